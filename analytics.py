@@ -0,0 +1,174 @@
+import streamlit as st
+import time
+import datetime
+import polars as pl
+from shared_cache import shared_cache
+from util import supabase_read_statement, fetch_user_roles
+
+
+def main():
+    st.set_page_config(
+        page_title="分析ダッシュボード",
+        page_icon="📊",
+        layout="wide",
+        initial_sidebar_state="expanded",
+    )
+    st.title("分析ダッシュボード")
+
+    # 認証されていない、またはセッション状態が存在しない場合
+    if "authenticated" not in st.session_state or not st.session_state.authenticated:
+        st.warning("ログインしてください。")
+        time.sleep(2)
+        st.switch_page("sign_in.py")
+        return
+
+    # 認証されている場合
+    user_email = st.session_state.get("user_email", "不明なユーザー")
+    user_roles_df = fetch_user_roles(email=user_email)
+
+    # ユーザー情報がない、または読み取り権限がない場合はアクセスを制限
+    if user_roles_df.is_empty() or not user_roles_df["can_read"][0]:
+        st.warning("このページにアクセスする権限がありません。")
+        return
+
+    st.caption("集計テーブルは電極・不具合データの登録・更新時に自動で更新されます。")
+
+    # 絞り込み条件
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        selected_items = st.multiselect(
+            "品目で絞り込み (未選択の場合はすべて)",
+            options=fetch_analytics_item_codes(),
+        )
+    with col2:
+        months = st.selectbox("表示期間 (月)", options=[3, 6, 12, 24], index=2)
+    items = tuple(selected_items)
+    date_from = first_day_of_month(months)
+
+    tab1, tab2, tab3 = st.tabs(["不具合件数 (月別)", "出荷数 (週別)", "未出荷数 (ギガ納期週別)"])
+
+    with tab1:
+        defect_df = fetch_defect_monthly(items, date_from)
+        if defect_df.is_empty():
+            st.info("表示対象の不具合データがありません。")
+        else:
+            # 月ごと・不具合状況ごとの件数 (品目は合算)
+            chart_df = defect_df.pivot(
+                on="不具合状況", index="月", values="件数", aggregate_function="sum"
+            ).sort("月")
+            st.bar_chart(chart_df, x="月", stack=True)
+            st.dataframe(
+                defect_df.pivot(
+                    on="不具合状況",
+                    index=["月", "品目"],
+                    values="件数",
+                    aggregate_function="sum",
+                ).fill_null(0),
+                width="stretch",
+                hide_index=True,
+            )
+
+    with tab2:
+        shipment_df = fetch_shipment_weekly(items, date_from)
+        if shipment_df.is_empty():
+            st.info("表示対象の出荷データがありません。")
+        else:
+            chart_df = shipment_df.pivot(
+                on="品目", index="週", values="出荷数", aggregate_function="sum"
+            ).sort("週")
+            st.bar_chart(chart_df, x="週", stack=True)
+            st.dataframe(shipment_df, width="stretch", hide_index=True)
+
+    with tab3:
+        backlog_df = fetch_open_backlog_weekly(items)
+        if backlog_df.is_empty():
+            st.info("未出荷の受注はありません。")
+        else:
+            this_week = datetime.date.today() - datetime.timedelta(
+                days=datetime.date.today().weekday()
+            )
+            overdue = backlog_df.filter(pl.col("ギガ納期週") < this_week)["未出荷数"].sum()
+            st.metric("未出荷数 (合計)", int(backlog_df["未出荷数"].sum()))
+            if overdue:
+                st.warning(f"ギガ納期が先週以前の未出荷が{overdue}件あります。")
+            chart_df = backlog_df.pivot(
+                on="品目", index="ギガ納期週", values="未出荷数", aggregate_function="sum"
+            ).sort("ギガ納期週")
+            st.bar_chart(chart_df, x="ギガ納期週", stack=True)
+            st.dataframe(backlog_df, width="stretch", hide_index=True)
+
+
+def first_day_of_month(months: int) -> datetime.date:
+    """
+    今月を含めて指定した月数だけ遡った月の初日を返す
+    Args:
+        months (int): 遡る月数
+    Returns:
+        datetime.date: 月の初日
+    """
+    today = datetime.date.today()
+    month_index = today.year * 12 + today.month - 1 - (months - 1)
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def fetch_analytics_item_codes() -> list[str]:
+    """集計テーブルに含まれる品目の一覧を取得する"""
+    item_df = _fetch_analytics_item_frame()
+    if item_df.is_empty():
+        return []
+    return item_df["品目"].to_list()
+
+
+@shared_cache(tables=("electrode_status", "defective_electrodes"), ttl=600)
+def _fetch_analytics_item_frame() -> pl.DataFrame:
+    return supabase_read_statement("analytics_items")
+
+
+@shared_cache(tables=("defective_electrodes",), ttl=300)
+def fetch_defect_monthly(items: tuple[str, ...], date_from: datetime.date) -> pl.DataFrame:
+    """
+    品目・月・不具合状況ごとの不具合件数を集計テーブルから取得する
+    Args:
+        items (tuple[str, ...]): 対象の品目 (空の場合はすべて)
+        date_from (datetime.date): 対象期間の開始日
+    Returns:
+        pl.DataFrame: 月, 品目, 不具合状況, 件数
+    """
+    return supabase_read_statement(
+        "analytics_defect_monthly",
+        parameters={"items": list(items), "date_from": date_from},
+    )
+
+
+@shared_cache(tables=("electrode_status",), ttl=300)
+def fetch_shipment_weekly(items: tuple[str, ...], date_from: datetime.date) -> pl.DataFrame:
+    """
+    品目・週ごとの出荷数を集計テーブルから取得する
+    Args:
+        items (tuple[str, ...]): 対象の品目 (空の場合はすべて)
+        date_from (datetime.date): 対象期間の開始日
+    Returns:
+        pl.DataFrame: 週, 品目, 出荷数
+    """
+    return supabase_read_statement(
+        "analytics_shipment_weekly",
+        parameters={"items": list(items), "date_from": date_from},
+    )
+
+
+@shared_cache(tables=("electrode_status",), ttl=300)
+def fetch_open_backlog_weekly(items: tuple[str, ...]) -> pl.DataFrame:
+    """
+    品目・ギガ納期の週ごとの未出荷数を集計テーブルから取得する
+    Args:
+        items (tuple[str, ...]): 対象の品目 (空の場合はすべて)
+    Returns:
+        pl.DataFrame: ギガ納期週, 品目, 未出荷数
+    """
+    return supabase_read_statement(
+        "analytics_open_backlog_weekly", parameters={"items": list(items)}
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+"""外部システム向けのJSON API
+
+Streamlitのアプリと同じホストで別のプロセスとして動かし、utilのデータ層(名前付きステートメント・共有キャッシュ)を使って
+溶射電極状況・最新の出荷データ・不具合履歴をJSONで返す。ブラウザのセッションは不要。
+
+認証:
+    Authorization: Bearer <トークン>   (python api.py create-token <メールアドレス> で発行する)
+    発行先のユーザーの user_roles.can_read が true の場合のみ読み取れる (migrations/006_api_tokens.sql)。
+
+エンドポイント (いずれもGET):
+    /v1/electrode-status?item=<品目>[&scope=hot|all][&offset=0][&limit=500]
+    /v1/shipments[?days=5][&scope=hot|all][&offset=0][&limit=500]
+    /v1/defects[?item=][&serial=][&date_from=YYYY-MM-DD][&date_to=YYYY-MM-DD][&cursor=][&limit=500]
+
+レスポンスは {"data": [行の配列], "next": 次のページのURL(最後のページの場合はnull)}。
+ETagは依存するテーブルのバージョン(shared_cache.tables_version)から作成するため、
+データが変わっていない場合はIf-None-Matchに対して304を返し、データベースに問い合わせない。
+
+起動方法:
+    python api.py serve
+    python api.py create-token <メールアドレス> [--name 用途]   # トークンを発行して一度だけ表示する
+    python api.py revoke-token <トークンのid>
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import polars as pl
+from sqlalchemy import exc
+
+import metrics
+from db_pool import QueryTimeoutError
+from shared_cache import shared_cache, tables_version
+from statements import SCOPE_SOURCES, scoped
+from util import read_sql, read_statement, supabase_execute_sql
+
+# 待ち受けるアドレスとポート
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8600"))
+# 1ページの既定の行数と最大の行数
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "500"))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "5000"))
+# トークンの確認結果をプロセス内で保持する秒数 (失効・権限の変更はこの秒数以内に反映される)
+API_AUTH_CACHE_SECONDS = float(os.getenv("API_AUTH_CACHE_SECONDS", "60"))
+# ETagを変える最大の間隔(秒)。共有キャッシュの有効期間(300秒)に合わせ、
+# アプリを経由しない書き込み(バージョンが更新されない)も、この秒数以内に反映されるようにする
+API_ETAG_MAX_AGE_SECONDS = float(os.getenv("API_ETAG_MAX_AGE_SECONDS", "300"))
+
+_AUTH_QUERY = """
+SELECT
+    u.email,
+    ur.can_read
+FROM
+    public.api_tokens t
+    INNER JOIN auth.users u ON u.id = t.user_id
+    INNER JOIN public.user_roles ur ON ur.id = t.user_id
+WHERE
+    t.token_hash = :token_hash
+    AND t.revoked_at IS NULL
+"""
+
+# トークンのハッシュ -> (確認した時刻, メールアドレス(無効なトークンはNone), can_read)
+_auth_cache: dict[str, tuple[float, str | None, bool]] = {}
+_auth_lock = threading.Lock()
+
+
+class ApiError(Exception):
+    """HTTPのエラーとして返す例外"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# --- 認証 ---
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def authenticate(authorization: str | None) -> str:
+    """
+    Authorizationヘッダーのトークンを確認する
+    Args:
+        authorization (str | None): Authorizationヘッダーの値
+    Returns:
+        str: トークンの発行先のメールアドレス
+    Raises:
+        ApiError: トークンがない・無効な場合(401)、読み取り権限がない場合(403)
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise ApiError(401, "Bearer token is required.")
+    token_hash = _hash_token(token.strip())
+
+    now = time.monotonic()
+    with _auth_lock:
+        cached = _auth_cache.get(token_hash)
+    if cached is None or now - cached[0] > API_AUTH_CACHE_SECONDS:
+        df = read_sql(_AUTH_QUERY, parameters={"token_hash": token_hash})
+        if df.is_empty():
+            cached = (now, None, False)
+        else:
+            cached = (now, df["email"][0], bool(df["can_read"][0]))
+        with _auth_lock:
+            # 無効なトークンを大量に送られても大きくならないようにする
+            if len(_auth_cache) >= 10000:
+                _auth_cache.clear()
+            _auth_cache[token_hash] = cached
+
+    _, email, can_read = cached
+    if email is None:
+        raise ApiError(401, "Invalid or revoked token.")
+    if not can_read:
+        raise ApiError(403, "The token owner does not have read permission.")
+    return email
+
+
+# --- データの取得 (結果は共有キャッシュに保存する) ---
+
+_ELECTRODE_STATUS_TABLES = (
+    "electrode_status",
+    "electrode_status_archive",
+    "defective_electrodes",
+)
+_SHIPMENT_TABLES = ("electrode_status", "electrode_status_archive")
+_DEFECT_TABLES = ("defective_electrodes", "user_roles")
+
+
+@shared_cache(tables=_ELECTRODE_STATUS_TABLES)
+def fetch_electrode_status(item_code: str, scope: str) -> pl.DataFrame:
+    """品目の溶射電極状況を、ページングのために一定の順序で返す"""
+    df = read_statement(
+        scoped("electrode_status_by_items", scope), parameters={"items": [item_code]}
+    )
+    if df.is_empty():
+        return df
+    return df.sort(["ギガ納期", "ギガ注番", "シリアル", "id"], nulls_last=True)
+
+
+@shared_cache(tables=_SHIPMENT_TABLES)
+def fetch_recent_shipments(days: int, scope: str) -> pl.DataFrame:
+    """最新の出荷実績日days日分の出荷データを返す"""
+    dates_df = read_statement(
+        scoped("recent_shipment_dates", scope), parameters={"limit": days}
+    )
+    if dates_df.is_empty():
+        return dates_df
+    return read_statement(
+        scoped("shipments_by_dates", scope),
+        parameters={"dates": dates_df["shiped_date"].to_list()},
+    )
+
+
+@shared_cache(tables=_DEFECT_TABLES)
+def fetch_defects(
+    item_code: str | None,
+    serial_num: str | None,
+    date_from: date | None,
+    date_to: date | None,
+    after_date: date | None,
+    after_id: int | None,
+    limit: int,
+) -> pl.DataFrame:
+    """不具合履歴の(不具合発生日, id)の降順で、カーソルの次からlimit件を返す"""
+    return read_statement(
+        "defect_history_page",
+        parameters={
+            "item_code": item_code,
+            "serial_num": serial_num,
+            "date_from": date_from,
+            "date_to": date_to,
+            "after_date": after_date,
+            "after_id": after_id,
+            "limit": limit,
+        },
+    )
+
+
+# --- パラメータ ---
+
+
+def _int_param(query: dict, name: str, default: int, minimum: int, maximum: int) -> int:
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be an integer.")
+    if not minimum <= number <= maximum:
+        raise ApiError(400, f"'{name}' must be between {minimum} and {maximum}.")
+    return number
+
+
+def _date_param(query: dict, name: str) -> date | None:
+    value = query.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be a date (YYYY-MM-DD).")
+
+
+def _scope_param(query: dict) -> str:
+    scope = query.get("scope", "hot")
+    if scope not in SCOPE_SOURCES:
+        raise ApiError(400, f"'scope' must be one of {', '.join(SCOPE_SOURCES)}.")
+    return scope
+
+
+def _limit_param(query: dict) -> int:
+    return _int_param(query, "limit", API_PAGE_SIZE, 1, API_MAX_PAGE_SIZE)
+
+
+# --- エンドポイント ---
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """APIのエンドポイント
+
+    parse: クエリパラメータを検証し、既定値を補った値を返す (ETagと次のページのURLに使う)
+    tables: 結果が依存するテーブル (ETagに使う)
+    fetch: 1ページ分のデータと、次のページのパラメータ(最後のページの場合はNone)を返す
+    """
+
+    parse: Callable[[dict], dict]
+    tables: Callable[[dict], tuple[str, ...]]
+    fetch: Callable[[dict], tuple[pl.DataFrame, dict | None]]
+
+
+def _offset_page(df: pl.DataFrame, params: dict) -> tuple[pl.DataFrame, dict | None]:
+    offset, limit = params["offset"], params["limit"]
+    next_params = None
+    if offset + limit < df.height:
+        next_params = {**params, "offset": offset + limit}
+    return df.slice(offset, limit), next_params
+
+
+def _parse_electrode_status(query: dict) -> dict:
+    item_code = query.get("item")
+    if not item_code:
+        raise ApiError(400, "'item' is required.")
+    return {
+        "item": item_code,
+        "scope": _scope_param(query),
+        "offset": _int_param(query, "offset", 0, 0, 10**9),
+        "limit": _limit_param(query),
+    }
+
+
+def _fetch_electrode_status(params: dict) -> tuple[pl.DataFrame, dict | None]:
+    return _offset_page(fetch_electrode_status(params["item"], params["scope"]), params)
+
+
+def _parse_shipments(query: dict) -> dict:
+    return {
+        "days": _int_param(query, "days", 5, 1, 60),
+        "scope": _scope_param(query),
+        "offset": _int_param(query, "offset", 0, 0, 10**9),
+        "limit": _limit_param(query),
+    }
+
+
+def _fetch_shipments(params: dict) -> tuple[pl.DataFrame, dict | None]:
+    return _offset_page(fetch_recent_shipments(params["days"], params["scope"]), params)
+
+
+def _parse_defects(query: dict) -> dict:
+    params = {
+        "item": query.get("item") or None,
+        "serial": query.get("serial") or None,
+        "date_from": _date_param(query, "date_from"),
+        "date_to": _date_param(query, "date_to"),
+        "cursor": query.get("cursor") or None,
+        "limit": _limit_param(query),
+    }
+    if params["cursor"]:
+        # カーソルは前のページの最後の行の「不具合発生日_id」
+        after_date, _, after_id = params["cursor"].partition("_")
+        try:
+            date.fromisoformat(after_date)
+            int(after_id)
+        except ValueError:
+            raise ApiError(400, "'cursor' is invalid.")
+    return params
+
+
+def _fetch_defects(params: dict) -> tuple[pl.DataFrame, dict | None]:
+    after_date = after_id = None
+    if params["cursor"]:
+        after_date_text, _, after_id_text = params["cursor"].partition("_")
+        after_date, after_id = date.fromisoformat(after_date_text), int(after_id_text)
+    # 次のページがあるかどうかを知るため、1件多く取得する
+    df = fetch_defects(
+        params["item"],
+        params["serial"],
+        params["date_from"],
+        params["date_to"],
+        after_date,
+        after_id,
+        params["limit"] + 1,
+    )
+    if df.height <= params["limit"]:
+        return df, None
+    df = df.head(params["limit"])
+    last = df.row(-1, named=True)
+    return df, {**params, "cursor": f"{last['不具合発生日']}_{last['id']}"}
+
+
+ENDPOINTS = {
+    "/v1/electrode-status": Endpoint(
+        _parse_electrode_status,
+        lambda params: _ELECTRODE_STATUS_TABLES,
+        _fetch_electrode_status,
+    ),
+    "/v1/shipments": Endpoint(
+        _parse_shipments, lambda params: _SHIPMENT_TABLES, _fetch_shipments
+    ),
+    "/v1/defects": Endpoint(_parse_defects, lambda params: _DEFECT_TABLES, _fetch_defects),
+}
+
+
+# --- ETag ---
+
+
+def _query_string(params: dict) -> str:
+    return urlencode(
+        sorted((k, str(v)) for k, v in params.items() if v is not None)
+    )
+
+
+def compute_etag(path: str, params: dict, tables: tuple[str, ...]) -> str:
+    """
+    リクエストとテーブルのバージョンから強いETagを作成する
+    いずれかのテーブルへの書き込み(shared_cache.bump_versions)、またはAPI_ETAG_MAX_AGE_SECONDSの経過で変わる。
+    """
+    bucket = int(time.time() // API_ETAG_MAX_AGE_SECONDS) if API_ETAG_MAX_AGE_SECONDS > 0 else 0
+    source = f"v1|{path}|{_query_string(params)}|{tables_version(tables)}|{bucket}"
+    return '"' + hashlib.sha256(source.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # If-None-Matchは弱い比較を行う (W/を付けて送り返すクライアントもあるため)
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+# --- HTTPサーバー ---
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    server_version = "ElectrodeAPI/1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        endpoint = ENDPOINTS.get(url.path)
+        status = 500
+        try:
+            if endpoint is None:
+                raise ApiError(404, "Not found.")
+            authenticate(self.headers.get("Authorization"))
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            params = endpoint.parse(query)
+            etag = compute_etag(url.path, params, endpoint.tables(params))
+            if _etag_matches(self.headers.get("If-None-Match"), etag):
+                status = 304
+                self._send(304, None, etag)
+                return
+            df, next_params = endpoint.fetch(params)
+            next_url = f"{url.path}?{_query_string(next_params)}" if next_params else None
+            body = '{"data":' + df.write_json() + ',"next":' + json.dumps(next_url) + "}"
+            status = 200
+            self._send(200, body.encode("utf-8"), etag)
+        except ApiError as e:
+            status = e.status
+            self._send_error(e.status, e.message)
+        except QueryTimeoutError:
+            status = 504
+            self._send_error(504, "The query took too long. Narrow down the request.")
+        except exc.SQLAlchemyError as e:
+            print(f"API database error on {url.path}: {e}")
+            status = 503
+            self._send_error(503, "Database error.")
+        finally:
+            metrics.count_api_request(url.path if endpoint else "unknown", status)
+
+    def _send(self, status: int, body: bytes | None, etag: str) -> None:
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        # キャッシュしてもよいが、使う前に必ずETagで確認させる
+        self.send_header("Cache-Control", "private, no-cache")
+        if body is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str) -> None:
+        body = json.dumps({"error": message}).encode("utf-8")
+        self.send_response(status)
+        if status == 401:
+            self.send_header("WWW-Authenticate", "Bearer")
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host: str = API_HOST, port: int = API_PORT) -> None:
+    """APIのHTTPサーバーを起動する(終了するまで戻らない)"""
+    # このプロセスのメトリクスも出力する (アプリと同じホストで動かす場合はMETRICS_PORTを変える)
+    metrics.start()
+    server = ThreadingHTTPServer((host, port), _ApiHandler)
+    server.daemon_threads = True
+    print(f"API listening on http://{host}:{port}/v1/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# --- トークンの発行・失効 ---
+
+
+def create_token(email: str, name: str) -> str | None:
+    """
+    ユーザーにトークンを発行する
+    Args:
+        email (str): 発行先のユーザーのメールアドレス
+        name (str): トークンの用途 (例: 顧客のシステム名)
+    Returns:
+        str | None: 発行したトークン(保存されないため、この時だけ取得できる)。ユーザーが存在しない場合はNone
+    """
+    token = secrets.token_urlsafe(32)
+    users_df = read_sql(
+        "SELECT id FROM auth.users WHERE email = :email", parameters={"email": email}
+    )
+    if users_df.is_empty():
+        return None
+    ok = supabase_execute_sql(
+        [
+            {
+                "sql": """
+INSERT INTO public.api_tokens (user_id, name, token_hash)
+VALUES (CAST(:user_id AS uuid), :name, :token_hash)
+""",
+                "params": {
+                    "user_id": str(users_df["id"][0]),
+                    "name": name,
+                    "token_hash": _hash_token(token),
+                },
+            }
+        ]
+    )
+    return token if ok else None
+
+
+def revoke_token(token_id: int) -> bool:
+    """トークンを失効させる (API_AUTH_CACHE_SECONDS以内に各プロセスで反映される)"""
+    return supabase_execute_sql(
+        [
+            {
+                "sql": "UPDATE public.api_tokens SET revoked_at = now() WHERE id = :id AND revoked_at IS NULL",
+                "params": {"id": token_id},
+            }
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="APIのHTTPサーバーを起動する")
+    serve_parser.add_argument("--host", default=API_HOST, help="待ち受けるアドレス")
+    serve_parser.add_argument("--port", type=int, default=API_PORT, help="待ち受けるポート")
+    create = subparsers.add_parser("create-token", help="トークンを発行する")
+    create.add_argument("email", help="発行先のユーザーのメールアドレス")
+    create.add_argument("--name", default="api", help="トークンの用途")
+    revoke = subparsers.add_parser("revoke-token", help="トークンを失効させる")
+    revoke.add_argument("id", type=int, help="api_tokensのid")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port)
+    elif args.command == "create-token":
+        token = create_token(args.email, args.name)
+        if token is None:
+            parser.error(f"Failed to create a token for {args.email}.")
+        print(token)
+    elif args.command == "revoke-token":
+        if not revoke_token(args.id):
+            parser.error(f"Failed to revoke token {args.id}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""起動時間(コールドスタート)のベンチマーク
+
+コンテナの起動直後と同じく、新しいPythonプロセスで次の時間を計測する。
+- ページ・モジュールごとのimportの時間と、その時点で読み込まれている重いライブラリ(pandas、Supabase SDKなど)
+- streamlit_app.pyで指定したページを最初に描画する(AppTestで1回実行する)までの時間
+  既定では、ログインしていない利用者が最初に開くサインインページを描画する
+  (溶射電極状況表示などは未ログインの場合、待ってからサインインページに移動するため対象にしない)
+
+データベースには接続しない(ウォームアップ・メトリクスのHTTPサーバー・通知メールの送信処理は無効にして実行する)。
+--outputを指定すると結果を1行のJSONとして追記し、前回の結果との差を表示するので、変更ごとの推移を追える。
+
+使い方:
+    python coldstart.py [--runs 5] [--pages sign_in.py] [--output coldstart.jsonl]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# importの時間を計測するモジュール (streamlit_app.pyが読み込むモジュールと各ページ)
+IMPORT_TARGETS = [
+    "util",
+    "main_contents",
+    "recent_shipments",
+    "defective_electrode_registration",
+    "update_syukka_status",
+    "order_management_linde",
+    "analytics",
+    "sign_in",
+    "change_username",
+    "password_reset",
+    "sign_out",
+]
+# 最初の描画の時間を計測するページ
+RENDER_PAGES = ["sign_in.py"]
+# 読み込まれているかどうかを記録するライブラリ
+HEAVY_MODULES = ["polars", "pandas", "pyarrow", "sqlalchemy", "supabase", "smtplib"]
+
+# 子プロセスで実行するコード。計測結果をJSONで標準出力の最終行に出力する
+_IMPORT_CODE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "modules": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+_RENDER_CODE = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("streamlit_app.py", default_timeout=120)
+at.switch_page({page!r})
+at.run()
+seconds = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": seconds,
+    "modules": [m for m in {heavy!r} if m in sys.modules],
+    "exception": [e.message for e in at.exception],
+}}))
+"""
+
+
+def _run_child(code: str) -> tuple[dict, float]:
+    env = dict(os.environ, WARMUP_ENABLED="0", METRICS_PORT="0", MAILER_ENABLED="0")
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    return json.loads(completed.stdout.strip().splitlines()[-1]), wall
+
+
+def measure(code: str, runs: int) -> dict:
+    """
+    codeを新しいプロセスでruns回実行し、所要時間をまとめる
+    Returns:
+        dict: 中央値・最小値(秒)、プロセスの起動を含む時間の中央値(秒)、読み込まれたライブラリなど
+    """
+    samples = []
+    walls = []
+    result = {}
+    for _ in range(runs):
+        result, wall = _run_child(code)
+        samples.append(result["seconds"])
+        walls.append(wall)
+    summary = {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "wall_median": statistics.median(walls),
+        "modules": result["modules"],
+    }
+    if result.get("exception"):
+        summary["exception"] = result["exception"]
+    return summary
+
+
+def run_benchmark(
+    runs: int = 5,
+    targets: list[str] = IMPORT_TARGETS,
+    pages: list[str] = RENDER_PAGES,
+) -> dict:
+    """
+    importと最初の描画の時間を計測する
+    Args:
+        runs (int, optional): 計測ごとの実行回数
+        targets (list[str], optional): importの時間を計測するモジュール
+        pages (list[str], optional): 最初の描画の時間を計測するページ
+    Returns:
+        dict: 計測名("import:<module>"、"first_render:<page>") -> 計測結果
+    """
+    results = {}
+    for module in targets:
+        try:
+            results[f"import:{module}"] = measure(
+                _IMPORT_CODE.format(module=module, heavy=HEAVY_MODULES), runs
+            )
+        except RuntimeError as e:
+            print(f"Failed to import {module}: {e}")
+    for page in pages:
+        results[f"first_render:{page}"] = measure(
+            _RENDER_CODE.format(page=page, heavy=HEAVY_MODULES), runs
+        )
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load_previous(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+
+def print_summary(results: dict, previous: dict | None = None) -> None:
+    """計測結果を表形式で出力する (前回の結果がある場合は中央値の差も出力する)"""
+    previous_results = (previous or {}).get("results", {})
+    print(f"{'name':<42} {'median':>8} {'min':>8} {'wall':>8} {'diff':>8}  modules")
+    for name, summary in results.items():
+        diff = ""
+        if name in previous_results:
+            diff = f"{(summary['median'] - previous_results[name]['median']) * 1000:+.0f}ms"
+        print(
+            f"{name:<42} {summary['median'] * 1000:>6.0f}ms {summary['min'] * 1000:>6.0f}ms "
+            f"{summary['wall_median'] * 1000:>6.0f}ms {diff:>8}  {','.join(summary['modules'])}"
+        )
+        for message in summary.get("exception", []):
+            print(f"    exception: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="計測ごとの実行回数")
+    parser.add_argument(
+        "--modules",
+        help="importの時間を計測するモジュール (カンマ区切り。省略時はすべてのページ)",
+    )
+    parser.add_argument(
+        "--pages",
+        help="最初の描画の時間を計測するページ (カンマ区切り。省略時はsign_in.py)",
+    )
+    parser.add_argument("--output", help="結果を1行のJSONとして追記するファイル")
+    args = parser.parse_args()
+
+    targets = args.modules.split(",") if args.modules else IMPORT_TARGETS
+    pages = args.pages.split(",") if args.pages else RENDER_PAGES
+    results = run_benchmark(args.runs, targets, pages)
+    previous = _load_previous(args.output) if args.output else None
+    print_summary(results, previous)
+
+    if args.output:
+        record = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "runs": args.runs,
+            "results": results,
+        }
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
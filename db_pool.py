@@ -0,0 +1,407 @@
+import os
+import threading
+import time
+import weakref
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.engine import Connection, Engine
+
+# クエリの種類ごとのstatement_timeout(秒)の既定値。0は無制限
+# .envのPOSTGRE_STATEMENT_TIMEOUT_<種類(大文字)>で上書きできる。
+#   interactive: 画面表示のための通常の読み取り(接続の既定値)
+#   heavy: 複数品目の一覧など、件数の多い読み取り
+#   background: 先読み・ウォームアップ・スナップショットの作成
+#   write: supabase_execute_sqlのトランザクション内の書き込み
+DEFAULT_STATEMENT_TIMEOUTS = {
+    "interactive": 15.0,
+    "heavy": 60.0,
+    "background": 30.0,
+    "write": 30.0,
+}
+# サーバー側でクエリがキャンセルされたときのSQLSTATE (query_canceled)
+_QUERY_CANCELED = "57014"
+
+# エンジンごとの計測オブジェクト
+_engine_metrics: "weakref.WeakKeyDictionary[Engine, PoolMetrics]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """コネクションプールの設定値
+
+    .envの以下のキーで上書きできる。
+        POSTGRE_POOL_SIZE: 常時保持する接続数
+        POSTGRE_MAX_OVERFLOW: pool_sizeを超えて一時的に作成できる接続数
+        POSTGRE_POOL_RECYCLE: 接続を作り直すまでの秒数
+        POSTGRE_POOL_TIMEOUT: 空き接続を待つ最大秒数
+        POSTGRE_LIVENESS_INTERVAL: バックグラウンドで接続の死活確認を行う間隔(秒)。0で無効
+        POSTGRE_PREPARE_THRESHOLD: psycopgドライバでサーバー側のプリペアを行うまでの実行回数
+        POSTGRE_POOL_MIN: 起動時のウォームアップで事前に開いておく接続数
+    """
+
+    pool_size: int = 10
+    max_overflow: int = 10
+    pool_recycle: int = 1800
+    pool_timeout: float = 10.0
+    liveness_interval: float = 60.0
+    prepare_threshold: int = 5
+    pool_min: int = 2
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        default = cls()
+        return cls(
+            pool_size=int(os.getenv("POSTGRE_POOL_SIZE", default.pool_size)),
+            max_overflow=int(os.getenv("POSTGRE_MAX_OVERFLOW", default.max_overflow)),
+            pool_recycle=int(os.getenv("POSTGRE_POOL_RECYCLE", default.pool_recycle)),
+            pool_timeout=float(
+                os.getenv("POSTGRE_POOL_TIMEOUT", default.pool_timeout)
+            ),
+            liveness_interval=float(
+                os.getenv("POSTGRE_LIVENESS_INTERVAL", default.liveness_interval)
+            ),
+            prepare_threshold=int(
+                os.getenv("POSTGRE_PREPARE_THRESHOLD", default.prepare_threshold)
+            ),
+            pool_min=int(os.getenv("POSTGRE_POOL_MIN", default.pool_min)),
+        )
+
+
+class QueryInterruptedError(Exception):
+    """クエリがサーバー側で中断された"""
+
+
+class QueryTimeoutError(QueryInterruptedError):
+    """statement_timeoutを超えたためクエリが中断された"""
+
+
+class QueryCancelledError(QueryInterruptedError):
+    """後続のリクエストに置き換えられたためクエリをキャンセルした"""
+
+
+def statement_timeouts_from_env() -> dict[str, float]:
+    """クエリの種類ごとのstatement_timeout(秒)を返す"""
+    return {
+        query_class: float(
+            os.getenv(f"POSTGRE_STATEMENT_TIMEOUT_{query_class.upper()}", default)
+        )
+        for query_class, default in DEFAULT_STATEMENT_TIMEOUTS.items()
+    }
+
+
+class PoolMetrics:
+    """コネクションプールの計測値を保持する
+
+    SQLAlchemyのプールイベントから更新され、スレッドセーフに読み出せる。
+    """
+
+    def __init__(self, settings: PoolSettings):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._connect_started = threading.local()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.checkout_timeouts = 0
+        self.connects = 0
+        self.connect_seconds_total = 0.0
+        self.connect_seconds_max = 0.0
+        self.invalidations = 0
+        self.liveness_checks = 0
+        self.liveness_failures = 0
+
+    def record_checkout(self, waited: float, had_to_wait: bool) -> None:
+        with self._lock:
+            self.checkouts += 1
+            if had_to_wait:
+                self.waits += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def record_checkout_timeout(self, waited: float) -> None:
+        with self._lock:
+            self.checkout_timeouts += 1
+            self.waits += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def record_connect(self, elapsed: float) -> None:
+        with self._lock:
+            self.connects += 1
+            self.connect_seconds_total += elapsed
+            self.connect_seconds_max = max(self.connect_seconds_max, elapsed)
+
+    def record_invalidation(self) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+    def record_liveness(self, ok: bool) -> None:
+        with self._lock:
+            self.liveness_checks += 1
+            if not ok:
+                self.liveness_failures += 1
+
+    def snapshot(self, engine: Engine) -> dict:
+        """現在のプール状態と累積計測値を辞書で返す"""
+        pool = engine.pool
+        with self._lock:
+            return {
+                "pool_size": self.settings.pool_size,
+                "max_overflow": self.settings.max_overflow,
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "checkout_timeouts": self.checkout_timeouts,
+                "connects": self.connects,
+                "connect_seconds_total": self.connect_seconds_total,
+                "connect_seconds_avg": (
+                    self.connect_seconds_total / self.connects if self.connects else 0.0
+                ),
+                "connect_seconds_max": self.connect_seconds_max,
+                "invalidations": self.invalidations,
+                "liveness_checks": self.liveness_checks,
+                "liveness_failures": self.liveness_failures,
+            }
+
+
+def create_pooled_engine(conn_string: str, settings: PoolSettings) -> Engine:
+    """プール設定と計測イベントを組み込んだエンジンを作成する
+
+    pool_pre_pingはチェックアウト毎に1往復増えるため使用せず、
+    start_liveness_checkerによる定期的な死活確認で代替する。
+    """
+    connect_args = {}
+    if conn_string.startswith("postgresql+psycopg://"):
+        # psycopg(v3)は同じSQLをprepare_threshold回実行するとサーバー側でプリペアする
+        connect_args["prepare_threshold"] = settings.prepare_threshold
+    engine = create_engine(
+        conn_string,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_recycle=settings.pool_recycle,
+        pool_timeout=settings.pool_timeout,
+        connect_args=connect_args,
+    )
+    metrics = PoolMetrics(settings)
+    _engine_metrics[engine] = metrics
+
+    # 新規接続(TLSハンドシェイクを含む)にかかった時間を計測する
+    @event.listens_for(engine, "do_connect")
+    def _on_do_connect(dialect, conn_rec, cargs, cparams):
+        metrics._connect_started.value = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        started = getattr(metrics._connect_started, "value", None)
+        if started is not None:
+            metrics.record_connect(time.perf_counter() - started)
+            metrics._connect_started.value = None
+
+    if engine.dialect.name == "postgresql":
+        default_timeout_ms = int(statement_timeouts_from_env()["interactive"] * 1000)
+
+        # 接続の既定のstatement_timeoutを設定する(通常の読み取りでは追加の往復が不要になる)
+        @event.listens_for(engine, "connect")
+        def _on_connect_set_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET statement_timeout = {default_timeout_ms}")
+            cursor.close()
+            # 暗黙のトランザクションがロールバックされると設定が戻るため確定する
+            dbapi_connection.commit()
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.record_invalidation()
+
+    if settings.liveness_interval > 0:
+        start_liveness_checker(engine, settings.liveness_interval)
+    return engine
+
+
+def get_pool_metrics(engine: Engine) -> PoolMetrics | None:
+    """create_pooled_engineで作成したエンジンの計測オブジェクトを返す"""
+    return _engine_metrics.get(engine)
+
+
+@contextmanager
+def checkout(engine: Engine) -> Iterator[Connection]:
+    """プールから接続を取得し、待ち時間を計測する
+
+    取得時点でプールが上限(pool_size + max_overflow)に達していた場合を「待ち」として数える。
+    """
+    metrics = get_pool_metrics(engine)
+    if metrics is None:
+        with engine.connect() as connection:
+            yield connection
+        return
+
+    pool = engine.pool
+    saturated = pool.checkedin() == 0 and pool.checkedout() >= (
+        metrics.settings.pool_size + metrics.settings.max_overflow
+    )
+    started = time.perf_counter()
+    try:
+        connection = engine.connect()
+    except exc.TimeoutError:
+        metrics.record_checkout_timeout(time.perf_counter() - started)
+        raise
+    metrics.record_checkout(time.perf_counter() - started, saturated)
+    with connection:
+        yield connection
+
+
+def open_connections(engine: Engine, count: int) -> int:
+    """
+    接続を同時にcount個開いてプールに戻し、以降のリクエストで新規接続を不要にする
+    Args:
+        engine (Engine): 対象のエンジン
+        count (int): 開く接続数 (pool_sizeを上限とする)
+    Returns:
+        int: プールで待機中の接続数
+    """
+    metrics = get_pool_metrics(engine)
+    if metrics is not None:
+        count = min(count, metrics.settings.pool_size)
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+    return engine.pool.checkedin()
+
+
+def apply_statement_timeout(connection: Connection, query_class: str) -> None:
+    """
+    現在のトランザクションのstatement_timeoutをクエリの種類に合わせて設定する
+    接続の既定値(interactive)と同じ場合は何もしない。
+    Args:
+        connection (Connection): トランザクション中の接続
+        query_class (str): クエリの種類 (DEFAULT_STATEMENT_TIMEOUTSのキー)
+    """
+    if connection.dialect.name != "postgresql":
+        return
+    timeouts = statement_timeouts_from_env()
+    timeout = timeouts[query_class]
+    if timeout == timeouts["interactive"]:
+        return
+    # SETはバインド変数を使えないため、set_configでトランザクション内に限定して設定する
+    connection.execute(
+        text("SELECT set_config('statement_timeout', :timeout, true)"),
+        {"timeout": str(int(timeout * 1000))},
+    )
+
+
+class QueryCanceller:
+    """実行中のクエリを監視し、キャンセル条件を満たしたらサーバー側でキャンセルする
+
+    キャンセル要求はDBAPIの接続のcancel()で送信する(psycopg2/psycopgはスレッドセーフ)。
+    監視は1つのデーモンスレッドでinterval秒ごとに行う。
+    """
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._watched: dict[int, tuple[Callable[[], bool], object, dict]] = {}
+        self._thread: threading.Thread | None = None
+        self.cancelled = 0
+
+    @contextmanager
+    def watch(
+        self, connection: Connection, should_cancel: Callable[[], bool] | None
+    ) -> Iterator[None]:
+        """
+        ブロック内のクエリを監視し、キャンセルまたはタイムアウトした場合は
+        QueryCancelledError / QueryTimeoutErrorに変換して送出する
+        Args:
+            connection (Connection): クエリを実行する接続
+            should_cancel (Callable[[], bool] | None): Trueを返したらキャンセルする。Noneの場合は監視しない
+        """
+        dbapi_connection = connection.connection.dbapi_connection
+        state = {"cancelled": False}
+        token = id(state)
+        if should_cancel is not None and hasattr(dbapi_connection, "cancel"):
+            with self._lock:
+                self._watched[token] = (should_cancel, dbapi_connection, state)
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="db-query-canceller", daemon=True
+                    )
+                    self._thread.start()
+        try:
+            yield
+        except exc.DBAPIError as e:
+            sqlstate = getattr(e.orig, "pgcode", None) or getattr(e.orig, "sqlstate", None)
+            if sqlstate != _QUERY_CANCELED:
+                raise
+            if state["cancelled"]:
+                raise QueryCancelledError("The query was superseded and cancelled.") from e
+            raise QueryTimeoutError("The query exceeded statement_timeout.") from e
+        finally:
+            with self._lock:
+                self._watched.pop(token, None)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            for token, (should_cancel, dbapi_connection, state) in watched:
+                try:
+                    if not should_cancel():
+                        continue
+                    with self._lock:
+                        # 監視が終了した(接続がプールに戻った)後はキャンセルしない
+                        if self._watched.pop(token, None) is None:
+                            continue
+                        state["cancelled"] = True
+                        self.cancelled += 1
+                        dbapi_connection.cancel()
+                except Exception as e:
+                    print(f"Failed to cancel a running query: {e}")
+
+
+query_canceller = QueryCanceller()
+
+
+def start_liveness_checker(engine: Engine, interval: float) -> threading.Thread:
+    """プール内の待機中の接続を定期的にpingするデーモンスレッドを開始する
+
+    切断済みの接続は実行時エラーでSQLAlchemyにより無効化されるため、
+    利用者のリクエストが死んだ接続を掴むことを防げる。
+    """
+    metrics = get_pool_metrics(engine)
+
+    def _run():
+        while True:
+            time.sleep(interval)
+            # QueuePoolはFIFOのため、待機中の接続数だけ取得・返却を繰り返すと
+            # それぞれの接続を一度ずつ確認できる
+            for _ in range(engine.pool.checkedin()):
+                ok = True
+                try:
+                    with engine.connect() as connection:
+                        connection.execute(text("SELECT 1"))
+                except exc.SQLAlchemyError:
+                    ok = False
+                if metrics is not None:
+                    metrics.record_liveness(ok)
+                if not ok:
+                    break
+
+    thread = threading.Thread(target=_run, name="db-pool-liveness", daemon=True)
+    thread.start()
+    return thread
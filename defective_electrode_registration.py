@@ -1,90 +1,409 @@
 import streamlit as st
 import time
+import io
+import functools
 import polars as pl
-from util import fetch_user_roles, supabase_read_sql, supabase_execute_sql
+import metrics
+import prefetch
+import snapshot
+from sqlalchemy import exc
+from db_pool import QueryInterruptedError
+from shared_cache import shared_cache, tracking_reads
+from util import (
+    fetch_user_roles,
+    supabase_read_sql,
+    supabase_read_statement,
+    supabase_execute_sql,
+    read_statement,
+)
 from datetime import datetime
 
 
 def fetch_unique_item_codes() -> list[str]:
     """
-    electrode_statusテーブルからユニークな品目コードのリストを取得する
+    electrode_status(アーカイブを含む)からユニークな品目コードのリストを取得する
     """
-    query = "SELECT DISTINCT item_code FROM public.electrode_status ORDER BY item_code"
-    df = supabase_read_sql(query)
+    df = _fetch_unique_item_frame()
     if df.is_empty():
         return []
     return df["item_code"].to_list()
 
 
-def fetch_defective_electrodes(limit: int | None = 100) -> pl.DataFrame:
+@shared_cache(tables=("electrode_status", "electrode_status_archive"), ttl=600)
+def _fetch_unique_item_frame() -> pl.DataFrame:
+    query = "SELECT DISTINCT item_code FROM public.electrode_status_all ORDER BY item_code"
+    return supabase_read_sql(query)
+
+
+def _defect_filter_params(filters: dict) -> dict:
+    """不具合履歴の絞り込み条件をステートメントのパラメータに変換する(未指定はNone)"""
+    serial_num = filters.get("serial_num")
+    return {
+        "item_code": filters.get("item_code"),
+        "serial_num": str(serial_num) if serial_num is not None else None,
+        "date_from": filters.get("date_from"),
+        "date_to": filters.get("date_to"),
+    }
+
+
+def fetch_defect_history_page(
+    filters: dict, cursor: tuple[str, int] | None, page_size: int
+) -> tuple[pl.DataFrame, bool]:
     """
-    defective_electrodesテーブルから全データを取得する
+    不具合履歴を(不具合発生日, id)の降順で1ページ分取得する
+    Args:
+        filters (dict): 絞り込み条件 (item_code, serial_num, date_from, date_to)
+        cursor (tuple[str, int] | None): 前のページの最終行の(不具合発生日, id)。先頭ページはNone
+        page_size (int): 1ページの件数
+    Returns:
+        tuple[pl.DataFrame, bool]: 1ページ分のデータと、次のページがあるかどうか
     """
-    query = """
-    SELECT
-        de.id
-        , de.item_code AS "品目"
-        , de.serial_num AS "シリアル"
-        , de.defect_date AS "不具合発生日"
-        , de.defect_status AS "不具合状況"
-        , de.defect_description AS "不具合内容"
-        , de.linde_remarks AS "リンデ備考"
-        , CASE 
-            WHEN de.updated_by != '' THEN ur_update.user_name
-            ELSE ur_create.user_name
-        END AS "登録者"
-        , CASE 
-            WHEN de.updated_at > de.created_at THEN de.updated_at 
-            ELSE de.created_at 
-        END AS "最終更新日時" -- UTC
-    FROM
-        public.defective_electrodes de
-    LEFT JOIN public.user_roles ur_create ON de.created_by = ur_create.email
-    LEFT JOIN public.user_roles ur_update ON de.updated_by = ur_update.email
-    ORDER BY
-        de.defect_date DESC,
-        COALESCE(de.updated_at, de.created_at) DESC
+    parameters = _defect_history_page_params(filters, cursor, page_size)
+    # スナップショットモードで有効なスナップショットがあればSQLを実行しない
+    df = snapshot.fetch_defect_history_page(parameters)
+    if df is None:
+        df = _query_defect_history_page(parameters)
+    return df.head(page_size), df.height > page_size
+
+
+def _defect_history_page_params(
+    filters: dict, cursor: tuple[str, int] | None, page_size: int
+) -> dict:
+    return _defect_filter_params(filters) | {
+        "after_date": cursor[0] if cursor else None,
+        "after_id": cursor[1] if cursor else None,
+        # 次のページの有無を判定するため1件多く取得する
+        "limit": page_size + 1,
+    }
+
+
+@shared_cache(tables=("defective_electrodes", "user_roles"), ttl=120)
+def _query_defect_history_page(parameters: dict) -> pl.DataFrame:
+    return supabase_read_statement("defect_history_page", parameters=parameters)
+
+
+def warm_defect_history_page(
+    filters: dict, cursor: tuple[str, int], page_size: int
+) -> None:
     """
-    query += f" LIMIT {limit}" if limit is not None else ""
-    df = supabase_read_sql(query)
+    不具合履歴の次のページを共有キャッシュに読み込む(先読み用)
+    セッションの外で実行されるため、エラー時は例外を送出するread_statementを使用する。
+    """
+    parameters = _defect_history_page_params(filters, cursor, page_size)
+    key = _query_defect_history_page.cache_key(parameters)
+    if _query_defect_history_page.lookup(key) is not None:
+        return
+    with tracking_reads() as sources:
+        df = read_statement(
+            "defect_history_page", parameters=parameters, query_class="background"
+        )
+    _query_defect_history_page.store(key, df, sources)
 
-    # データフレームが空の場合は、後続の処理を行わずにそのまま返す
-    if df.is_empty():
-        return df
-
-    # 最終更新日時列のタイムゾーン変換とフォーマットを行う式を定義
-    # データベースから取得した時点ではUTCのタイムゾーン情報を持っている想定
-    datetime_format_expr = (
-        pl.col("最終更新日時")
-        .dt.convert_time_zone("Asia/Tokyo")  # 日本時間に変換
-        .dt.strftime("%Y-%m-%d %H:%M:%S")  # 文字列にフォーマット
+
+def fetch_defect_item_counts(filters: dict) -> pl.DataFrame:
+    """
+    品目以外の絞り込み条件に一致する不具合履歴の件数を品目ごとに取得する
+    Args:
+        filters (dict): 絞り込み条件 (serial_num, date_from, date_to)
+    Returns:
+        pl.DataFrame: 品目と件数のデータフレーム
+    """
+    parameters = _defect_filter_params(filters | {"item_code": None})
+    df = snapshot.fetch_defect_item_counts(parameters)
+    if df is None:
+        df = supabase_read_statement("defect_item_counts", parameters=parameters)
+    return df
+
+
+def _defect_history_cursors(filter_key: str) -> list:
+    """現在の絞り込み条件でのページのカーソル一覧を返す(条件が変わったら先頭ページに戻す)"""
+    state = st.session_state.get("defect_history_pages")
+    if state is None or state["filter_key"] != filter_key:
+        state = {"filter_key": filter_key, "cursors": [None]}
+        st.session_state["defect_history_pages"] = state
+    return state["cursors"]
+
+
+DEFECT_CSV_COLUMNS = [
+    "品目",
+    "シリアル",
+    "不具合発生日",
+    "不具合状況",
+    "不具合内容",
+    "リンデ備考",
+]
+DEFECT_STATUSES = ["判定中", "廃棄"]
+
+
+def read_defect_csv(csvfile) -> pl.DataFrame:
+    """一括登録用のCSVファイル(CP932)を全列文字列として読み込む"""
+    content = csvfile.getvalue().decode("cp932")
+    return pl.read_csv(io.StringIO(content), infer_schema=False)
+
+
+def lookup_defect_serials(item_codes: list[str], serial_nums: list[str]) -> pl.DataFrame:
+    """
+    (品目, シリアル)の組み合わせが不具合登録済みか、電極状況表に存在するかを1回のクエリで確認する
+    Args:
+        item_codes (list[str]): 品目コードのリスト
+        serial_nums (list[str]): シリアルのリスト (item_codesと同じ順序)
+    Returns:
+        pl.DataFrame: 品目、シリアル、不具合登録済、電極登録済のデータフレーム (該当がない場合は空)
+    Raises:
+        exc.SQLAlchemyError, QueryInterruptedError: 確認できなかった場合
+            (空の結果と区別するため、supabase_read_statementは使わない)
+    """
+    # 他のユーザーが直前に登録したシリアルを見落とさないように、プライマリで確認する
+    return read_statement(
+        "defect_serial_lookup",
+        parameters={"item_codes": item_codes, "serial_nums": serial_nums},
+        primary=True,
     )
 
-    # もし最終更新日時列が文字列型(String)なら、先にDatetime型に変換する
-    if df.schema["最終更新日時"] == pl.String:
-        datetime_format_expr = (
-            pl.col("最終更新日時")
-            .str.to_datetime()
-            .pipe(lambda series: datetime_format_expr)
-        )
 
-    # 不具合発生日列のフォーマットを行う式を定義
-    defect_date_format_expr = pl.col("不具合発生日").dt.strftime("%Y-%m-%d")
+def validate_defect_rows(input_df: pl.DataFrame) -> pl.DataFrame:
+    """
+    一括登録する不具合データを正規化し、行ごとのエラー内容を「エラー」列に設定する
+    Args:
+        input_df (pl.DataFrame): DEFECT_CSV_COLUMNSの列を持つデータフレーム
+    Returns:
+        pl.DataFrame: 正規化したデータと「エラー」「警告」列 (問題がない行はnull)
+    Raises:
+        ValueError: 必須列がない場合
+        exc.SQLAlchemyError, QueryInterruptedError: 登録済みのシリアルを確認できなかった場合
+    """
+    missing = [col for col in DEFECT_CSV_COLUMNS if col not in input_df.columns]
+    if missing:
+        raise ValueError(f"必須列 {missing} が含まれていません。")
 
-    # もし不具合発生日列が文字列型(String)なら、先にDatetime型に変換する
-    # `strptime` を使用して、日付のみの文字列 "YYYY-MM-DD" をパースする
-    if df.schema["不具合発生日"] == pl.String:
-        defect_date_format_expr = (
+    df = (
+        input_df.select(
+            [pl.col(col).cast(pl.String).str.strip_chars() for col in DEFECT_CSV_COLUMNS]
+        )
+        # 空行は無視する
+        .filter(~pl.all_horizontal(pl.all().is_null() | (pl.all() == "")))
+        .with_columns(
+            # シリアルは単票の登録と同じく整数を文字列にした形で保存する
+            pl.col("シリアル").cast(pl.Int64, strict=False).alias("_serial_int"),
+            pl.col("不具合発生日").alias("_raw_date"),
             pl.col("不具合発生日")
-            .str.strptime(pl.Date, "%Y-%m-%d")
-            .dt.strftime("%Y-%m-%d")
+            .str.replace_all("/", "-")
+            .str.to_date("%Y-%m-%d", strict=False)
+            .alias("_defect_date"),
+            pl.col("不具合状況").fill_null("判定中"),
+            pl.col("リンデ備考").fill_null(""),
+        )
+    )
+    if df.is_empty():
+        return df.with_columns(
+            pl.lit(None, dtype=pl.String).alias("エラー"),
+            pl.lit(None, dtype=pl.String).alias("警告"),
         )
 
     df = df.with_columns(
-        defect_date_format_expr.alias("不具合発生日"),  # 定義した式を適用
-        datetime_format_expr.alias("最終更新日時"),  # 定義した式を適用
+        pl.col("_serial_int").cast(pl.String).alias("シリアル"),
+        pl.col("_defect_date").fill_null(datetime.now().date()).alias("不具合発生日"),
     )
-    return df
+
+    # 登録済みの確認は1回のクエリで行う (確認できなかった場合は例外を送出し、登録させない)
+    lookup_df = lookup_defect_serials(
+        df["品目"].fill_null("").to_list(), df["シリアル"].fill_null("").to_list()
+    )
+    if lookup_df.is_empty():
+        # 該当するシリアルがない場合
+        lookup_df = pl.DataFrame(
+            schema={
+                "品目": pl.String,
+                "シリアル": pl.String,
+                "不具合登録済": pl.Boolean,
+                "電極登録済": pl.Boolean,
+            }
+        )
+    df = df.join(
+        lookup_df.unique(subset=["品目", "シリアル"]),
+        on=["品目", "シリアル"],
+        how="left",
+    )
+
+    errors = [
+        pl.when(pl.col("品目").is_null() | (pl.col("品目") == "")).then(
+            pl.lit("品目が未入力")
+        ),
+        pl.when(pl.col("_serial_int").is_null() | (pl.col("_serial_int") < 1)).then(
+            pl.lit("シリアルが不正")
+        ),
+        pl.when(
+            pl.col("_defect_date").is_null()
+            & pl.col("_raw_date").is_not_null()
+            & (pl.col("_raw_date") != "")
+        ).then(pl.lit("不具合発生日が不正")),
+        pl.when(~pl.col("不具合状況").is_in(DEFECT_STATUSES)).then(
+            pl.lit("不具合状況は判定中または廃棄")
+        ),
+        pl.when(pl.col("不具合内容").is_null() | (pl.col("不具合内容") == "")).then(
+            pl.lit("不具合内容が未入力")
+        ),
+        pl.when(pl.struct("品目", "シリアル").is_duplicated()).then(
+            pl.lit("ファイル内で重複")
+        ),
+        pl.when(pl.col("不具合登録済").fill_null(False)).then(
+            pl.lit("不具合登録済みのシリアル")
+        ),
+    ]
+    return df.with_columns(
+        pl.concat_str(errors, separator=" / ", ignore_nulls=True).alias("エラー"),
+        pl.when(~pl.col("電極登録済").fill_null(False))
+        .then(pl.lit("電極状況表に存在しないシリアル"))
+        .alias("警告"),
+    ).with_columns(
+        pl.when(pl.col("エラー") != "").then(pl.col("エラー")).alias("エラー"),
+    ).drop("_serial_int", "_raw_date", "_defect_date", "不具合登録済", "電極登録済")
+
+
+def register_defects(valid_df: pl.DataFrame, user_email: str) -> bool:
+    """検証済みの不具合データを1つのINSERT文で登録する"""
+    query = {
+        "sql": """
+            INSERT INTO public.defective_electrodes
+            (item_code, serial_num, defect_date, defect_status, defect_description, linde_remarks, created_by)
+            SELECT item_code, serial_num, defect_date, defect_status, defect_description, linde_remarks, :created_by
+            FROM unnest(
+                CAST(:item_codes AS text[]),
+                CAST(:serial_nums AS text[]),
+                CAST(:defect_dates AS date[]),
+                CAST(:defect_statuses AS text[]),
+                CAST(:defect_descriptions AS text[]),
+                CAST(:linde_remarks AS text[])
+            ) AS t(item_code, serial_num, defect_date, defect_status, defect_description, linde_remarks)
+        """,
+        "params": {
+            "item_codes": valid_df["品目"].to_list(),
+            "serial_nums": valid_df["シリアル"].to_list(),
+            "defect_dates": valid_df["不具合発生日"].to_list(),
+            "defect_statuses": valid_df["不具合状況"].to_list(),
+            "defect_descriptions": valid_df["不具合内容"].to_list(),
+            "linde_remarks": valid_df["リンデ備考"].to_list(),
+            "created_by": user_email,
+        },
+    }
+    started = time.perf_counter()
+    success = supabase_execute_sql([query])
+    metrics.record_upload(
+        "defect_bulk", time.perf_counter() - started, valid_df.height, success
+    )
+    return success
+
+
+def render_bulk_defect_form(user_email: str):
+    """不具合の一括登録フォームをレンダリングする"""
+    st.subheader("一括登録")
+    st.info(
+        "CSVファイルのアップロード、または下の表への入力で複数の不具合をまとめて登録します。  \n"
+        "- 不具合発生日が空欄の場合は本日、不具合状況が空欄の場合は判定中として登録します。"
+    )
+    sample_csv = (
+        ",".join(DEFECT_CSV_COLUMNS)
+        + "\nITEM001,101,2024-07-15,判定中,溶射面の剥離,\nITEM001,102,2024-07-15,廃棄,割れ,\n"
+    )
+    st.download_button(
+        "サンプルCSVダウンロード",
+        data=sample_csv.encode("cp932"),
+        file_name="sample_defect_format.csv",
+        mime="text/csv",
+    )
+
+    csvfile = st.file_uploader(
+        "CSVファイルをアップロードしてください (CP932)",
+        type=["csv"],
+        key="defect_csv_file",
+    )
+    try:
+        if csvfile is not None:
+            input_df = read_defect_csv(csvfile)
+        else:
+            input_df = st.data_editor(
+                pl.DataFrame(schema={col: pl.String for col in DEFECT_CSV_COLUMNS}),
+                num_rows="dynamic",
+                key="defect_bulk_editor",
+                width="stretch",
+                column_config={
+                    "不具合状況": st.column_config.SelectboxColumn(
+                        options=DEFECT_STATUSES
+                    ),
+                },
+            )
+        checked_df = validate_defect_rows(input_df)
+    except (exc.SQLAlchemyError, QueryInterruptedError) as e:
+        st.error(
+            f"登録済みのシリアルを確認できなかったため、登録できません。しばらくしてから再度お試しください: {e}"
+        )
+        return
+    except UnicodeDecodeError as e:
+        st.error(
+            f"CSVファイルのエンコードに問題があります。Shift-JISまたはCP932形式のファイルをアップロードしてください: {e}"
+        )
+        return
+    except Exception as e:
+        st.error(f"入力データの読み込み中にエラーが発生しました: {e}")
+        return
+
+    if checked_df.is_empty():
+        return
+
+    error_df = checked_df.filter(pl.col("エラー").is_not_null())
+    valid_df = checked_df.filter(pl.col("エラー").is_null())
+    st.dataframe(checked_df, width="stretch", hide_index=True)
+    if not error_df.is_empty():
+        st.warning(f"{error_df.height}件のエラーがある行は登録されません。")
+    warning_count = valid_df.filter(pl.col("警告").is_not_null()).height
+    if warning_count:
+        st.info(f"{warning_count}件は電極状況表に存在しないシリアルです。")
+
+    if not valid_df.is_empty() and st.button(
+        f"{valid_df.height}件を登録する", type="primary", key="defect_bulk_submit"
+    ):
+        with st.spinner("データベースに登録しています..."):
+            success = register_defects(valid_df, user_email)
+        if success:
+            st.success(f"{valid_df.height}件の不具合情報を正常に登録しました。")
+        else:
+            st.error("データベースへの登録中にエラーが発生しました。")
+
+
+def render_bulk_status_change(
+    selected_df: pl.DataFrame, user_email: str, selection_key: str
+):
+    """選択した複数行のうち判定中のものを、1つのUPDATE文で廃棄に変更する"""
+    pending_ids = selected_df.filter(pl.col("不具合状況") == "判定中")["id"].to_list()
+    st.divider()
+    st.markdown(
+        f"##### 選択中: {selected_df.height} 件 (うち判定中 {len(pending_ids)} 件)"
+    )
+    if not pending_ids:
+        return
+    if st.button(
+        f"判定中の {len(pending_ids)} 件を廃棄に変更する",
+        type="primary",
+        key="defect_bulk_discard",
+    ):
+        update_query = {
+            "sql": """
+                UPDATE public.defective_electrodes
+                SET defect_status = '廃棄',
+                    updated_at = NOW(),
+                    updated_by = :updated_by
+                WHERE id = ANY(:ids) AND defect_status = '判定中'
+            """,
+            "params": {"ids": pending_ids, "updated_by": user_email},
+        }
+        if supabase_execute_sql([update_query]):
+            st.success(f"{len(pending_ids)} 件を廃棄に変更しました。")
+            # 選択を解除して画面を再読み込みする
+            st.session_state.pop(selection_key, None)
+            time.sleep(1)
+            st.rerun()
+        else:
+            st.error("状況の変更に失敗しました。")
 
 
 def main():
@@ -132,76 +451,85 @@ def main():
         tab1 = None  # tab1は使わない
     # --- Tab1: 不具合登録 ---
     with tab1:
-        st.subheader("新規登録フォーム")
-        # 品目リストを取得
-        existing_items = fetch_unique_item_codes()
-
-        # 品目入力（既存リストからの選択と新規入力）
-        item_selection_method = st.radio(
-            "品目選択方法",
-            ["既存の品目から選択", "新しい品目を入力"],
+        registration_mode = st.radio(
+            "登録方法",
+            ["1件ずつ登録", "一括登録 (CSV・複数行)"],
             horizontal=True,
-            key="new_item_method",
+            key="defect_registration_mode",
         )
+        if registration_mode == "一括登録 (CSV・複数行)":
+            render_bulk_defect_form(user_email)
+        else:
+            st.subheader("新規登録フォーム")
+            # 品目リストを取得
+            existing_items = fetch_unique_item_codes()
+
+            # 品目入力（既存リストからの選択と新規入力）
+            item_selection_method = st.radio(
+                "品目選択方法",
+                ["既存の品目から選択", "新しい品目を入力"],
+                horizontal=True,
+                key="new_item_method",
+            )
 
-        with st.form(key="defect_form", clear_on_submit=True):
-            st.write("不具合情報を入力してください。")
-
-            if item_selection_method == "既存の品目から選択":
-                item_code = st.selectbox(
-                    "品目",
-                    options=existing_items,
-                    index=None,
-                    placeholder="品目を選択してください",
-                )
-            else:
-                item_code = st.text_input("新しい品目名")
+            with st.form(key="defect_form", clear_on_submit=True):
+                st.write("不具合情報を入力してください。")
 
-            serial_num = st.number_input(
-                "シリアル", min_value=1, step=1, value=None, format="%d"
-            )
-            defect_date = st.date_input("不具合発生日", value=datetime.now())
-            defect_status = st.radio("不具合状況", ["判定中", "廃棄"], horizontal=True)
-            defect_description = st.text_area("不具合内容")
-            linde_remarks = st.text_area(
-                "リンデ備考", help="この項目は主に協力企業（リンデ）が使用します。"
-            )
+                if item_selection_method == "既存の品目から選択":
+                    item_code = st.selectbox(
+                        "品目",
+                        options=existing_items,
+                        index=None,
+                        placeholder="品目を選択してください",
+                    )
+                else:
+                    item_code = st.text_input("新しい品目名")
 
-            submit_button = st.form_submit_button("登録する", type="primary")
+                serial_num = st.number_input(
+                    "シリアル", min_value=1, step=1, value=None, format="%d"
+                )
+                defect_date = st.date_input("不具合発生日", value=datetime.now())
+                defect_status = st.radio("不具合状況", ["判定中", "廃棄"], horizontal=True)
+                defect_description = st.text_area("不具合内容")
+                linde_remarks = st.text_area(
+                    "リンデ備考", help="この項目は主に協力企業（リンデ）が使用します。"
+                )
 
-        # --- フォーム送信処理 ---
-        if submit_button:
-            # バリデーション
-            if not all([item_code, serial_num, defect_description]):
-                st.error("すべての項目を入力してください。")
-            else:
-                try:
-                    # 登録クエリの作成
-                    query = {
-                        "sql": """
-                            INSERT INTO public.defective_electrodes 
-                            (item_code, serial_num, defect_date, defect_status, defect_description, linde_remarks, created_by)
-                            VALUES (:item_code, :serial_num, :defect_date, :defect_status, :defect_description, :linde_remarks, :created_by)
-                        """,
-                        "params": {
-                            "item_code": item_code.strip(),
-                            "serial_num": str(serial_num),
-                            "defect_date": defect_date,
-                            "defect_status": defect_status,
-                            "defect_description": defect_description.strip(),
-                            "linde_remarks": linde_remarks.strip(),
-                            "created_by": user_email,
-                        },
-                    }
+                submit_button = st.form_submit_button("登録する", type="primary")
+
+            # --- フォーム送信処理 ---
+            if submit_button:
+                # バリデーション
+                if not all([item_code, serial_num, defect_description]):
+                    st.error("すべての項目を入力してください。")
+                else:
+                    try:
+                        # 登録クエリの作成
+                        query = {
+                            "sql": """
+                                INSERT INTO public.defective_electrodes 
+                                (item_code, serial_num, defect_date, defect_status, defect_description, linde_remarks, created_by)
+                                VALUES (:item_code, :serial_num, :defect_date, :defect_status, :defect_description, :linde_remarks, :created_by)
+                            """,
+                            "params": {
+                                "item_code": item_code.strip(),
+                                "serial_num": str(serial_num),
+                                "defect_date": defect_date,
+                                "defect_status": defect_status,
+                                "defect_description": defect_description.strip(),
+                                "linde_remarks": linde_remarks.strip(),
+                                "created_by": user_email,
+                            },
+                        }
 
-                    # SQL実行
-                    if supabase_execute_sql([query]):
-                        st.success("不具合情報を正常に登録しました。")
-                    else:
-                        st.error("データベースへの登録中にエラーが発生しました。")
+                        # SQL実行
+                        if supabase_execute_sql([query]):
+                            st.success("不具合情報を正常に登録しました。")
+                        else:
+                            st.error("データベースへの登録中にエラーが発生しました。")
 
-                except Exception as e:
-                    st.error(f"登録処理中に予期せぬエラーが発生しました: {e}")
+                    except Exception as e:
+                        st.error(f"登録処理中に予期せぬエラーが発生しました: {e}")
 
     # --- Tab2: 履歴の表示・修正 ---
     with tab2:
@@ -212,10 +540,11 @@ def main():
         with st.expander("フィルターと表示設定", expanded=True):
             c1, c2 = st.columns(2)
             with c1:
-                show_all = st.toggle(
-                    "全件表示（デフォルトは最新100件）",
-                    value=False,
-                    key="show_all_toggle",
+                page_size = st.selectbox(
+                    "1ページの表示件数",
+                    options=[50, 100, 200],
+                    index=1,
+                    key="defect_page_size",
                 )
 
             # 品目以外のフィルターを先に定義
@@ -235,65 +564,117 @@ def main():
                 )
                 filter_defect_date_to = st.date_input("不具合発生日 (To)", value=None)
 
-        # データ取得
-        limit = None if show_all else 100
-        defects_df = fetch_defective_electrodes(limit=limit)
+        filters = {
+            "serial_num": filter_serial_num,
+            "date_from": filter_defect_date_from,
+            "date_to": filter_defect_date_to,
+        }
+
+        # --- selectbox用の品目リストを作成 ---
+        # 品目以外の条件に一致する件数から作成する(表示中のページに依存しない)
+        item_counts_df = fetch_defect_item_counts(filters)
 
-        if defects_df.is_empty():
-            st.info("登録されている不具合情報はありません。")
+        if item_counts_df.is_empty():
+            st.info("条件に一致する不具合情報はありません。")
         else:
-            # --- selectbox用の品目リストを作成 ---
-            # "すべて" を先頭に追加
-            item_code_options = ["すべて"] + sorted(
-                defects_df["品目"].unique().to_list()
+            item_counts = dict(
+                zip(item_counts_df["品目"].to_list(), item_counts_df["件数"].to_list())
             )
+            total_count = sum(item_counts.values())
+            # "すべて" を先頭に追加
+            item_code_options = ["すべて"] + list(item_counts)
             # プレースホルダーにselectboxを配置
             with col1_placeholder:
                 filter_item_code = st.selectbox(
-                    "品目で絞り込み", options=item_code_options, index=0
+                    "品目で絞り込み",
+                    options=item_code_options,
+                    index=0,
+                    format_func=lambda item: (
+                        f"すべて ({total_count}件)"
+                        if item == "すべて"
+                        else f"{item} ({item_counts[item]}件)"
+                    ),
                 )
-
-            # --- フィルター適用 ---
-            filtered_df = defects_df
             if filter_item_code and filter_item_code != "すべて":
-                filtered_df = filtered_df.filter(pl.col("品目") == filter_item_code)
-            if filter_serial_num:
-                filtered_df = filtered_df.filter(
-                    pl.col("シリアル").cast(pl.Int64) == filter_serial_num
-                )
-            if filter_defect_date_from:
-                filtered_df = filtered_df.filter(
-                    pl.col("不具合発生日").str.to_date("%Y-%m-%d")
-                    >= filter_defect_date_from
+                filters["item_code"] = filter_item_code
+                matched_count = item_counts[filter_item_code]
+            else:
+                matched_count = total_count
+
+            # --- ページ単位でデータ取得 ---
+            cursors = _defect_history_cursors(
+                repr(sorted(filters.items())) + f"|{page_size}"
+            )
+            filtered_df, has_next = fetch_defect_history_page(
+                filters, cursors[-1], page_size
+            )
+            page_no = len(cursors)
+
+            nav_prev, nav_info, nav_next = st.columns([1, 3, 1])
+            with nav_prev:
+                if st.button("◀ 前へ", disabled=page_no == 1, key="defect_prev"):
+                    cursors.pop()
+                    st.rerun()
+            with nav_info:
+                st.caption(
+                    f"{matched_count} 件中 {(page_no - 1) * page_size + 1} - "
+                    f"{(page_no - 1) * page_size + filtered_df.height} 件目 "
+                    f"({page_no} ページ)"
                 )
-            if filter_defect_date_to:
-                filtered_df = filtered_df.filter(
-                    pl.col("不具合発生日").str.to_date("%Y-%m-%d")
-                    <= filter_defect_date_to
+            with nav_next:
+                if st.button("次へ ▶", disabled=not has_next, key="defect_next"):
+                    last_row = filtered_df.row(-1, named=True)
+                    cursors.append((last_row["不具合発生日"], last_row["id"]))
+                    st.rerun()
+            if has_next:
+                # 次のページを先読みしておく
+                last_row = filtered_df.row(-1, named=True)
+                prefetch.schedule(
+                    [
+                        functools.partial(
+                            warm_defect_history_page,
+                            dict(filters),
+                            (last_row["不具合発生日"], last_row["id"]),
+                            page_size,
+                        )
+                    ]
                 )
 
             # データフレーム表示
             if can_write:
-                st.info("修正したい行を選択してください。")
+                st.info(
+                    "修正したい行を選択してください。複数行を選択すると、判定中の電極をまとめて廃棄に変更できます。"
+                )
             else:
-                st.info(f"{len(filtered_df)} 件のデータが表示されています。")
+                st.info(f"{matched_count} 件のデータが該当します。")
 
             # on_select="rerun"で、行選択時にアプリを再実行させる
-            # selection_mode="single-row"で単一行選択を有効にする
+            # selection_mode="multi-row"で複数行選択を有効にする
+            # ページごとにキーを分け、別のページの行選択が残らないようにする
+            defects_df_key = f"defects_df_{page_no}"
             st.dataframe(
                 filtered_df,
-                key="defects_df",
+                key=defects_df_key,
                 on_select="rerun",
-                selection_mode="single-row",
+                selection_mode="multi-row" if can_write else "single-row",
                 hide_index=True,
             )
 
             # 選択された行の情報を取得
-            selection = st.session_state.get("defects_df")
+            selection = st.session_state.get(defects_df_key)
+            selected_rows = (
+                selection["selection"]["rows"] if selection is not None else []
+            )
+
+            # 書き込み権限がある場合のみ、複数行の状況変更を表示
+            if can_write and selected_rows:
+                render_bulk_status_change(
+                    filtered_df[selected_rows], user_email, defects_df_key
+                )
 
-            # 書き込み権限がある場合のみ、編集・削除フォームを表示
-            if can_write and selection and selection["selection"]["rows"]:
-                selected_row_index = selection["selection"]["rows"][0]
+            # 書き込み権限があり、1行のみ選択されている場合に編集・削除フォームを表示
+            if can_write and len(selected_rows) == 1:
+                selected_row_index = selected_rows[0]
                 selected_record = filtered_df.row(selected_row_index, named=True)
 
                 st.divider()
@@ -0,0 +1,510 @@
+"""AppTestを使用した同時接続の負荷試験
+
+実際のページのスクリプト(main_contents.pyなど)をstreamlit.testingのAppTestでヘッドレスに実行し、
+ログイン済みのセッションを持つN人の利用者が、品目の選択や絞り込みなどの操作を同時に繰り返す。
+1つのプロセス(=1つのワーカー)で、何人の同時利用者を処理できるかを見積もるために使用する。
+
+- 利用者ごとに、ページごとのセッション(AppTest)を作成し、試験の間使い続ける。
+- 操作は読み取りのみで、データベースへの書き込みは行わない。
+- コネクションプールと共有キャッシュは、実際のサーバーと同じくプロセス内で共有される。
+
+結果として、スループット(再実行/秒)、再実行の所要時間のp50/p95/p99(ページ・操作ごと)、
+コネクションプールの使用状況(使用中の接続数の最大値、待ち回数、タイムアウト)を出力する。
+
+使い方 (.envのPOSTGRE_*にローカルのPostgreSQLを指定する):
+    python loadtest.py seed [--items 20] [--orders 2000]       # 試験用のデータを作成する
+    python loadtest.py run [--users 10] [--duration 60] [--pages main_contents,recent_shipments]
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+from urllib import parse
+
+from sqlalchemy import text
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import (
+    MemoryCacheStorageManager,
+)
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.pages_manager import PagesManager
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+from streamlit.testing.v1.util import patch_config_options
+
+# 試験に使用する利用者のメールアドレス (seedでauth.usersとuser_rolesに作成する)
+LOADTEST_EMAIL = os.getenv("LOADTEST_EMAIL", "loadtest@example.com")
+# 試験用のデータの品目コードの接頭辞 (seedはこの接頭辞のデータを削除してから作成する)
+LOADTEST_ITEM_PREFIX = "LT-"
+# 1回の再実行の上限(秒)
+LOADTEST_RUN_TIMEOUT = float(os.getenv("LOADTEST_RUN_TIMEOUT", "60"))
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+class ConcurrentAppTest(AppTest):
+    """複数のスレッドから同時に実行できるAppTest
+
+    AppTest.runは実行のたびにRuntimeのインスタンスと設定をプロセス全体で差し替えて元に戻すため、
+    同時に実行すると他の実行の途中で戻されてしまう。このクラスでは差し替えを行わず、
+    shared_test_runtime()で試験の間だけまとめて設定する。
+    """
+
+    def _run(self, widget_state=None, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        pages_manager = PagesManager(self._script_path, ScriptCache(), setup_watcher=False)
+        script_runner = LocalScriptRunner(
+            self._script_path,
+            self.session_state,
+            pages_manager,
+            args=self.args,
+            kwargs=self.kwargs,
+        )
+        self._tree = script_runner.run(
+            widget_state, self.query_params, timeout, self._page_hash
+        )
+        self._tree._runner = self
+        query_string = script_runner.event_data[-1]["client_state"].query_string
+        self.query_params = parse.parse_qs(query_string)
+        return self
+
+
+@contextmanager
+def shared_test_runtime() -> Iterator[None]:
+    """ConcurrentAppTestの実行に必要なRuntimeと設定を、試験の間だけ設定する"""
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    saved_runtime = Runtime._instance
+    Runtime._instance = runtime
+    # セッションの外でsession_stateを設定した際の警告を抑制する
+    logging.getLogger(
+        "streamlit.runtime.scriptrunner_utils.script_run_context"
+    ).setLevel(logging.ERROR)
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        Runtime._instance = saved_runtime
+
+
+# --- 操作のシナリオ ---
+# 各シナリオはウィジェットを操作してから操作名をyieldする。yieldのたびにスクリプトを再実行して計測する。
+
+
+def _select_random(widget, rng: random.Random) -> bool:
+    options = [option for option in widget.options if option]
+    if not options:
+        return False
+    widget.select(rng.choice(options))
+    return True
+
+
+def _main_contents_steps(at: AppTest, rng: random.Random) -> Iterator[str]:
+    yield "open"
+    at.toggle(key="multi_item").set_value(False)
+    yield "single_item"
+    if not _select_random(at.selectbox(key="item_code"), rng):
+        return
+    yield "select_item"
+    at.toggle(key="sort_mode").set_value(rng.random() < 0.5)
+    yield "sort"
+    at.selectbox(key="status_page_size").select(rng.choice([100, 200, 500]))
+    yield "page_size"
+    if rng.random() < 0.3:
+        at.toggle(key="multi_item").set_value(True)
+        yield "multi_item"
+        options = at.multiselect(key="item_codes").options
+        at.multiselect(key="item_codes").set_value(
+            rng.sample(options, min(len(options), rng.randint(2, 4)))
+        )
+        yield "select_items"
+
+
+def _recent_shipments_steps(at: AppTest, rng: random.Random) -> Iterator[str]:
+    yield "open"
+    at.selectbox[0].select(rng.choice([5, 10, 20]))
+    yield "limit"
+    if len(at.selectbox) < 2:
+        return
+    _select_random(at.selectbox[1], rng)
+    yield "select_date"
+    at.text_input(key="search_item").set_value(LOADTEST_ITEM_PREFIX)
+    yield "search_item"
+    at.text_input(key="search_item").set_value("")
+
+
+def _defective_electrode_steps(at: AppTest, rng: random.Random) -> Iterator[str]:
+    yield "open"
+    at.selectbox(key="defect_page_size").select(rng.choice([50, 100, 200]))
+    yield "page_size"
+    item_filters = [s for s in at.selectbox if s.label == "品目で絞り込み"]
+    if item_filters and _select_random(item_filters[0], rng):
+        yield "select_item"
+    next_buttons = [b for b in at.button if b.key == "defect_next" and not b.disabled]
+    if next_buttons:
+        next_buttons[0].click()
+        yield "next_page"
+
+
+def _order_management_steps(at: AppTest, rng: random.Random) -> Iterator[str]:
+    yield "open"
+    at.radio(key="order_management_active_tab").set_value("受注編集・削除")
+    yield "edit_tab"
+    search_items = [s for s in at.selectbox if s.label == "品目で検索"]
+    if search_items and _select_random(search_items[0], rng):
+        yield "search_item"
+
+
+SCENARIOS: dict[str, Callable[[AppTest, random.Random], Iterator[str]]] = {
+    "main_contents": _main_contents_steps,
+    "recent_shipments": _recent_shipments_steps,
+    "defective_electrode_registration": _defective_electrode_steps,
+    "order_management_linde": _order_management_steps,
+}
+
+
+# --- 計測 ---
+
+
+class LoadTestResult:
+    """再実行の所要時間とコネクションプールの使用状況を集計する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: list[tuple[str, str, float]] = []
+        self.errors: dict[str, int] = {}
+        self.pool_samples: list[dict] = []
+
+    def record(self, page: str, step: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.append((page, step, seconds))
+
+    def record_error(self, page: str, step: str, message: str) -> None:
+        key = f"{page}.{step}: {message[:120]}"
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def record_pool(self, metrics: dict) -> None:
+        if metrics:
+            with self._lock:
+                self.pool_samples.append(metrics)
+
+    def summary(self, elapsed: float, users: int) -> dict:
+        groups: dict[str, list[float]] = {"all": []}
+        for page, step, seconds in self.samples:
+            groups["all"].append(seconds)
+            groups.setdefault(page, []).append(seconds)
+            groups.setdefault(f"{page}.{step}", []).append(seconds)
+        return {
+            "users": users,
+            "elapsed_seconds": round(elapsed, 2),
+            "reruns": len(self.samples),
+            "throughput_per_second": round(len(self.samples) / elapsed, 2) if elapsed else 0.0,
+            "errors": sum(self.errors.values()),
+            "error_details": self.errors,
+            "latency": {name: _latency_summary(values) for name, values in groups.items()},
+            "pool": _pool_summary(self.pool_samples),
+        }
+
+
+def _latency_summary(values: list[float]) -> dict:
+    if len(values) < 2:
+        value = round(values[0], 3) if values else None
+        return {"count": len(values), "p50": value, "p95": value, "p99": value}
+    quantiles = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        "count": len(values),
+        "p50": round(quantiles[49], 3),
+        "p95": round(quantiles[94], 3),
+        "p99": round(quantiles[98], 3),
+    }
+
+
+def _pool_summary(samples: list[dict]) -> dict:
+    if not samples:
+        return {}
+    first, last = samples[0], samples[-1]
+    capacity = last["pool_size"] + last["max_overflow"]
+    checked_out = [sample["checked_out"] for sample in samples]
+    return {
+        "capacity": capacity,
+        "checked_out_max": max(checked_out),
+        "checked_out_avg": round(sum(checked_out) / len(checked_out), 2),
+        # 全ての接続が使用中だった時間の割合 (サンプリングによる近似)
+        "saturated_ratio": round(
+            sum(1 for count in checked_out if count >= capacity) / len(checked_out), 3
+        ),
+        "waits": last["waits"] - first["waits"],
+        "wait_seconds_max": round(last["wait_seconds_max"], 3),
+        "checkout_timeouts": last["checkout_timeouts"] - first["checkout_timeouts"],
+        "connects": last["connects"] - first["connects"],
+    }
+
+
+# --- 実行 ---
+
+
+def _new_session(page: str, user_no: int) -> AppTest:
+    at = ConcurrentAppTest(
+        os.path.join(_BASE_DIR, f"{page}.py"), default_timeout=LOADTEST_RUN_TIMEOUT
+    )
+    at.session_state["authenticated"] = True
+    at.session_state["user_email"] = LOADTEST_EMAIL
+    at.session_state["loadtest_user"] = user_no
+    return at
+
+
+def _simulate_user(
+    user_no: int,
+    pages: list[str],
+    deadline: float,
+    think_time: float,
+    result: LoadTestResult,
+    seed: int,
+) -> None:
+    rng = random.Random(seed + user_no)
+    sessions: dict[str, AppTest] = {}
+    while time.monotonic() < deadline:
+        page = rng.choice(pages)
+        at = sessions.setdefault(page, _new_session(page, user_no))
+        step = "setup"
+        try:
+            for step in SCENARIOS[page](at, rng):
+                if time.monotonic() >= deadline:
+                    return
+                started = time.perf_counter()
+                at.run()
+                result.record(page, step, time.perf_counter() - started)
+                if at.exception:
+                    result.record_error(page, step, str(at.exception[0].value))
+                    break
+                if at.error:
+                    result.record_error(page, step, str(at.error[0].value))
+                time.sleep(think_time * rng.uniform(0.5, 1.5))
+        except Exception as e:
+            # ウィジェットが見つからない場合など。セッションを作り直して続ける
+            result.record_error(page, step, f"{type(e).__name__}: {e}")
+            sessions.pop(page, None)
+
+
+def _monitor_pool(stop: threading.Event, result: LoadTestResult, interval: float) -> None:
+    from util import fetch_pool_metrics
+
+    while not stop.is_set():
+        result.record_pool(fetch_pool_metrics())
+        stop.wait(interval)
+    result.record_pool(fetch_pool_metrics())
+
+
+def run_load_test(
+    users: int,
+    duration: float,
+    pages: list[str],
+    think_time: float = 1.0,
+    ramp_up: float = 5.0,
+    seed: int = 0,
+) -> dict:
+    """
+    同時利用者の負荷試験を実行し、結果の集計を返す
+    Args:
+        users (int): 同時に操作する利用者の数
+        duration (float): 試験の時間(秒)
+        pages (list[str]): 操作するページ (SCENARIOSのキー)
+        think_time (float, optional): 操作の間隔の平均(秒)
+        ramp_up (float, optional): 全ての利用者が操作を開始するまでの時間(秒)
+        seed (int, optional): 操作を選ぶ乱数のシード
+    Returns:
+        dict: スループット、再実行の所要時間、コネクションプールの使用状況
+    """
+    result = LoadTestResult()
+    stop = threading.Event()
+    with shared_test_runtime():
+        monitor = threading.Thread(
+            target=_monitor_pool, args=(stop, result, 0.5), name="loadtest-pool", daemon=True
+        )
+        monitor.start()
+        started = time.monotonic()
+        deadline = started + duration
+        threads = []
+        for user_no in range(users):
+            thread = threading.Thread(
+                target=_simulate_user,
+                args=(user_no, pages, deadline, think_time, result, seed),
+                name=f"loadtest-user-{user_no}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+            time.sleep(ramp_up / users)
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        stop.set()
+        monitor.join()
+    return result.summary(elapsed, users)
+
+
+def print_summary(summary: dict) -> None:
+    """集計結果を表として出力する"""
+    print(
+        f"users={summary['users']} elapsed={summary['elapsed_seconds']}s "
+        f"reruns={summary['reruns']} throughput={summary['throughput_per_second']}/s "
+        f"errors={summary['errors']}"
+    )
+    print(f"{'scenario':<52}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, latency in summary["latency"].items():
+        print(
+            f"{name:<52}{latency['count']:>7}"
+            + "".join(
+                f"{latency[key]:>9.3f}" if latency[key] is not None else f"{'-':>9}"
+                for key in ("p50", "p95", "p99")
+            )
+        )
+    if summary["pool"]:
+        print("pool: " + ", ".join(f"{k}={v}" for k, v in summary["pool"].items()))
+    for message, count in summary["error_details"].items():
+        print(f"error x{count}: {message}")
+
+
+# --- 試験用のデータ ---
+
+
+def seed_database(items: int, orders: int, max_qty: int = 5) -> None:
+    """
+    ローカルのPostgreSQLに試験用の利用者・受注・不具合のデータを作成する
+    品目コードがLOADTEST_ITEM_PREFIXで始まるデータは削除してから作成する。
+    Args:
+        items (int): 品目の数
+        orders (int): 受注(ギガ注番)の数
+        max_qty (int, optional): 1受注の最大の受注数
+    """
+    from db_pool import checkout
+    from shared_cache import bump_versions
+    from util import conn_str, get_db_engine, postgre_host
+
+    if postgre_host not in _LOCAL_HOSTS:
+        raise SystemExit(
+            f"Refusing to seed non-local database host '{postgre_host}'. "
+            "Point POSTGRE_HOST at a local PostgreSQL."
+        )
+    params = {
+        "email": LOADTEST_EMAIL,
+        "prefix": LOADTEST_ITEM_PREFIX,
+        "items": items,
+        "orders": orders,
+        "max_qty": max_qty,
+    }
+    statements = [
+        # ログイン済みとして扱う利用者 (全ページを操作できる権限)
+        """
+        INSERT INTO auth.users (id, email, email_confirmed_at, last_sign_in_at, created_at)
+        SELECT gen_random_uuid(), :email, now(), now(), now()
+        WHERE NOT EXISTS (SELECT 1 FROM auth.users WHERE email = :email)
+        """,
+        """
+        INSERT INTO public.user_roles (id, email, user_name, role, can_read, can_write)
+        SELECT id, email, 'loadtest', 'admin', true, true
+        FROM auth.users WHERE email = :email
+        ON CONFLICT (id) DO UPDATE
+        SET role = 'admin', can_read = true, can_write = true
+        """,
+        "DELETE FROM public.defective_electrodes WHERE item_code LIKE :prefix || '%'",
+        "DELETE FROM public.electrode_status WHERE item_code LIKE :prefix || '%'",
+        # 受注の1/3は出荷済み(最近90日)、残りは未出荷
+        """
+        INSERT INTO public.electrode_status
+            (giga_order_num, item_code, giga_due_date, edaban, linde_order_num,
+             status, shiped_date, sirial_num)
+        SELECT
+            'LT' || lpad(o::text, 7, '0'),
+            :prefix || lpad((o % :items)::text, 3, '0'),
+            current_date + (o % 120) - 60,
+            e,
+            'LLT' || o,
+            CASE WHEN o % 3 = 0 THEN 'OK' END,
+            CASE WHEN o % 3 = 0 THEN current_date - (o % 90) END,
+            CASE WHEN o % 3 = 0 THEN o * 10 + e END
+        FROM generate_series(1, :orders) AS o
+        CROSS JOIN LATERAL generate_series(1, 1 + o % :max_qty) AS e
+        """,
+        """
+        INSERT INTO public.defective_electrodes
+            (item_code, serial_num, defect_date, defect_status, defect_description, created_by)
+        SELECT
+            :prefix || lpad((o % :items)::text, 3, '0'),
+            (900000 + o)::text,
+            current_date - (o % 365),
+            CASE WHEN o % 2 = 0 THEN '判定中' ELSE '廃棄' END,
+            'loadtest',
+            :email
+        FROM generate_series(1, GREATEST(:orders / 10, 1)) AS o
+        """,
+    ]
+    engine = get_db_engine(conn_str)
+    with checkout(engine) as connection:
+        with connection.begin():
+            for sql in statements:
+                connection.execute(text(sql), params)
+    bump_versions(["electrode_status", "defective_electrodes", "user_roles"])
+    print(f"Seeded {orders} orders for {items} items and user {LOADTEST_EMAIL}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed = subparsers.add_parser("seed", help="ローカルのPostgreSQLに試験用のデータを作成する")
+    seed.add_argument("--items", type=int, default=20, help="品目の数")
+    seed.add_argument("--orders", type=int, default=2000, help="受注(ギガ注番)の数")
+
+    run = subparsers.add_parser("run", help="負荷試験を実行する")
+    run.add_argument("--users", type=int, default=10, help="同時に操作する利用者の数")
+    run.add_argument("--duration", type=float, default=60, help="試験の時間(秒)")
+    run.add_argument(
+        "--pages",
+        default=",".join(SCENARIOS),
+        help="操作するページ (カンマ区切り)",
+    )
+    run.add_argument("--think-time", type=float, default=1.0, help="操作の間隔の平均(秒)")
+    run.add_argument("--ramp-up", type=float, default=5.0, help="全員が操作を開始するまでの時間(秒)")
+    run.add_argument("--seed", type=int, default=0, help="操作を選ぶ乱数のシード")
+    run.add_argument("--json", help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        seed_database(args.items, args.orders)
+        return
+
+    pages = [page for page in args.pages.split(",") if page]
+    unknown = [page for page in pages if page not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown pages: {', '.join(unknown)}")
+    summary = run_load_test(
+        users=args.users,
+        duration=args.duration,
+        pages=pages,
+        think_time=args.think_time,
+        ramp_up=args.ramp_up,
+        seed=args.seed,
+    )
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
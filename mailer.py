@@ -0,0 +1,436 @@
+"""新規ユーザー登録の管理者への通知メールの送信 (アウトボックス)
+
+サインアップ(sign_in.py)はsignup_notification_outboxに1行書き込むだけで、メールの送信を待たない
+(migrations/005_signup_notification_outbox.sql)。
+バックグラウンドのスレッドが未送信の行をまとめて、管理者ごとに1通のメール(ダイジェスト)で通知する。
+
+- SMTPの接続は送信の間で使い回し、SMTP_IDLE_TIMEOUTの間使わなかった場合に閉じる。
+- 送信に失敗した行は、MAILER_BACKOFFから失敗ごとに2倍(最大MAILER_BACKOFF_MAX)の間隔をあけて再送する。
+  送信に成功した管理者はdelivered_toに記録し、再送ではまだ届いていない管理者にだけ送る
+  (migrations/011_signup_notification_recipients.sql)。
+  MAILER_MAX_ATTEMPTS回失敗した行は送信しない。ログに出力し、app_signup_notifications{result="abandoned"}で数える
+  (last_errorに最後のエラーが残る)。
+- 未送信の行はFOR UPDATE SKIP LOCKEDで取得し、next_attempt_atをMAILER_CLAIM_TIMEOUT秒後に進めて確保してから
+  コミットする。SMTPの送信中はロックも接続も持たず、結果は別の短いトランザクションで記録する。
+  複数のプロセスで動かしても同じ行を重複して送らない。
+
+起動方法:
+    streamlit run streamlit_app.py    # 各プロセスで最初のリクエスト時に送信処理を開始する
+    python mailer.py run              # 送信処理だけを別プロセスで動かす (アプリはMAILER_ENABLED=0にする)
+    python mailer.py once             # 未送信の行を1回だけ送信する
+"""
+
+import argparse
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+_lock = threading.Lock()
+_started = False
+# サインアップ直後に送信処理を起こすためのイベント
+_wakeup = threading.Event()
+
+# 未送信の行を確保する。送信が終わるまで(最大claim_timeout秒)は他のプロセスに取得させない
+_CLAIM_QUERY = """
+WITH pending AS (
+    SELECT id
+    FROM public.signup_notification_outbox
+    WHERE sent_at IS NULL
+      AND next_attempt_at <= now()
+      AND attempts < :max_attempts
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE public.signup_notification_outbox o
+SET next_attempt_at = now() + :claim_timeout * interval '1 second'
+FROM pending
+WHERE o.id = pending.id
+RETURNING o.id, o.new_user_email, o.created_at, o.delivered_to
+"""
+
+_ADMIN_QUERY = """
+SELECT u.email
+FROM auth.users u
+    INNER JOIN public.user_roles ur ON u.id = ur.id
+WHERE ur.role = 'admin'
+    AND u.email IS NOT NULL
+ORDER BY u.email
+"""
+
+_SENT_UPDATE = """
+UPDATE public.signup_notification_outbox
+SET sent_at = now(),
+    attempts = attempts + 1,
+    last_error = NULL
+WHERE id = ANY(:ids)
+"""
+
+_DELIVERED_UPDATE = """
+UPDATE public.signup_notification_outbox
+SET delivered_to = array_append(delivered_to, :admin_email)
+WHERE id = ANY(:ids)
+  AND NOT (:admin_email = ANY(delivered_to))
+"""
+
+# SETの右辺のattemptsは更新前の値 (1回目の失敗はbackoff秒後に再送する)
+_FAILED_UPDATE = """
+UPDATE public.signup_notification_outbox
+SET attempts = attempts + 1,
+    last_error = :error,
+    next_attempt_at = now()
+        + least(:backoff * power(2, attempts), :backoff_max) * interval '1 second'
+WHERE id = ANY(:ids)
+RETURNING id, new_user_email, attempts
+"""
+
+
+@dataclass(frozen=True)
+class MailerSettings:
+    """通知メールの送信の設定値
+
+    .envの以下のキーで上書きできる。
+        SMTP_SERVER / SMTP_PORT: SMTPサーバー
+        SMTP_USER / SMTP_PASSWORD: 認証情報。SMTP_USERが空の場合は認証しない。送信元にもSMTP_USERを使う
+        SMTP_FROM: 送信元 (省略時はSMTP_USER)
+        SMTP_STARTTLS: 1の場合はSTARTTLSで暗号化する。ローカルのSMTPシンクで試す場合は0
+        SMTP_IDLE_TIMEOUT: 使っていないSMTPの接続を閉じるまでの秒数
+        MAILER_INTERVAL: 未送信の行を確認する間隔(秒)
+        MAILER_BATCH_SIZE: 1通のダイジェストにまとめる最大の登録数
+        MAILER_MAX_ATTEMPTS: 送信を試みる最大回数
+        MAILER_BACKOFF: 最初の再送までの秒数
+        MAILER_BACKOFF_MAX: 再送までの最大の秒数
+        MAILER_CLAIM_TIMEOUT: 送信中の行を他のプロセスに取得させない秒数
+    """
+
+    smtp_server: str | None = None
+    smtp_port: int = 587
+    smtp_user: str | None = None
+    smtp_password: str | None = None
+    smtp_from: str | None = None
+    smtp_starttls: bool = True
+    smtp_idle_timeout: float = 60.0
+    interval: float = 30.0
+    batch_size: int = 100
+    max_attempts: int = 8
+    backoff: float = 60.0
+    backoff_max: float = 3600.0
+    claim_timeout: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "MailerSettings":
+        default = cls()
+        smtp_user = os.getenv("SMTP_USER") or None
+        return cls(
+            smtp_server=os.getenv("SMTP_SERVER") or None,
+            smtp_port=int(os.getenv("SMTP_PORT", default.smtp_port)),
+            smtp_user=smtp_user,
+            smtp_password=os.getenv("SMTP_PASSWORD") or None,
+            smtp_from=os.getenv("SMTP_FROM") or smtp_user,
+            smtp_starttls=os.getenv("SMTP_STARTTLS", "1") == "1",
+            smtp_idle_timeout=float(
+                os.getenv("SMTP_IDLE_TIMEOUT", default.smtp_idle_timeout)
+            ),
+            interval=float(os.getenv("MAILER_INTERVAL", default.interval)),
+            batch_size=int(os.getenv("MAILER_BATCH_SIZE", default.batch_size)),
+            max_attempts=int(os.getenv("MAILER_MAX_ATTEMPTS", default.max_attempts)),
+            backoff=float(os.getenv("MAILER_BACKOFF", default.backoff)),
+            backoff_max=float(os.getenv("MAILER_BACKOFF_MAX", default.backoff_max)),
+            claim_timeout=float(
+                os.getenv("MAILER_CLAIM_TIMEOUT", default.claim_timeout)
+            ),
+        )
+
+
+class SmtpConnection:
+    """送信の間で使い回すSMTPの接続
+
+    サーバーに切断されていた場合は、接続し直して1回だけ送り直す。
+    """
+
+    def __init__(self, settings: MailerSettings):
+        self.settings = settings
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        import smtplib
+
+        smtp = smtplib.SMTP(self.settings.smtp_server, self.settings.smtp_port, timeout=30)
+        try:
+            if self.settings.smtp_starttls:
+                smtp.starttls()
+            if self.settings.smtp_user:
+                smtp.login(self.settings.smtp_user, self.settings.smtp_password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def send(self, message, to_addrs: list[str]) -> None:
+        """
+        メールを送信する
+        Args:
+            message (email.message.Message): 送信するメール
+            to_addrs (list[str]): 宛先
+        """
+        import smtplib
+
+        for attempt in range(2):
+            if self._smtp is None:
+                self._smtp = self._connect()
+            try:
+                self._smtp.sendmail(self.settings.smtp_from, to_addrs, message.as_string())
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # 使っていない間にサーバー側で切断された場合
+                self._smtp = None
+                if attempt:
+                    raise
+            except Exception:
+                # 送信途中の失敗は接続の状態が分からないため、次の送信では接続し直す
+                self.close()
+                raise
+
+    def close_if_idle(self) -> None:
+        """SMTP_IDLE_TIMEOUTの間使わなかった接続を閉じる"""
+        if (
+            self._smtp is not None
+            and time.monotonic() - self._last_used >= self.settings.smtp_idle_timeout
+        ):
+            self.close()
+
+    def close(self) -> None:
+        if self._smtp is None:
+            return
+        smtp, self._smtp = self._smtp, None
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+
+def build_digest(signups: list[tuple[str, object]], from_addr: str | None, to_addr: str):
+    """
+    複数の新規登録をまとめた通知メールを作成する
+    Args:
+        signups (list[tuple[str, object]]): (登録メールアドレス, 登録日時)のリスト
+        from_addr (str | None): 送信元
+        to_addr (str): 宛先の管理者
+    Returns:
+        email.mime.text.MIMEText: 通知メール
+    """
+    from email.mime.text import MIMEText
+
+    lines = "\n".join(
+        f"- {email} ({created_at:%Y-%m-%d %H:%M})" if created_at else f"- {email}"
+        for email, created_at in signups
+    )
+    body = f"""
+管理者の皆様
+
+新しいユーザーがシステムに登録されました。
+内容を確認し、必要に応じて権限の付与を行ってください。
+
+登録メールアドレス ({len(signups)}件):
+{lines}
+
+溶射電極管理システム
+"""
+    message = MIMEText(body, "plain", "utf-8")
+    message["Subject"] = f"【溶射電極管理システム】新規ユーザー登録通知 ({len(signups)}件)"
+    message["From"] = from_addr or ""
+    message["To"] = to_addr
+    return message
+
+
+def deliver_pending(settings: MailerSettings, smtp: SmtpConnection) -> int:
+    """
+    未送信の登録を1つのダイジェストにまとめ、管理者ごとに送信する
+    行の確保、SMTPでの送信、結果の記録を分け、送信中はデータベースのロックと接続を持たない。
+    再送では、前回までに届いていない管理者にだけ、その管理者に届いていない登録を送る。
+    Args:
+        settings (MailerSettings): 設定値
+        smtp (SmtpConnection): 使い回すSMTPの接続
+    Returns:
+        int: 送信済みにした行数
+    """
+    from sqlalchemy import text
+
+    from db_pool import apply_statement_timeout, checkout
+    from metrics import count_signup_notifications
+    from util import conn_str, get_db_engine
+
+    engine = get_db_engine(conn_str)
+    with checkout(engine) as connection:
+        with connection.begin():
+            apply_statement_timeout(connection, "background")
+            rows = connection.execute(
+                text(_CLAIM_QUERY),
+                {
+                    "max_attempts": settings.max_attempts,
+                    "batch_size": settings.batch_size,
+                    "claim_timeout": settings.claim_timeout,
+                },
+            ).all()
+            if not rows:
+                return 0
+            admin_emails = connection.execute(text(_ADMIN_QUERY)).scalars().all()
+    rows = sorted(rows, key=lambda row: row.id)
+
+    errors = []
+    if not admin_emails:
+        errors.append("no admin users")
+    # 管理者ごとに、今回の送信で届いた行
+    delivered = {}
+    for admin_email in admin_emails:
+        targets = [row for row in rows if admin_email not in row.delivered_to]
+        if not targets:
+            continue
+        try:
+            smtp.send(
+                build_digest(
+                    [(row.new_user_email, row.created_at) for row in targets],
+                    settings.smtp_from,
+                    admin_email,
+                ),
+                [admin_email],
+            )
+        except Exception as e:
+            errors.append(f"{admin_email}: {e}")
+        else:
+            delivered[admin_email] = [row.id for row in targets]
+
+    sent_ids = []
+    failed_ids = []
+    for row in rows:
+        recipients = set(row.delivered_to) | {
+            admin_email for admin_email, ids in delivered.items() if row.id in ids
+        }
+        if admin_emails and recipients.issuperset(admin_emails):
+            sent_ids.append(row.id)
+        else:
+            failed_ids.append(row.id)
+
+    abandoned = []
+    with checkout(engine) as connection:
+        with connection.begin():
+            apply_statement_timeout(connection, "background")
+            for admin_email, ids in delivered.items():
+                connection.execute(
+                    text(_DELIVERED_UPDATE), {"admin_email": admin_email, "ids": ids}
+                )
+            if sent_ids:
+                connection.execute(text(_SENT_UPDATE), {"ids": sent_ids})
+            if failed_ids:
+                abandoned = [
+                    row
+                    for row in connection.execute(
+                        text(_FAILED_UPDATE),
+                        {
+                            "ids": failed_ids,
+                            "error": "; ".join(errors),
+                            "backoff": settings.backoff,
+                            "backoff_max": settings.backoff_max,
+                        },
+                    )
+                    if row.attempts >= settings.max_attempts
+                ]
+
+    count_signup_notifications("sent", len(sent_ids))
+    count_signup_notifications("failed", len(failed_ids))
+    count_signup_notifications("abandoned", len(abandoned))
+    if sent_ids:
+        print(
+            f"Signup notification sent to {len(admin_emails)} admins ({len(sent_ids)} signups)."
+        )
+    if failed_ids:
+        print(
+            f"Signup notification failed for {len(failed_ids)} signups: {'; '.join(errors)}"
+        )
+    for row in abandoned:
+        print(
+            f"Signup notification abandoned after {row.attempts} attempts: "
+            f"{row.new_user_email} (id={row.id})"
+        )
+    return len(sent_ids)
+
+
+def run(settings: MailerSettings | None = None, once: bool = False) -> None:
+    """
+    未送信の行を送信する。onceでない場合は、MAILER_INTERVALごと(またはnotify()されたとき)に繰り返す
+    Args:
+        settings (MailerSettings | None, optional): 設定値。省略時は.envから読み込む
+        once (bool, optional): 未送信の行を1回だけ送信して終了する
+    """
+    settings = settings or MailerSettings.from_env()
+    smtp = SmtpConnection(settings)
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                # 1回で送りきれなかった場合は続けて送る
+                while deliver_pending(settings, smtp) >= settings.batch_size:
+                    pass
+            except Exception as e:
+                print(f"Signup notification delivery failed: {e}")
+            if once:
+                return
+            _wakeup.wait(settings.interval)
+            smtp.close_if_idle()
+    finally:
+        smtp.close()
+
+
+def start() -> bool:
+    """
+    送信処理をバックグラウンドのスレッドで開始する(プロセスで1回のみ)
+    Returns:
+        bool: このプロセスで初めて開始した場合はTrue
+    """
+    from dotenv import load_dotenv
+
+    global _started
+    with _lock:
+        if _started:
+            return False
+        _started = True
+    # streamlit_app.pyの先頭で呼び出されるため、ここで.envを読み込む
+    load_dotenv()
+    # 0の場合、このプロセスでは送信処理を開始しない (python mailer.py runで別に動かす場合)
+    if os.getenv("MAILER_ENABLED", "1") != "1":
+        return False
+    settings = MailerSettings.from_env()
+    if not settings.smtp_server:
+        print("Signup notification mailer disabled: SMTP_SERVER is not set.")
+        return False
+    thread = threading.Thread(target=run, args=(settings,), name="mailer", daemon=True)
+    thread.start()
+    return True
+
+
+def notify() -> None:
+    """アウトボックスに書き込んだことを送信処理に知らせ、次の間隔を待たずに送信させる"""
+    _wakeup.set()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("run", help="未送信の通知を送信し続ける")
+    subparsers.add_parser("once", help="未送信の通知を1回だけ送信する")
+    args = parser.parse_args()
+
+    settings = MailerSettings.from_env()
+    if not settings.smtp_server:
+        parser.error("SMTP_SERVER is not set.")
+    run(settings, once=args.command == "once")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,27 @@
 import streamlit as st
 from datetime import datetime
+import functools
 import time
 import polars as pl
-from util import supabase_read_sql, fetch_user_roles, conn_str
+from sqlalchemy import exc
+import prefetch
+import session_frames
+import snapshot
+import statements
+from db_pool import QueryInterruptedError
+from shared_cache import (
+    SHARED_CACHE_MAX_AGE_SECONDS,
+    shared_cache,
+    tables_version,
+    tracking_reads,
+)
+from util import (
+    supabase_read_sql,
+    supabase_read_statement,
+    read_statement,
+    fetch_user_roles,
+    conn_str,
+)
 
 
 def main():
@@ -55,10 +74,18 @@ def main():
         st.divider()
 
         item_list = fetch_item_list()
-        item_code = st.selectbox(
-            "品目を選択してください", options=item_list, key="item_code"
-        )
-        if item_code:
+        multi_item = st.toggle("複数の品目を表示する", value=False, key="multi_item")
+        if multi_item:
+            item_codes = st.multiselect(
+                "品目を選択してください（複数選択可）", options=item_list, key="item_codes"
+            )
+        else:
+            item_code = st.selectbox(
+                "品目を選択してください", options=item_list, key="item_code"
+            )
+            item_codes = [item_code] if item_code else []
+
+        if item_codes:
             # 検索条件の入力欄をExpander内に配置
             with st.expander("検索条件で絞り込む", expanded=False):
                 col1, col2, col3 = st.columns(3)
@@ -71,86 +98,255 @@ def main():
                     serial_from = st.text_input("シリアル (From)", "")
                     serial_to = st.text_input("シリアル (To)", "")
 
-            # 品目コードでデータを取得
-            electrode_status_df = fetch_electrode_status_list(item_code=item_code)
-
-            # 検索条件に基づいてDataFrameをフィルタリング
-            # st.date_inputはdateオブジェクトを返すため、datetimeに変換してから比較する
-            if giga_due_date_from and giga_due_date_to:
-                start_datetime = datetime.combine(
-                    giga_due_date_from, datetime.min.time()
-                )
-                end_datetime = datetime.combine(giga_due_date_to, datetime.max.time())
-                electrode_status_df = electrode_status_df.filter(
-                    pl.col("ギガ納期").is_between(start_datetime, end_datetime)
+            sort_col, page_size_col = st.columns([3, 1])
+            with sort_col:
+                sort_mode = st.toggle(
+                    "並び順を納期と注番にする（デフォルトはシリアル順）",
+                    value=False,
+                    key="sort_mode",
                 )
-            elif giga_due_date_from:
-                start_datetime = datetime.combine(
-                    giga_due_date_from, datetime.min.time()
+                include_archive = st.toggle(
+                    "アーカイブ(過去の出荷済みデータ)も表示する",
+                    value=False,
+                    key="status_include_archive",
                 )
-                electrode_status_df = electrode_status_df.filter(
-                    pl.col("ギガ納期") >= start_datetime
+            scope = "all" if include_archive else "hot"
+            with page_size_col:
+                page_size = st.selectbox(
+                    "1ページの表示件数", options=[100, 200, 500], index=1, key="status_page_size"
                 )
-            elif giga_due_date_to:
-                end_datetime = datetime.combine(giga_due_date_to, datetime.max.time())
-                electrode_status_df = electrode_status_df.filter(
-                    pl.col("ギガ納期") <= end_datetime
+
+            # 選択された品目のデータをまとめて取得 (取得済みの品目は再利用する)
+            item_frames = fetch_electrode_status_lists(item_codes, scope)
+            display_frames = {
+                code: filter_electrode_status(
+                    df,
+                    giga_due_date_from=giga_due_date_from,
+                    giga_due_date_to=giga_due_date_to,
+                    shiped_date=shiped_date,
+                    serial_from=serial_from,
+                    serial_to=serial_to,
+                    sort_mode=sort_mode,
                 )
+                for code, df in item_frames.items()
+            }
 
-            if shiped_date:
-                target_datetime = datetime.combine(shiped_date, datetime.min.time())
-                electrode_status_df = electrode_status_df.filter(
-                    pl.col("出荷実績日").dt.date() == target_datetime.date()
+            if len(item_codes) == 1:
+                code = item_codes[0]
+                st.subheader(f" {code} の溶射電極状況一覧")
+                show_electrode_status(display_frames[code], code, page_size)
+            else:
+                st.subheader("選択した品目の溶射電極状況一覧")
+                st.dataframe(
+                    pl.DataFrame(
+                        {
+                            "品目": item_codes,
+                            "件数": [display_frames[code].height for code in item_codes],
+                        }
+                    ),
+                    hide_index=True,
                 )
+                tabs = st.tabs(item_codes)
+                for tab, code in zip(tabs, item_codes):
+                    with tab:
+                        show_electrode_status(display_frames[code], code, page_size)
 
-            if serial_from and serial_to:
-                electrode_status_df = electrode_status_df.filter(
-                    pl.col("シリアル").cast(pl.Utf8).is_between(serial_from, serial_to)
+            # 最近使った他の品目を先読みし、品目の切り替えをキャッシュから表示できるようにする
+            for code in reversed(item_codes):
+                prefetch.remember_item("electrode_status", code)
+            recent = prefetch.recent_items("electrode_status", exclude=item_codes)
+            if recent:
+                prefetch.schedule(
+                    [functools.partial(warm_electrode_status, recent, scope)]
                 )
 
-            # 表示用に日付列を YYYY-MM-DD 形式の文字列に変換する
-            date_columns_to_format = [
-                "ギガ納期",
-                "出荷予定日",
-                "出荷実績日",
-                "台帳反映日",
-            ]
-            for col_name in date_columns_to_format:
-                # DataFrameに列が存在し、かつ日付/日時型である場合のみ変換を試みる
-                if col_name in electrode_status_df.columns and electrode_status_df[
-                    col_name
-                ].dtype in [pl.Date, pl.Datetime]:
-                    electrode_status_df = electrode_status_df.with_columns(
-                        pl.col(col_name).dt.strftime("%Y-%m-%d").alias(col_name)
-                    )
-
-            sort_mode = st.toggle(
-                "並び順を納期と注番にする（デフォルトはシリアル順）",
-                value=False,
-                key="sort_mode",
+        st.divider()
+        show_change_history(item_codes)
+
+
+# 変更履歴の表示件数の上限
+CHANGE_HISTORY_LIMIT = 200
+
+
+def show_change_history(item_codes: list[str]):
+    """
+    シリアルまたはギガ注番ごとの変更履歴(誰が・いつ・何を変更したか)を新しい順に表示する
+    履歴はmigrations/008_electrode_change_history.sqlのトリガーで記録される。
+    Args:
+        item_codes (list[str]): 選択中の品目コード (1品目の場合はシリアルの検索をその品目に絞る)
+    """
+    with st.expander("変更履歴を表示する", expanded=False):
+        target_col, value_col = st.columns([1, 3])
+        with target_col:
+            target = st.radio(
+                "検索対象", options=["シリアル", "ギガ注番"], horizontal=True, key="history_target"
+            )
+        with value_col:
+            value = st.text_input(f"{target}を入力してください", "", key="history_value").strip()
+        if not value:
+            return
+        # スナップショットには変更履歴が含まれない
+        if snapshot.SNAPSHOT_MODE:
+            st.info("スナップショットの表示中は変更履歴を表示できません。")
+            return
+
+        if target == "シリアル":
+            item_code = item_codes[0] if len(item_codes) == 1 else None
+            history_df = supabase_read_statement(
+                "change_history_by_serial",
+                parameters={
+                    "serial_num": value,
+                    "item_code": item_code,
+                    "limit": CHANGE_HISTORY_LIMIT,
+                },
             )
-            if sort_mode:
-                # 不具合情報（状況が'判定中' or '廃棄'）を除外する
-                electrode_status_df = electrode_status_df.filter(
-                    ~pl.col("状況").is_in(["判定中", "廃棄"])
-                )
-                electrode_status_df = electrode_status_df.sort(
-                    by=["ギガ納期", "ギガ注番"],
-                    descending=[True, True],
-                )
-            else:
-                electrode_status_df = electrode_status_df.sort(
-                    by=["sn有", "シリアル", "ギガ納期", "ギガ注番"],
-                    descending=[False, True, True, True],
-                )
-            st.subheader(f" {item_code} の溶射電極状況一覧")
-            st.dataframe(electrode_status_df, width="stretch")
+            label = f"シリアル {value}" + (f" ({item_code})" if item_code else "")
+        else:
+            history_df = supabase_read_statement(
+                "change_history_by_order",
+                parameters={"giga_order_num": value, "limit": CHANGE_HISTORY_LIMIT},
+            )
+            label = f"ギガ注番 {value}"
+
+        if history_df.is_empty():
+            st.info(f"{label} の変更履歴はありません。")
+            return
+        st.caption(f"{label} の変更履歴 (新しい順、最大{CHANGE_HISTORY_LIMIT}件)")
+        st.dataframe(
+            history_df,
+            hide_index=True,
+            column_config={
+                "日時": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm:ss"),
+                "変更内容": st.column_config.TextColumn(width="large"),
+            },
+        )
 
 
+def filter_electrode_status(
+    electrode_status_df: pl.DataFrame,
+    giga_due_date_from=None,
+    giga_due_date_to=None,
+    shiped_date=None,
+    serial_from: str = "",
+    serial_to: str = "",
+    sort_mode: bool = False,
+) -> pl.DataFrame:
+    """
+    1品目分の溶射電極状況を検索条件で絞り込み、並べ替える
+    (日付の書式化はshow_electrode_statusで表示するページの行だけに行う)
+    Args:
+        electrode_status_df (pl.DataFrame): fetch_electrode_status_listsで取得した1品目分のデータ
+        giga_due_date_from (date, optional): ギガ納期 (From)
+        giga_due_date_to (date, optional): ギガ納期 (To)
+        shiped_date (date, optional): 出荷実績日
+        serial_from (str, optional): シリアル (From)
+        serial_to (str, optional): シリアル (To)
+        sort_mode (bool, optional): Trueの場合は納期と注番の順に並べる
+    Returns:
+        pl.DataFrame: 絞り込み・並べ替え後のデータフレーム
+    """
+    if electrode_status_df.is_empty():
+        return electrode_status_df
+
+    # 検索条件に基づいてDataFrameをフィルタリング
+    # st.date_inputはdateオブジェクトを返すため、datetimeに変換してから比較する
+    if giga_due_date_from and giga_due_date_to:
+        start_datetime = datetime.combine(giga_due_date_from, datetime.min.time())
+        end_datetime = datetime.combine(giga_due_date_to, datetime.max.time())
+        electrode_status_df = electrode_status_df.filter(
+            pl.col("ギガ納期").is_between(start_datetime, end_datetime)
+        )
+    elif giga_due_date_from:
+        start_datetime = datetime.combine(giga_due_date_from, datetime.min.time())
+        electrode_status_df = electrode_status_df.filter(
+            pl.col("ギガ納期") >= start_datetime
+        )
+    elif giga_due_date_to:
+        end_datetime = datetime.combine(giga_due_date_to, datetime.max.time())
+        electrode_status_df = electrode_status_df.filter(
+            pl.col("ギガ納期") <= end_datetime
+        )
+
+    if shiped_date:
+        target_datetime = datetime.combine(shiped_date, datetime.min.time())
+        electrode_status_df = electrode_status_df.filter(
+            pl.col("出荷実績日").dt.date() == target_datetime.date()
+        )
+
+    if serial_from and serial_to:
+        electrode_status_df = electrode_status_df.filter(
+            pl.col("シリアル").cast(pl.Utf8).is_between(serial_from, serial_to)
+        )
+
+    if sort_mode:
+        # 不具合情報（状況が'判定中' or '廃棄'）を除外する
+        electrode_status_df = electrode_status_df.filter(
+            ~pl.col("状況").is_in(["判定中", "廃棄"])
+        )
+        electrode_status_df = electrode_status_df.sort(
+            by=["ギガ納期", "ギガ注番"],
+            descending=[True, True],
+        )
+    else:
+        electrode_status_df = electrode_status_df.sort(
+            by=["sn有", "シリアル", "ギガ納期", "ギガ注番"],
+            descending=[False, True, True, True],
+        )
+    return electrode_status_df
+
 
+# 表示用にYYYY-MM-DD形式の文字列に変換する日付列
+DATE_COLUMNS_TO_FORMAT = [
+    "ギガ納期",
+    "出荷予定日",
+    "出荷実績日",
+    "台帳反映日",
+]
+
+
+def show_electrode_status(
+    electrode_status_df: pl.DataFrame, item_code: str, page_size: int
+) -> None:
+    """
+    1品目分の溶射電極状況をページ単位で表示する
+    Args:
+        electrode_status_df (pl.DataFrame): filter_electrode_statusの結果
+        item_code (str): 品目コード (ページ番号の入力欄のキーに使用)
+        page_size (int): 1ページの件数
+    """
+    if electrode_status_df.is_empty():
+        st.info("指定された条件に一致するデータはありません。")
+        return
+    page_count = (electrode_status_df.height + page_size - 1) // page_size
+    page = 1
+    if page_count > 1:
+        page = st.number_input(
+            f"ページ (全{page_count}ページ・{electrode_status_df.height}件)",
+            min_value=1,
+            max_value=page_count,
+            value=1,
+            key=f"status_page_{item_code}",
+        )
+    st.dataframe(
+        session_frames.format_page(
+            electrode_status_df, page, page_size, DATE_COLUMNS_TO_FORMAT
+        ),
+        width="stretch",
+    )
 
 
 def fetch_item_list() -> list[str]:
+    """
+    品目リストビューから品目コードのリストを取得する
+    """
+    df = _fetch_item_frame()
+    if df.is_empty():
+        return []
+    return list(df["item_code"])
+
+
+@shared_cache(tables=("electrode_status",), ttl=600)
+def _fetch_item_frame() -> pl.DataFrame:
     """
     品目リストビューからデータを取得し、Polars DataFrameとして返す
     """
@@ -161,74 +357,225 @@ SELECT
 FROM
     public.v_item_list 
     """
-    df = supabase_read_sql(query)
-    return list(df["item_code"])
+    return supabase_read_sql(query)
+
+
+# 溶射電極状況が依存するテーブル
+_STATUS_TABLES = ("electrode_status", "electrode_status_archive", "defective_electrodes")
+# テーブルのバージョンでキャッシュする場合の有効秒数
+# (ローカルのバージョンは他のホストやSQLでの書き込みでは更新されないため、期限を設ける)
+_STATUS_CACHE_TTL = 120
+# 品目のバージョンを取得できなかった後、テーブルのバージョンでキャッシュする秒数
+# (migrations/007_electrode_item_versions.sqlを適用していない場合に、毎回失敗するクエリを実行しない)
+_ITEM_VERSION_RETRY_SECONDS = 300
+_item_versions_unavailable_until = 0.0
+
+
+def fetch_electrode_status_lists(
+    item_codes: list[str], scope: str = "hot"
+) -> dict[str, pl.DataFrame]:
+    """
+    複数の品目の溶射電極状況を取得し、品目ごとのDataFrameとして返す
+
+    先に品目ごとのバージョンを1回のクエリ(主キーの参照)で取得し、同じバージョンの品目は
+    セッション内で取得済みのもの(session_framesのメモリ予算内で保持)または共有キャッシュのものをそのまま使う。
+    残りの品目だけを1回のクエリ(item_code = ANY(:items))で取得して品目ごとに保存する。
+    品目のバージョンを取得できない場合は、テーブルのバージョンと有効秒数(_STATUS_CACHE_TTL)で再利用する。
+    Args:
+        item_codes (list[str]): 品目コードのリスト
+        scope (str, optional): 読み取る範囲。hotは未出荷と最近出荷した行のみ、allはアーカイブを含む全期間
+    Returns:
+        dict[str, pl.DataFrame]: 品目コードごとのデータフレーム (item_codesの順)
+    """
+    # キャッシュのキーは取得前のバージョンで作成する(取得中の書き込みで古いデータを保存しない)
+    item_versions = fetch_item_versions(item_codes)
+    if item_versions is None:
+        table_version = tables_version(_STATUS_TABLES)
+        versions = {item_code: f"table:{table_version}" for item_code in item_codes}
+        max_age = _STATUS_CACHE_TTL
+    else:
+        versions = {
+            item_code: f"item:{item_versions[item_code]}" for item_code in item_codes
+        }
+        max_age = SHARED_CACHE_MAX_AGE_SECONDS
 
+    frames = {}
+    missing = []
+    for item_code in item_codes:
+        loaded = session_frames.get(
+            f"electrode_status:{scope}:{item_code}", versions[item_code], max_age
+        )
+        if loaded is not None:
+            frames[item_code] = loaded
+        else:
+            missing.append(item_code)
+
+    fetched_codes = set()
+    if missing:
+        # 品目のバージョンが変わっていなければ、共有キャッシュのDataFrameを再利用する
+        cache, keys = _item_cache_keys(missing, scope, item_versions)
+        missing_keys = {}
+        for item_code, key in keys.items():
+            df = cache.lookup(key)
+            if df is None:
+                missing_keys[item_code] = key
+            else:
+                frames[item_code] = df
+                fetched_codes.add(item_code)
+        if missing_keys:
+            with tracking_reads() as sources:
+                fetched = _query_electrode_status(list(missing_keys), scope)
+            frames |= _store_item_partitions(fetched, missing_keys, sources, cache)
+            fetched_codes |= missing_keys.keys()
+
+    for item_code in fetched_codes:
+        df = frames[item_code]
+        # 空のDataFrameは取得エラーの可能性があるため保持しない
+        if not df.is_empty():
+            session_frames.put(
+                f"electrode_status:{scope}:{item_code}", versions[item_code], df
+            )
+    return {item_code: frames[item_code] for item_code in item_codes}
+
+
+def warm_electrode_status(item_codes: list[str], scope: str = "hot") -> None:
+    """
+    共有キャッシュにない品目の溶射電極状況を1回のクエリで取得して保存する(先読み用)
+    セッションの外で実行されるため、エラー時は例外を送出するread_statementを使用する。
+    Args:
+        item_codes (list[str]): 品目コードのリスト
+        scope (str, optional): 読み取る範囲 (hot/all)
+    """
+    cache, keys = _item_cache_keys(item_codes, scope, fetch_item_versions(item_codes))
+    missing_keys = {
+        item_code: key for item_code, key in keys.items() if cache.lookup(key) is None
+    }
+    if missing_keys:
+        with tracking_reads() as sources:
+            fetched = read_statement(
+                statements.scoped("electrode_status_by_items", scope),
+                parameters={"items": list(missing_keys)},
+                query_class="background",
+            )
+        _store_item_partitions(fetched, missing_keys, sources, cache)
 
-def fetch_electrode_status_list(item_code: str) -> pl.DataFrame:
+
+def fetch_item_versions(item_codes: list[str]) -> dict[str, int] | None:
     """
-    user_rolesテーブルからデータを取得し、Polars DataFrameとして返す
+    品目ごとのデータのバージョンを1回のクエリ(主キーの参照)で取得する
+    バージョンはelectrode_status・electrode_status_archive・defective_electrodesへの書き込みで
+    トリガーにより更新される(migrations/007_electrode_item_versions.sql)。
+    Args:
+        item_codes (list[str]): 品目コードのリスト
+    Returns:
+        dict[str, int] | None: 品目コードごとのバージョン (書き込みのない品目は0)。
+            スナップショットモードの場合と、取得できない場合はNone
+    """
+    global _item_versions_unavailable_until
+    # スナップショットは作成時点のデータのため、品目のバージョンと対応しない
+    if snapshot.SNAPSHOT_MODE or time.monotonic() < _item_versions_unavailable_until:
+        return None
+    try:
+        df = read_statement("electrode_item_versions", parameters={"items": item_codes})
+    except (exc.SQLAlchemyError, QueryInterruptedError) as e:
+        if isinstance(e, exc.ProgrammingError):
+            _item_versions_unavailable_until = (
+                time.monotonic() + _ITEM_VERSION_RETRY_SECONDS
+            )
+        print(f"Item version probe failed, falling back to table versions: {e}")
+        return None
+    versions = (
+        dict(zip(df["item_code"].to_list(), df["version"].to_list()))
+        if not df.is_empty()
+        else {}
+    )
+    return {item_code: versions.get(item_code, 0) for item_code in item_codes}
+
+
+def _item_cache_keys(
+    item_codes: list[str], scope: str, item_versions: dict[str, int] | None
+) -> tuple:
+    """
+    品目ごとの共有キャッシュのキーを作成する
+    品目のバージョンを取得できた場合は品目のバージョンを、取得できない場合はテーブルのバージョンをキーに含める。
+    Args:
+        item_codes (list[str]): 品目コードのリスト
+        scope (str): 読み取る範囲 (hot/all)
+        item_versions (dict[str, int] | None): fetch_item_versionsの結果
+    Returns:
+        tuple: (キャッシュの関数, 品目コードごとのキー)
+    """
+    if item_versions is None:
+        cache = fetch_electrode_status_list
+        return cache, {item_code: cache.cache_key(item_code, scope) for item_code in item_codes}
+    cache = fetch_versioned_electrode_status
+    return cache, {
+        item_code: cache.cache_key(item_code, scope, item_versions[item_code])
+        for item_code in item_codes
+    }
+
+
+def _store_item_partitions(
+    fetched: pl.DataFrame, keys: dict[str, str], sources: set[str], cache=None
+) -> dict[str, pl.DataFrame]:
+    """複数品目の取得結果を品目ごとに分割し、それぞれのキャッシュキーで保存する(sourcesは読み取り元)"""
+    cache = cache or fetch_electrode_status_list
+    fetched = session_frames.compact(fetched)
+    partitions = (
+        fetched.partition_by("品目", as_dict=True) if not fetched.is_empty() else {}
+    )
+    frames = {}
+    for item_code, key in keys.items():
+        df = partitions.get((item_code,), fetched.clear())
+        cache.store(key, df, sources)
+        frames[item_code] = df
+    return frames
+
+
+@shared_cache(tables=_STATUS_TABLES, ttl=_STATUS_CACHE_TTL)
+def fetch_electrode_status_list(item_code: str, scope: str = "hot") -> pl.DataFrame:
+    """
+    1品目分の溶射電極状況を取得し、Polars DataFrameとして返す
+    (共有キャッシュのエントリは品目と読み取る範囲ごとに作成される)
     Args:
         item_code (str): 品目コード
+        scope (str, optional): 読み取る範囲 (hot/all)
     Returns:
         pl.DataFrame: Polarsデータフレーム
     """
+    return session_frames.compact(_query_electrode_status([item_code], scope))
 
-    query = """
-    -- 通常の電極ステータス (不具合登録されていないもの)
-    SELECT
-        id,
-        linde_order_num AS "リンデ注番",
-        giga_order_num AS "ギガ注番",
-        item_code AS "品目",
-        giga_due_date AS "ギガ納期",
-        sirial_num AS "シリアル",
-        status AS "状況",
-        remarks AS "備考",
-        ship_plan AS "出荷予定日",
-        shiped_date AS "出荷実績日",
-        daicho_haneibi AS "台帳反映日",
-        linde_remarks AS "リンデ備考",
-        NULL::date AS "不具合発生日", -- 不具合品ではないのでNULL
-        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END) AS "sn有"
-    FROM
-        public.electrode_status es
-    WHERE
-        es.item_code = :item_code
-        AND NOT EXISTS (
-            SELECT 1
-            FROM public.defective_electrodes de
-            WHERE de.item_code = es.item_code AND de.serial_num = es.sirial_num
-        )
 
-    UNION ALL
-
-    -- 不具合電極の情報 (こちらを優先)
-    SELECT
-        id,
-        '-' AS "リンデ注番",
-        '-' AS "ギガ注番",
-        item_code AS "品目",
-        NULL::timestamp AS "ギガ納期",
-        serial_num AS "シリアル",
-        defect_status AS "状況",
-        defect_description AS "備考",
-        NULL::date AS "出荷予定日",
-        NULL::date AS "出荷実績日",
-        NULL::date AS "台帳反映日",
-        linde_remarks AS "リンデ備考",
-        defect_date AS "不具合発生日",
-        1 AS "sn有" -- 不具合品は必ずシリアルがあるので1
-    FROM
-        public.defective_electrodes
-    WHERE
-        item_code = :item_code
-    """
-    parameters = {"item_code": item_code}
-    # sirial_numは数値と文字列が混在する可能性があるため、String型として読み込む
-    electrode_status_list = supabase_read_sql(query, parameters=parameters)
-
-    return electrode_status_list
+# 品目のバージョンが変わるまで再利用するため、キーにテーブルのバージョンを含めない
+# (有効期間は共有キャッシュのファイルを削除するまでの秒数と同じ)
+@shared_cache(tables=(), ttl=SHARED_CACHE_MAX_AGE_SECONDS)
+def fetch_versioned_electrode_status(
+    item_code: str, scope: str, item_version: int
+) -> pl.DataFrame:
+    """
+    1品目分の溶射電極状況を取得する(共有キャッシュのエントリは品目のバージョンごとに作成される)
+    Args:
+        item_code (str): 品目コード
+        scope (str): 読み取る範囲 (hot/all)
+        item_version (int): fetch_item_versionsで取得した品目のバージョン
+    Returns:
+        pl.DataFrame: Polarsデータフレーム
+    """
+    return session_frames.compact(_query_electrode_status([item_code], scope))
+
+
+def _query_electrode_status(item_codes: list[str], scope: str = "hot") -> pl.DataFrame:
+    """指定した品目の溶射電極状況を1回のクエリで取得する"""
+    # スナップショットモードで有効なスナップショットがあればSQLを実行しない
+    electrode_status_list = snapshot.fetch_electrode_status_lists(item_codes, scope)
+    if electrode_status_list is not None:
+        return electrode_status_list
+
+    # 品目のリストは配列として1つのパラメータで渡すため、品目数によらず同じステートメントになる
+    return supabase_read_statement(
+        statements.scoped("electrode_status_by_items", scope),
+        parameters={"items": item_codes},
+    )
 
 
 if __name__ == "__main__":
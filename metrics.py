@@ -0,0 +1,473 @@
+"""プロセス内のメトリクスとOpenMetrics形式の出力
+
+クエリの所要時間、取得・書き込みの行数、共有キャッシュ、コネクションプール、
+ファイルのアップロード、ページの再実行回数をプロセス内で集計し、
+METRICS_PORTのHTTPサーバーからOpenMetrics形式で出力する(既存の監視からスクレイプする)。
+
+確認方法:
+    curl http://127.0.0.1:9464/metrics
+
+- カウンターとヒストグラムは記録時に更新する。
+- 共有キャッシュ・コネクションプール・先読みの値は、他のモジュールが保持している集計を出力時に読み取る。
+- 値はプロセスごとに集計される。複数プロセスで動かす場合は、プロセスごとにMETRICS_PORTを変える。
+"""
+
+import math
+import os
+import threading
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# メトリクスを出力するポート (0の場合、HTTPサーバーを起動しない)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+# HTTPサーバーが待ち受けるアドレス (他のホストからスクレイプする場合は0.0.0.0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# 所要時間のヒストグラムのバケット(秒)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# アップロードの所要時間のヒストグラムのバケット(秒)
+UPLOAD_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+@dataclass
+class MetricFamily:
+    """出力する1つのメトリクス (同じ名前のサンプルの集まり)"""
+
+    name: str
+    type: str
+    help: str
+    # (サンプル名, ラベル, 値)
+    samples: list[tuple[str, dict[str, str], float]] = field(default_factory=list)
+
+
+class Counter:
+    """ラベルごとの単調増加する値"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            values = dict(self._values)
+        return MetricFamily(
+            self.name,
+            "counter",
+            self.help,
+            [
+                (f"{self.name}_total", dict(zip(self.labelnames, key)), value)
+                for key, value in sorted(values.items())
+            ],
+        )
+
+
+class Histogram:
+    """ラベルごとの値の分布 (累積バケット、合計、件数)"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        # ラベル -> (バケットごとの件数, 合計)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        family = MetricFamily(self.name, "histogram", self.help)
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                family.samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": _format_bound(bound)}, cumulative)
+                )
+            family.samples.append((f"{self.name}_count", labels, cumulative))
+            family.samples.append((f"{self.name}_sum", labels, total))
+        return family
+
+
+class MetricsRegistry:
+    """メトリクスと、出力時に値を読み取る関数(コレクター)を保持する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: list[Callable[[], Iterable[MetricFamily]]] = []
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[MetricFamily]]) -> None:
+        """出力時に呼び出され、その時点の値を返す関数を登録する"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> list[MetricFamily]:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                # 1つのコレクターの失敗で出力全体を失わないようにする
+                print(f"Metrics collector failed: {e}")
+        return families
+
+    def render(self) -> str:
+        """OpenMetrics形式のテキストを返す"""
+        lines = []
+        for family in self.collect():
+            lines.append(f"# TYPE {family.name} {family.type}")
+            lines.append(f"# HELP {family.name} {_escape(family.help)}")
+            for sample_name, labels, value in family.samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+query_duration = registry.histogram(
+    "app_query_duration_seconds",
+    "Duration of database reads by statement name (adhoc for unnamed SQL).",
+    ("statement",),
+)
+query_errors = registry.counter(
+    "app_query_errors",
+    "Database reads that raised an error, by statement name.",
+    ("statement",),
+)
+rows_fetched = registry.counter(
+    "app_rows_fetched",
+    "Rows returned by database reads, by statement name.",
+    ("statement",),
+)
+rows_written = registry.counter(
+    "app_rows_written",
+    "Rows inserted, updated or deleted by committed writes, by table.",
+    ("table",),
+)
+write_transactions = registry.counter(
+    "app_write_transactions",
+    "Write batches executed through supabase_execute_sql, by result.",
+    ("result",),
+)
+upload_duration = registry.histogram(
+    "app_upload_duration_seconds",
+    "Duration of file upload jobs (registration of uploaded rows), by job.",
+    ("job",),
+    UPLOAD_BUCKETS,
+)
+upload_rows = registry.counter(
+    "app_upload_rows",
+    "Rows submitted by file upload jobs, by job and result.",
+    ("job", "result"),
+)
+page_reruns = registry.counter(
+    "app_page_reruns",
+    "Script reruns per page.",
+    ("page",),
+)
+api_requests = registry.counter(
+    "app_api_requests",
+    "Requests to the JSON API (api.py), by endpoint and HTTP status.",
+    ("endpoint", "status"),
+)
+signup_notifications = registry.counter(
+    "app_signup_notifications",
+    "Signup notification rows processed by the mailer, by result (sent, failed, abandoned).",
+    ("result",),
+)
+
+
+def observe_query(statement: str, seconds: float, rows: int | None) -> None:
+    """
+    読み取りクエリの所要時間と行数を記録する
+    Args:
+        statement (str): ステートメント名 (名前のないSQLは"adhoc")
+        seconds (float): 所要時間(秒)
+        rows (int | None): 取得した行数。エラーの場合はNone
+    """
+    query_duration.observe(seconds, statement=statement)
+    if rows is None:
+        query_errors.inc(statement=statement)
+    else:
+        rows_fetched.inc(rows, statement=statement)
+
+
+def record_upload(job: str, seconds: float, rows: int, ok: bool) -> None:
+    """
+    ファイルのアップロードによる登録・更新の所要時間と行数を記録する
+    Args:
+        job (str): 処理の種類 (例: "shipment_status")
+        seconds (float): 所要時間(秒)
+        rows (int): 登録・更新を依頼した行数
+        ok (bool): 成功したかどうか
+    """
+    upload_duration.observe(seconds, job=job)
+    upload_rows.inc(rows, job=job, result="ok" if ok else "error")
+
+
+def count_rerun(page: str) -> None:
+    """ページの再実行を記録する (streamlit_app.pyでpg.run()の前に呼び出す)"""
+    page_reruns.inc(page=page)
+
+
+def count_api_request(endpoint: str, status: int) -> None:
+    """JSON APIへのリクエストを記録する (304はデータベースに問い合わせずに返した件数)"""
+    api_requests.inc(endpoint=endpoint, status=str(status))
+
+
+def count_signup_notifications(result: str, rows: int) -> None:
+    """
+    新規登録の通知の送信結果を記録する (mailer.py)
+    Args:
+        result (str): "sent" / "failed" / "abandoned"(MAILER_MAX_ATTEMPTS回失敗して再送しない)
+        rows (int): 行数
+    """
+    if rows:
+        signup_notifications.inc(rows, result=result)
+
+
+# --- 他のモジュールが保持している集計 ---
+
+
+def _collect_shared_cache() -> list[MetricFamily]:
+    from shared_cache import get_cache_backend
+
+    stats = get_cache_backend().stats()
+    return [
+        MetricFamily(
+            f"app_shared_cache_{name}",
+            "counter",
+            f"Shared cache {name} in this process.",
+            [(f"app_shared_cache_{name}_total", {}, stats[name])],
+        )
+        for name in ("hits", "misses", "evictions")
+    ]
+
+
+_POOL_GAUGES = {
+    "checked_out": "Connections currently checked out of the pool.",
+    "checked_in": "Idle connections in the pool.",
+    "overflow": "Connections opened beyond pool_size.",
+}
+_POOL_COUNTERS = {
+    "checkouts": "Connections checked out of the pool.",
+    "waits": "Checkouts that had to wait for a connection.",
+    "checkout_timeouts": "Checkouts that timed out waiting for a connection.",
+    "connects": "New database connections opened.",
+    "invalidations": "Connections invalidated after an error.",
+}
+# 所要時間の合計(counter)と最大値(gauge)。平均は合計を回数(connects / waits)で割って求める
+_POOL_SECONDS = {
+    "connect": "Time spent opening new database connections (including the TLS handshake).",
+    "wait": "Time checkouts spent waiting for a connection (including timed-out waits).",
+}
+
+
+def _collect_pool() -> list[MetricFamily]:
+    from util import fetch_pool_metrics
+
+    pools = {"primary": fetch_pool_metrics(), "replica": fetch_pool_metrics(replica=True)}
+    pools = {pool: snapshot for pool, snapshot in pools.items() if snapshot}
+    families = [
+        MetricFamily(
+            "app_db_pool_capacity",
+            "gauge",
+            "Maximum connections of the pool (pool_size + max_overflow).",
+            [
+                ("app_db_pool_capacity", {"pool": pool}, s["pool_size"] + s["max_overflow"])
+                for pool, s in pools.items()
+            ],
+        )
+    ]
+    for name, help in _POOL_GAUGES.items():
+        families.append(
+            MetricFamily(
+                f"app_db_pool_{name}",
+                "gauge",
+                help,
+                [(f"app_db_pool_{name}", {"pool": pool}, s[name]) for pool, s in pools.items()],
+            )
+        )
+    for name, help in _POOL_COUNTERS.items():
+        families.append(
+            MetricFamily(
+                f"app_db_pool_{name}",
+                "counter",
+                help,
+                [
+                    (f"app_db_pool_{name}_total", {"pool": pool}, s[name])
+                    for pool, s in pools.items()
+                ],
+            )
+        )
+    for name, help in _POOL_SECONDS.items():
+        families.append(
+            MetricFamily(
+                f"app_db_pool_{name}_seconds",
+                "counter",
+                help,
+                [
+                    (
+                        f"app_db_pool_{name}_seconds_total",
+                        {"pool": pool},
+                        s[f"{name}_seconds_total"],
+                    )
+                    for pool, s in pools.items()
+                ],
+            )
+        )
+        families.append(
+            MetricFamily(
+                f"app_db_pool_{name}_seconds_max",
+                "gauge",
+                f"Longest single {name} since the process started.",
+                [
+                    (f"app_db_pool_{name}_seconds_max", {"pool": pool}, s[f"{name}_seconds_max"])
+                    for pool, s in pools.items()
+                ],
+            )
+        )
+    return families
+
+
+def _collect_prefetch() -> list[MetricFamily]:
+    from prefetch import get_scheduler
+
+    stats = get_scheduler().stats()
+    return [
+        MetricFamily(
+            "app_prefetch_tasks",
+            "counter",
+            "Background prefetch tasks by outcome.",
+            [
+                ("app_prefetch_tasks_total", {"outcome": outcome}, count)
+                for outcome, count in stats.items()
+            ],
+        )
+    ]
+
+
+registry.add_collector(_collect_shared_cache)
+registry.add_collector(_collect_pool)
+registry.add_collector(_collect_prefetch)
+
+
+# --- HTTPサーバー ---
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # スクレイプのたびにアクセスログを出力しない
+        pass
+
+
+_lock = threading.Lock()
+_started = False
+
+
+def start(port: int = METRICS_PORT, host: str = METRICS_HOST) -> bool:
+    """
+    メトリクスを出力するHTTPサーバーをバックグラウンドのスレッドで起動する(プロセスで1回のみ)
+    Args:
+        port (int, optional): 待ち受けるポート。0の場合は起動しない
+        host (str, optional): 待ち受けるアドレス
+    Returns:
+        bool: このプロセスで初めて起動した場合はTrue
+    """
+    global _started
+    with _lock:
+        if _started or port == 0:
+            return False
+        _started = True
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        # 同じホストの他のプロセスが使用している場合など
+        print(f"Metrics server disabled: {e}")
+        return False
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    print(f"Metrics server listening on http://{host}:{port}/metrics")
+    return True
@@ -0,0 +1,9 @@
+-- 不具合履歴のキーセットページング用インデックス
+-- defective_electrode_registration.py の履歴表示は (defect_date, id) の降順で1ページずつ取得する。
+-- 品目での絞り込みは (item_code, defect_date, id) のインデックスを使用する。
+
+create index concurrently if not exists defective_electrodes_defect_date_id_idx
+    on public.defective_electrodes (defect_date desc, id desc);
+
+create index concurrently if not exists defective_electrodes_item_defect_date_id_idx
+    on public.defective_electrodes (item_code, defect_date desc, id desc);
@@ -0,0 +1,164 @@
+-- 分析ダッシュボード(analytics.py)用の集計テーブル
+-- electrode_status と defective_electrodes への書き込み時に、ステートメント単位のトリガーで
+-- 差分だけを加減算する。ダッシュボードはこの小さな集計テーブルのみを参照する。
+
+-- 品目・月・不具合状況ごとの不具合件数
+create table if not exists public.analytics_defect_monthly (
+    item_code text not null,
+    month date not null,
+    defect_status text not null,
+    defect_count bigint not null,
+    primary key (item_code, month, defect_status)
+);
+
+-- 品目・週ごとの出荷数 (出荷実績日の週)
+create table if not exists public.analytics_shipment_weekly (
+    item_code text not null,
+    week date not null,
+    shipped_count bigint not null,
+    primary key (item_code, week)
+);
+
+-- 品目・ギガ納期の週ごとの未出荷数
+create table if not exists public.analytics_open_backlog_weekly (
+    item_code text not null,
+    due_week date not null,
+    open_count bigint not null,
+    primary key (item_code, due_week)
+);
+
+
+-- 不具合件数の差分更新
+create or replace function public.analytics_defect_rollup()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into public.analytics_defect_monthly as t (item_code, month, defect_status, defect_count)
+    select item_code, date_trunc('month', defect_date)::date, defect_status, count(*)
+    from new_rows
+    where item_code is not null and defect_date is not null and defect_status is not null
+    group by 1, 2, 3
+    on conflict (item_code, month, defect_status)
+    do update set defect_count = t.defect_count + excluded.defect_count;
+  end if;
+
+  if tg_op in ('UPDATE', 'DELETE') then
+    insert into public.analytics_defect_monthly as t (item_code, month, defect_status, defect_count)
+    select item_code, date_trunc('month', defect_date)::date, defect_status, -count(*)
+    from old_rows
+    where item_code is not null and defect_date is not null and defect_status is not null
+    group by 1, 2, 3
+    on conflict (item_code, month, defect_status)
+    do update set defect_count = t.defect_count + excluded.defect_count;
+
+    delete from public.analytics_defect_monthly where defect_count = 0;
+  end if;
+  return null;
+end;
+$$;
+
+-- 出荷数と未出荷数の差分更新
+create or replace function public.analytics_electrode_status_rollup()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into public.analytics_shipment_weekly as t (item_code, week, shipped_count)
+    select item_code, date_trunc('week', shiped_date)::date, count(*)
+    from new_rows
+    where item_code is not null and shiped_date is not null
+    group by 1, 2
+    on conflict (item_code, week)
+    do update set shipped_count = t.shipped_count + excluded.shipped_count;
+
+    insert into public.analytics_open_backlog_weekly as t (item_code, due_week, open_count)
+    select item_code, date_trunc('week', giga_due_date)::date, count(*)
+    from new_rows
+    where item_code is not null and shiped_date is null and giga_due_date is not null
+    group by 1, 2
+    on conflict (item_code, due_week)
+    do update set open_count = t.open_count + excluded.open_count;
+  end if;
+
+  if tg_op in ('UPDATE', 'DELETE') then
+    insert into public.analytics_shipment_weekly as t (item_code, week, shipped_count)
+    select item_code, date_trunc('week', shiped_date)::date, -count(*)
+    from old_rows
+    where item_code is not null and shiped_date is not null
+    group by 1, 2
+    on conflict (item_code, week)
+    do update set shipped_count = t.shipped_count + excluded.shipped_count;
+
+    insert into public.analytics_open_backlog_weekly as t (item_code, due_week, open_count)
+    select item_code, date_trunc('week', giga_due_date)::date, -count(*)
+    from old_rows
+    where item_code is not null and shiped_date is null and giga_due_date is not null
+    group by 1, 2
+    on conflict (item_code, due_week)
+    do update set open_count = t.open_count + excluded.open_count;
+
+    delete from public.analytics_shipment_weekly where shipped_count = 0;
+    delete from public.analytics_open_backlog_weekly where open_count = 0;
+  end if;
+  return null;
+end;
+$$;
+
+-- 遷移テーブルを使うトリガーはイベントごとに作成する必要がある
+drop trigger if exists analytics_defect_rollup_ins on public.defective_electrodes;
+drop trigger if exists analytics_defect_rollup_upd on public.defective_electrodes;
+drop trigger if exists analytics_defect_rollup_del on public.defective_electrodes;
+create trigger analytics_defect_rollup_ins
+  after insert on public.defective_electrodes
+  referencing new table as new_rows
+  for each statement execute function public.analytics_defect_rollup();
+create trigger analytics_defect_rollup_upd
+  after update on public.defective_electrodes
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function public.analytics_defect_rollup();
+create trigger analytics_defect_rollup_del
+  after delete on public.defective_electrodes
+  referencing old table as old_rows
+  for each statement execute function public.analytics_defect_rollup();
+
+drop trigger if exists analytics_status_rollup_ins on public.electrode_status;
+drop trigger if exists analytics_status_rollup_upd on public.electrode_status;
+drop trigger if exists analytics_status_rollup_del on public.electrode_status;
+create trigger analytics_status_rollup_ins
+  after insert on public.electrode_status
+  referencing new table as new_rows
+  for each statement execute function public.analytics_electrode_status_rollup();
+create trigger analytics_status_rollup_upd
+  after update on public.electrode_status
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function public.analytics_electrode_status_rollup();
+create trigger analytics_status_rollup_del
+  after delete on public.electrode_status
+  referencing old table as old_rows
+  for each statement execute function public.analytics_electrode_status_rollup();
+
+
+-- 既存データからの初期集計 (トリガー作成と同じトランザクションで実行する)
+truncate public.analytics_defect_monthly;
+insert into public.analytics_defect_monthly (item_code, month, defect_status, defect_count)
+select item_code, date_trunc('month', defect_date)::date, defect_status, count(*)
+from public.defective_electrodes
+where item_code is not null and defect_date is not null and defect_status is not null
+group by 1, 2, 3;
+
+truncate public.analytics_shipment_weekly;
+insert into public.analytics_shipment_weekly (item_code, week, shipped_count)
+select item_code, date_trunc('week', shiped_date)::date, count(*)
+from public.electrode_status
+where item_code is not null and shiped_date is not null
+group by 1, 2;
+
+truncate public.analytics_open_backlog_weekly;
+insert into public.analytics_open_backlog_weekly (item_code, due_week, open_count)
+select item_code, date_trunc('week', giga_due_date)::date, count(*)
+from public.electrode_status
+where item_code is not null and shiped_date is null and giga_due_date is not null
+group by 1, 2;
@@ -0,0 +1,137 @@
+-- electrode_status のホット/コールド分割
+-- electrode_status は未出荷と最近出荷した行だけを持つホットなテーブルとし、
+-- 出荷から一定期間が過ぎた行(status = 'OK')は出荷実績日の年ごとのパーティションを持つ
+-- electrode_status_archive に移す。全期間を参照する場合は electrode_status_all ビューを使う。
+--
+-- electrode_status 自体はパーティション化しない(既存のビュー・主キー・トリガーをそのまま使うため)。
+-- 行の移動は public.roll_electrode_status_partitions() で行う (python partitions.py roll)。
+-- electrode_status に列を追加した場合は、electrode_status_archive にも同じ順序で追加し、
+-- electrode_status_all ビューを作り直すこと。
+
+create table if not exists public.electrode_status_archive (
+    like public.electrode_status including defaults including constraints
+) partition by range (shiped_date);
+
+-- パーティションごとに作成される(年ごとの小さな索引になるため、履歴が増えても索引のコストは一定)
+create index if not exists electrode_status_archive_item_code_idx
+    on public.electrode_status_archive (item_code);
+create index if not exists electrode_status_archive_giga_order_idx
+    on public.electrode_status_archive (giga_order_num, edaban);
+create index if not exists electrode_status_archive_shiped_date_idx
+    on public.electrode_status_archive (shiped_date);
+
+-- 全期間のデータ (archived: アーカイブに移された行)
+create or replace view public.electrode_status_all as
+select es.*, false as archived from public.electrode_status es
+union all
+select a.*, true as archived from public.electrode_status_archive a;
+
+
+-- 出荷実績日の年のパーティションがなければ作成する
+create or replace function public.ensure_electrode_status_archive_partition(target_year integer)
+returns void
+language plpgsql
+as $$
+declare
+  partition_name text := format('electrode_status_archive_%s', target_year);
+begin
+  if to_regclass(format('public.%I', partition_name)) is null then
+    execute format(
+      'create table public.%I partition of public.electrode_status_archive
+         for values from (%L) to (%L)',
+      partition_name,
+      make_date(target_year, 1, 1),
+      make_date(target_year + 1, 1, 1)
+    );
+  end if;
+end;
+$$;
+
+
+-- 出荷からretentionを過ぎた行をアーカイブへ移し、移した行数を返す
+create or replace function public.roll_electrode_status_partitions(retention interval)
+returns bigint
+language plpgsql
+as $$
+declare
+  cutoff date := current_date - retention;
+  target_year integer;
+  moved bigint;
+begin
+  for target_year in
+    select distinct extract(year from es.shiped_date)::integer
+    from public.electrode_status es
+    where es.status = 'OK' and es.shiped_date < cutoff
+  loop
+    perform public.ensure_electrode_status_archive_partition(target_year);
+  end loop;
+
+  -- 集計テーブル(002)のトリガーに、出荷の取り消しではなく移動であることを伝える
+  perform set_config('app.electrode_status_archiving', 'on', true);
+
+  with moved_rows as (
+    delete from public.electrode_status es
+    where es.status = 'OK' and es.shiped_date < cutoff
+    returning es.*
+  )
+  insert into public.electrode_status_archive
+  select * from moved_rows;
+  get diagnostics moved = row_count;
+
+  perform set_config('app.electrode_status_archiving', 'off', true);
+  return moved;
+end;
+$$;
+
+
+-- 002の集計トリガー: アーカイブへの移動では出荷数・未出荷数を変えない
+create or replace function public.analytics_electrode_status_rollup()
+returns trigger
+language plpgsql
+as $$
+begin
+  if current_setting('app.electrode_status_archiving', true) = 'on' then
+    return null;
+  end if;
+
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into public.analytics_shipment_weekly as t (item_code, week, shipped_count)
+    select item_code, date_trunc('week', shiped_date)::date, count(*)
+    from new_rows
+    where item_code is not null and shiped_date is not null
+    group by 1, 2
+    on conflict (item_code, week)
+    do update set shipped_count = t.shipped_count + excluded.shipped_count;
+
+    insert into public.analytics_open_backlog_weekly as t (item_code, due_week, open_count)
+    select item_code, date_trunc('week', giga_due_date)::date, count(*)
+    from new_rows
+    where item_code is not null and shiped_date is null and giga_due_date is not null
+    group by 1, 2
+    on conflict (item_code, due_week)
+    do update set open_count = t.open_count + excluded.open_count;
+  end if;
+
+  if tg_op in ('UPDATE', 'DELETE') then
+    insert into public.analytics_shipment_weekly as t (item_code, week, shipped_count)
+    select item_code, date_trunc('week', shiped_date)::date, -count(*)
+    from old_rows
+    where item_code is not null and shiped_date is not null
+    group by 1, 2
+    on conflict (item_code, week)
+    do update set shipped_count = t.shipped_count + excluded.shipped_count;
+
+    insert into public.analytics_open_backlog_weekly as t (item_code, due_week, open_count)
+    select item_code, date_trunc('week', giga_due_date)::date, -count(*)
+    from old_rows
+    where item_code is not null and shiped_date is null and giga_due_date is not null
+    group by 1, 2
+    on conflict (item_code, due_week)
+    do update set open_count = t.open_count + excluded.open_count;
+
+    delete from public.analytics_shipment_weekly where shipped_count = 0;
+    delete from public.analytics_open_backlog_weekly where open_count = 0;
+  end if;
+  return null;
+end;
+$$;
@@ -0,0 +1,16 @@
+-- 受注の明細(ギガ注番・枝番)の一意キー
+-- 新規受注登録(order_management_linde.py)の INSERT ... ON CONFLICT と、
+-- 出荷状況更新(update_syukka_status.py)の一括 UPDATE ... FROM は (giga_order_num, edaban) で行を特定する。
+-- 同時に登録した場合も同じ明細が重複して作成されないように、一意インデックスを作成する。
+--
+-- 一意キーはホットなテーブル(electrode_status)のみに作成する。アーカイブ(003)へ移した受注の
+-- 重複登録は、アプリケーション側でelectrode_status_allを確認して防ぐ。
+--
+-- 作成前に重複がないことを確認すること (重複がある場合はインデックスの作成に失敗する):
+--   select giga_order_num, edaban, count(*)
+--   from public.electrode_status
+--   group by giga_order_num, edaban
+--   having count(*) > 1;
+
+create unique index concurrently if not exists electrode_status_giga_order_edaban_key
+    on public.electrode_status (giga_order_num, edaban);
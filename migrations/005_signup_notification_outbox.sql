@@ -0,0 +1,23 @@
+-- 新規ユーザー登録の管理者への通知 (アウトボックス)
+-- サインアップ(sign_in.py)はこのテーブルに1行書き込むだけで、メールの送信は待たない。
+-- バックグラウンドの送信処理(mailer.py)が未送信の行をまとめて、管理者ごとに1通のメールで通知する。
+-- 送信に失敗した行は attempts を増やし、next_attempt_at まで待ってから再送する。
+
+create table if not exists public.signup_notification_outbox (
+    id bigint generated always as identity primary key,
+    new_user_email text not null,
+    created_at timestamptz not null default now(),
+    attempts integer not null default 0,
+    next_attempt_at timestamptz not null default now(),
+    last_error text,
+    sent_at timestamptz
+);
+
+-- 未送信の行のみを対象にする部分インデックス (送信処理の取得用)
+create index if not exists signup_notification_outbox_pending_idx
+    on public.signup_notification_outbox (next_attempt_at, id)
+    where sent_at is null;
+
+-- 登録したメールアドレスを含むため、REST API(anon/authenticated)からは読み書きさせない
+-- (アプリケーションはデータベースに直接接続して読み書きする)
+alter table public.signup_notification_outbox enable row level security;
@@ -0,0 +1,16 @@
+-- 外部システム向けのJSON API(api.py)のアクセストークン
+-- トークン自体は保存せず、SHA-256のハッシュのみを保存する(発行時に一度だけ表示する)。
+-- トークンで読み取れるかどうかは、発行先のユーザーの user_roles.can_read で判定する。
+-- 発行・失効は python api.py create-token / revoke-token で行う。
+
+create table if not exists public.api_tokens (
+    id bigint generated always as identity primary key,
+    user_id uuid not null references auth.users (id) on delete cascade,
+    name text not null,
+    token_hash text not null unique,
+    created_at timestamptz not null default now(),
+    revoked_at timestamptz
+);
+
+-- トークンのハッシュを含むため、REST API(anon/authenticated)からは読み書きさせない
+alter table public.api_tokens enable row level security;
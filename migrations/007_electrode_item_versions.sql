@@ -0,0 +1,82 @@
+-- 品目ごとのデータのバージョン
+-- electrode_status / electrode_status_archive / defective_electrodes への書き込み時に、
+-- ステートメント単位のトリガーで書き込まれた品目の version を1つ増やす。
+-- 溶射電極状況表示(main_contents.py)は、重いUNIONのクエリを実行する前にこのテーブルを主キーで参照し、
+-- バージョンが変わっていない品目はキャッシュ済みのDataFrameを再利用する。
+-- 行がない品目はバージョン0として扱うため、既存データからの初期化は不要。
+
+create table if not exists public.electrode_item_versions (
+    item_code text primary key,
+    version bigint not null,
+    updated_at timestamptz not null default now()
+);
+
+-- RESTなどRLSの対象のロールによる書き込みでも更新できるように、所有者の権限で実行する
+create or replace function public.bump_electrode_item_versions()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  -- 同じ品目を同時に書き込む場合のデッドロックを避けるため、品目の順に更新する
+  if tg_op = 'INSERT' then
+    insert into public.electrode_item_versions as v (item_code, version)
+    select distinct item_code, 1 from new_rows where item_code is not null
+    order by item_code
+    on conflict (item_code)
+    do update set version = v.version + 1, updated_at = now();
+  elsif tg_op = 'DELETE' then
+    insert into public.electrode_item_versions as v (item_code, version)
+    select distinct item_code, 1 from old_rows where item_code is not null
+    order by item_code
+    on conflict (item_code)
+    do update set version = v.version + 1, updated_at = now();
+  else
+    insert into public.electrode_item_versions as v (item_code, version)
+    select item_code, 1
+    from (
+      select item_code from new_rows
+      union
+      select item_code from old_rows
+    ) changed
+    where item_code is not null
+    order by item_code
+    on conflict (item_code)
+    do update set version = v.version + 1, updated_at = now();
+  end if;
+  return null;
+end;
+$$;
+
+-- 遷移テーブルを使うトリガーはイベントごとに作成する必要がある
+-- (electrode_status_archiveはパーティションテーブルの親に作成し、すべてのパーティションへの書き込みを対象にする)
+do $$
+declare
+  target text;
+begin
+  foreach target in array array['electrode_status', 'electrode_status_archive', 'defective_electrodes']
+  loop
+    execute format('drop trigger if exists %I on public.%I', target || '_item_version_ins', target);
+    execute format('drop trigger if exists %I on public.%I', target || '_item_version_upd', target);
+    execute format('drop trigger if exists %I on public.%I', target || '_item_version_del', target);
+    execute format(
+      'create trigger %I after insert on public.%I
+         referencing new table as new_rows
+         for each statement execute function public.bump_electrode_item_versions()',
+      target || '_item_version_ins', target);
+    execute format(
+      'create trigger %I after update on public.%I
+         referencing old table as old_rows new table as new_rows
+         for each statement execute function public.bump_electrode_item_versions()',
+      target || '_item_version_upd', target);
+    execute format(
+      'create trigger %I after delete on public.%I
+         referencing old table as old_rows
+         for each statement execute function public.bump_electrode_item_versions()',
+      target || '_item_version_del', target);
+  end loop;
+end;
+$$;
+
+alter table public.electrode_item_versions enable row level security;
@@ -0,0 +1,121 @@
+-- 溶射電極の変更履歴
+-- electrode_status / electrode_status_archive / defective_electrodes への書き込みを、
+-- ステートメント単位のトリガーで追記専用の electrode_change_history に記録する。
+-- UPDATE は値が変わった列だけを変更前(old_values)・変更後(new_values)として保存し、
+-- update_dt / updated_at だけが変わった行は記録しない。INSERT / DELETE は行全体を保存する。
+-- 変更者はアプリ(util.supabase_execute_sql)が書き込みの前に設定する app.user_email、
+-- REST API 経由の場合は JWT の email、どちらもなければ接続ユーザー名を記録する。
+-- アーカイブへの移動(003, app.electrode_status_archiving = 'on')は変更ではないため記録しない。
+--
+-- 「シリアルXの履歴」「ギガ注番Yの変更」は (キー, changed_at desc) のインデックスで引く。
+-- 履歴は時刻順に追記されるだけなので、期間での絞り込みと古い履歴の削除には
+-- パーティションではなく changed_at の BRIN インデックスを使う(数年分でも数MB程度)。
+
+create table if not exists public.electrode_change_history (
+    id bigint generated always as identity primary key,
+    changed_at timestamptz not null default now(),
+    table_name text not null,
+    operation text not null check (operation in ('INSERT', 'UPDATE', 'DELETE')),
+    row_id bigint,
+    item_code text,
+    serial_num text,
+    giga_order_num text,
+    changed_by text not null,
+    old_values jsonb,
+    new_values jsonb
+);
+
+create index if not exists electrode_change_history_serial_idx
+    on public.electrode_change_history (serial_num, changed_at desc);
+create index if not exists electrode_change_history_order_idx
+    on public.electrode_change_history (giga_order_num, changed_at desc)
+    where giga_order_num is not null;
+create index if not exists electrode_change_history_changed_at_brin
+    on public.electrode_change_history using brin (changed_at);
+
+-- RESTなどRLSの対象のロールによる書き込みでも記録できるように、所有者の権限で実行する
+create or replace function public.capture_electrode_changes()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  actor text := coalesce(
+    nullif(current_setting('app.user_email', true), ''),
+    nullif(current_setting('request.jwt.claims', true), '')::jsonb ->> 'email',
+    session_user
+  );
+begin
+  if current_setting('app.electrode_status_archiving', true) = 'on' then
+    return null;
+  end if;
+
+  if tg_op = 'INSERT' then
+    insert into public.electrode_change_history
+      (table_name, operation, row_id, item_code, serial_num, giga_order_num, changed_by, old_values, new_values)
+    select tg_table_name, 'INSERT', (n.j ->> 'id')::bigint, n.j ->> 'item_code',
+           coalesce(n.j ->> 'sirial_num', n.j ->> 'serial_num'), n.j ->> 'giga_order_num',
+           actor, null, n.j
+    from (select to_jsonb(r) as j from new_rows r) n;
+  elsif tg_op = 'DELETE' then
+    insert into public.electrode_change_history
+      (table_name, operation, row_id, item_code, serial_num, giga_order_num, changed_by, old_values, new_values)
+    select tg_table_name, 'DELETE', (o.j ->> 'id')::bigint, o.j ->> 'item_code',
+           coalesce(o.j ->> 'sirial_num', o.j ->> 'serial_num'), o.j ->> 'giga_order_num',
+           actor, o.j, null
+    from (select to_jsonb(r) as j from old_rows r) o;
+  else
+    insert into public.electrode_change_history
+      (table_name, operation, row_id, item_code, serial_num, giga_order_num, changed_by, old_values, new_values)
+    select tg_table_name, 'UPDATE', (n.j ->> 'id')::bigint, n.j ->> 'item_code',
+           coalesce(n.j ->> 'sirial_num', n.j ->> 'serial_num'),
+           coalesce(n.j ->> 'giga_order_num', o.j ->> 'giga_order_num'),
+           actor, d.old_values, d.new_values
+    from (select to_jsonb(r) as j from old_rows r) o
+    join (select to_jsonb(r) as j from new_rows r) n on n.j -> 'id' = o.j -> 'id'
+    cross join lateral (
+      select jsonb_object_agg(e.key, o.j -> e.key) as old_values,
+             jsonb_object_agg(e.key, e.value) as new_values
+      from jsonb_each(n.j) e
+      where e.key not in ('update_dt', 'updated_at')
+        and (o.j -> e.key) is distinct from e.value
+    ) d
+    where d.new_values is not null;
+  end if;
+  return null;
+end;
+$$;
+
+-- 遷移テーブルを使うトリガーはイベントごとに作成する必要がある
+do $$
+declare
+  target text;
+begin
+  foreach target in array array['electrode_status', 'electrode_status_archive', 'defective_electrodes']
+  loop
+    execute format('drop trigger if exists %I on public.%I', target || '_history_ins', target);
+    execute format('drop trigger if exists %I on public.%I', target || '_history_upd', target);
+    execute format('drop trigger if exists %I on public.%I', target || '_history_del', target);
+    execute format(
+      'create trigger %I after insert on public.%I
+         referencing new table as new_rows
+         for each statement execute function public.capture_electrode_changes()',
+      target || '_history_ins', target);
+    execute format(
+      'create trigger %I after update on public.%I
+         referencing old table as old_rows new table as new_rows
+         for each statement execute function public.capture_electrode_changes()',
+      target || '_history_upd', target);
+    execute format(
+      'create trigger %I after delete on public.%I
+         referencing old table as old_rows
+         for each statement execute function public.capture_electrode_changes()',
+      target || '_history_del', target);
+  end loop;
+end;
+$$;
+
+-- 追記専用: REST API(anon/authenticated)からは読み書きさせず、更新・削除の権限も与えない
+alter table public.electrode_change_history enable row level security;
+revoke update, delete, truncate on public.electrode_change_history from public, anon, authenticated;
@@ -0,0 +1,160 @@
+-- 受注ごとの集計テーブル (受注管理の受注編集・削除の検索で使用)
+-- electrode_status への書き込み時に、ステートメント単位のトリガーで書き込まれたギガ注番の受注だけを
+-- 集計し直す。1受注の行数は受注数と同じで少ないため、(giga_order_num, edaban)の一意キー(004)で
+-- 該当する行だけを読み取る。検索はこのテーブルだけを参照し、条件とページングをSQLで行う。
+--
+-- 集計はホットなテーブル(electrode_status)のみが対象。アーカイブ(003)へ移した行は受注編集の
+-- 対象ではないため、移動時に集計から外れる(すべての行を移した受注は集計から削除される)。
+-- 同じ受注を同時に書き込むトランザクションが古い集計で上書きしないように、electrode_statusに書き込む
+-- 処理は書き込みの前にギガ注番のアドバイザリロック(util.advisory_lock_query)を取得する。
+-- トリガーではロックを取得しない (行ロックの後にアドバイザリロックを待つと、先にアドバイザリロックを
+-- 取得して行ロックを待つ書き込みとデッドロックするため)。ギガ注番が事前に分からないアーカイブへの移動
+-- (partitions.py roll)はelectrode_statusのテーブルロックで他の書き込みと直列にする。
+-- 1つのトランザクションで実行する。
+
+create table if not exists public.order_summary (
+    giga_order_num text not null,
+    item_code text not null,
+    linde_order_num text,
+    giga_due_date date,
+    -- 判定中・廃棄・保留を除いた受注数 (受注編集の検索結果の「受注数」)
+    order_qty integer not null,
+    serial_count integer not null,
+    shipped_count integer not null,
+    -- 状況ごとの件数 (状況がない行は空文字のキー)
+    status_counts jsonb not null,
+    updated_at timestamptz not null default now(),
+    -- ギガ納期の降順でキーセットページングを行うための並び順のキー (納期がない受注は最後)
+    sort_due date generated always as (coalesce(giga_due_date, date '0001-01-01')) stored,
+    primary key (giga_order_num, item_code)
+);
+
+create index if not exists order_summary_sort_idx
+    on public.order_summary (sort_due desc, giga_order_num desc, item_code desc);
+create index if not exists order_summary_item_sort_idx
+    on public.order_summary (item_code, sort_due desc, giga_order_num desc);
+-- 注番の前方一致検索用
+create index if not exists order_summary_giga_order_prefix_idx
+    on public.order_summary (giga_order_num text_pattern_ops);
+create index if not exists order_summary_linde_order_prefix_idx
+    on public.order_summary (linde_order_num text_pattern_ops);
+
+
+-- 指定したギガ注番の受注を集計し直す
+create or replace function public.refresh_order_summary(orders text[])
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  if orders is null or cardinality(orders) = 0 then
+    return;
+  end if;
+
+  -- 呼び出し元がギガ注番のロックを取得済みのため、先に書き込んだトランザクションの結果を含めて集計する
+  insert into public.order_summary as s
+    (giga_order_num, item_code, linde_order_num, giga_due_date,
+     order_qty, serial_count, shipped_count, status_counts, updated_at)
+  select
+    giga_order_num,
+    item_code,
+    max(linde_order_num),
+    max(giga_due_date),
+    coalesce(sum(row_count) filter (where status not in ('判定中', '廃棄', '保留')), 0),
+    sum(serial_count),
+    sum(shipped_count),
+    jsonb_object_agg(status, row_count),
+    now()
+  from (
+    select
+      es.giga_order_num::text as giga_order_num,
+      es.item_code,
+      coalesce(es.status, '') as status,
+      count(*) as row_count,
+      max(es.linde_order_num::text) as linde_order_num,
+      max(es.giga_due_date)::date as giga_due_date,
+      count(es.sirial_num) as serial_count,
+      count(es.shiped_date) as shipped_count
+    from public.electrode_status es
+    where es.giga_order_num::text = any(orders) and es.item_code is not null
+    group by 1, 2, 3
+  ) per_status
+  group by giga_order_num, item_code
+  on conflict (giga_order_num, item_code)
+  do update set
+    linde_order_num = excluded.linde_order_num,
+    giga_due_date = excluded.giga_due_date,
+    order_qty = excluded.order_qty,
+    serial_count = excluded.serial_count,
+    shipped_count = excluded.shipped_count,
+    status_counts = excluded.status_counts,
+    updated_at = excluded.updated_at;
+
+  -- 行がなくなった受注(削除、品目の変更、アーカイブへの移動)を集計から外す
+  delete from public.order_summary s
+  where s.giga_order_num = any(orders)
+    and not exists (
+      select 1
+      from public.electrode_status es
+      where es.giga_order_num::text = s.giga_order_num and es.item_code = s.item_code
+    );
+end;
+$$;
+
+create or replace function public.order_summary_refresh_trigger()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  if tg_op = 'INSERT' then
+    perform public.refresh_order_summary(
+      array(select distinct giga_order_num::text from new_rows where giga_order_num is not null)
+    );
+  elsif tg_op = 'DELETE' then
+    perform public.refresh_order_summary(
+      array(select distinct giga_order_num::text from old_rows where giga_order_num is not null)
+    );
+  else
+    perform public.refresh_order_summary(
+      array(
+        select giga_order_num::text from new_rows where giga_order_num is not null
+        union
+        select giga_order_num::text from old_rows where giga_order_num is not null
+      )
+    );
+  end if;
+  return null;
+end;
+$$;
+
+-- 遷移テーブルを使うトリガーはイベントごとに作成する必要がある
+drop trigger if exists electrode_status_order_summary_ins on public.electrode_status;
+create trigger electrode_status_order_summary_ins
+  after insert on public.electrode_status
+  referencing new table as new_rows
+  for each statement execute function public.order_summary_refresh_trigger();
+
+drop trigger if exists electrode_status_order_summary_upd on public.electrode_status;
+create trigger electrode_status_order_summary_upd
+  after update on public.electrode_status
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function public.order_summary_refresh_trigger();
+
+drop trigger if exists electrode_status_order_summary_del on public.electrode_status;
+create trigger electrode_status_order_summary_del
+  after delete on public.electrode_status
+  referencing old table as old_rows
+  for each statement execute function public.order_summary_refresh_trigger();
+
+alter table public.order_summary enable row level security;
+
+
+-- 既存データからの初期集計 (トリガー作成と同じトランザクションで実行する)
+-- トリガーの作成でelectrode_statusへの書き込みはコミットまで待つため、集計の途中で変わらない
+truncate public.order_summary;
+select public.refresh_order_summary(
+  array(select distinct giga_order_num::text from public.electrode_status where giga_order_num is not null)
+);
@@ -0,0 +1,21 @@
+-- アーカイブ(003)の行の更新を分析ダッシュボードの集計(002)に反映する
+-- 出荷状況更新(update_syukka_status.py)は、アーカイブに移した出荷済みの行の出荷実績日・シリアルも更新する。
+-- electrode_status と同じ集計トリガーを electrode_status_archive に作成し、差分を加減算する。
+-- アーカイブへの移動(app.electrode_status_archiving = 'on')では、集計関数が何もしないため二重に数えない。
+-- (electrode_status_archiveはパーティションテーブルの親に作成し、すべてのパーティションへの書き込みを対象にする)
+
+drop trigger if exists analytics_status_rollup_ins on public.electrode_status_archive;
+drop trigger if exists analytics_status_rollup_upd on public.electrode_status_archive;
+drop trigger if exists analytics_status_rollup_del on public.electrode_status_archive;
+create trigger analytics_status_rollup_ins
+  after insert on public.electrode_status_archive
+  referencing new table as new_rows
+  for each statement execute function public.analytics_electrode_status_rollup();
+create trigger analytics_status_rollup_upd
+  after update on public.electrode_status_archive
+  referencing old table as old_rows new table as new_rows
+  for each statement execute function public.analytics_electrode_status_rollup();
+create trigger analytics_status_rollup_del
+  after delete on public.electrode_status_archive
+  referencing old table as old_rows
+  for each statement execute function public.analytics_electrode_status_rollup();
@@ -0,0 +1,8 @@
+-- 新規登録の通知の送信済みの宛先 (005のアウトボックスに追加)
+-- 送信処理(mailer.py)は送信に成功した管理者を delivered_to に記録し、再送ではまだ届いていない管理者にだけ送る。
+-- すべての管理者に届いた行を送信済み(sent_at)にする。
+-- 送信中の行は next_attempt_at を MAILER_CLAIM_TIMEOUT 秒後に進めて確保し、ロックを持たずにSMTPで送信する。
+-- (送信処理が途中で止まった場合は、その時刻を過ぎると他のプロセスが再送する)
+
+alter table public.signup_notification_outbox
+    add column if not exists delivered_to text[] not null default '{}';
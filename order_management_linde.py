@@ -2,7 +2,20 @@ import streamlit as st
 import time
 import polars as pl
 import datetime
-from util import supabase_read_sql, supabase_execute_sql, fetch_user_roles
+import functools
+import io
+import json
+import metrics
+import prefetch
+from shared_cache import shared_cache, tracking_reads
+from util import (
+    advisory_lock_query,
+    supabase_read_sql,
+    supabase_read_statement,
+    supabase_execute_sql,
+    fetch_user_roles,
+    read_statement,
+)
 
 item_codes = []
 
@@ -31,16 +44,7 @@ def main():
         st.error("このページにアクセスする権限がありません。")
         return
 
-    # 品目リストをデータベースから取得 (キャッシュを活用)
-    @st.cache_data(ttl=10)  # 10秒キャッシュ
-    def get_item_codes():
-        df = supabase_read_sql(
-            "SELECT DISTINCT item_code FROM public.electrode_status ORDER BY item_code"
-        )
-        if not df.is_empty():
-            return df["item_code"].to_list()
-        return []
-
+    # 品目リストをデータベースから取得 (共有キャッシュを活用)
     item_codes = get_item_codes()
 
     # --- UIの定義 (タブの代わりにst.radioを使用して状態を維持) ---
@@ -65,6 +69,21 @@ def main():
     elif selected_tab == "受注編集・削除":
         render_edit_order_form()
 
+@shared_cache(tables=("electrode_status",), ttl=600)
+def _fetch_item_code_frame() -> pl.DataFrame:
+    return supabase_read_sql(
+        "SELECT DISTINCT item_code FROM public.electrode_status ORDER BY item_code"
+    )
+
+
+def get_item_codes() -> list[str]:
+    """品目コードのリストを返す"""
+    df = _fetch_item_code_frame()
+    if not df.is_empty():
+        return df["item_code"].to_list()
+    return []
+
+
 def render_new_order_form():
     """新規受注登録フォームをレンダリングする"""
     st.header("新規受注登録")
@@ -104,33 +123,14 @@ def render_new_order_form():
                 return
 
             # --- 登録処理 ---
-            queries = []
-            base_sql_columns = "giga_order_num, item_code, giga_due_date, edaban"
-            base_sql_values = ":giga_order_num, :item_code, :giga_due_date, :edaban"
-            base_params = {
+            order = {
                 "giga_order_num": giga_order_num,
                 "item_code": item_code,
                 "giga_due_date": giga_due_date,
+                "order_qty": order_qty,
+                "linde_order_num": linde_order_num or None,
             }
-
-            # リンデ注番がある場合、SQLとパラメータに追加
-            if linde_order_num:
-                sql_columns = f"linde_order_num, {base_sql_columns}"
-                sql_values = f":linde_order_num, {base_sql_values}"
-                base_params["linde_order_num"] = linde_order_num
-            else:
-                sql_columns = base_sql_columns
-                sql_values = base_sql_values
-
-            # 受注数の回数だけINSERT文を生成
-            for i in range(order_qty):
-                params = base_params.copy()
-                params["edaban"] = i + 1
-                sql = f"""
-                    INSERT INTO public.electrode_status ({sql_columns})
-                    VALUES ({sql_values});
-                """
-                queries.append({"sql": sql, "params": params})
+            queries = build_order_insert_queries([order], skip_existing=False)
 
             # トランザクションで一括実行
             with st.spinner("データベースに登録しています..."):
@@ -180,48 +180,44 @@ def render_new_ordercsv_form():
         if insert_button:
             # --- 登録処理 ---
 
-            queries = []
+            # 登録済みのギガ注番は1回のクエリでまとめて確認する
+            existing = fetch_existing_giga_orders(df["ギガ注番"].astype(str).tolist())
+            orders = []
             for _, row in df.iterrows():
-                giga_order_num = row["ギガ注番"]
-                item_code = row["品目"]
-                giga_due_date = row["ギガ納期"]
-                order_qty = int(row["受注数"])
+                giga_order_num = str(row["ギガ注番"])
                 linde_order_num = row.get("リンデ注番", None)
 
-                if is_giga_order_exist(giga_order_num):
+                if giga_order_num in existing:
                     st.warning(f"ギガ注番 `{giga_order_num}` は既に登録されています。スキップします。")
                     continue
+                existing.add(giga_order_num)
 
-                base_sql_columns = "giga_order_num, item_code, giga_due_date, edaban"
-                base_sql_values = ":giga_order_num, :item_code, :giga_due_date, :edaban"
-                base_params = {
-                    "giga_order_num": giga_order_num,
-                    "item_code": item_code,
-                    "giga_due_date": giga_due_date,
-                }
+                orders.append(
+                    {
+                        "giga_order_num": giga_order_num,
+                        "item_code": row["品目"],
+                        "giga_due_date": row["ギガ納期"],
+                        "order_qty": int(row["受注数"]),
+                        "linde_order_num": linde_order_num if pd.notna(linde_order_num) else None,
+                    }
+                )
 
-                if linde_order_num:
-                    sql_columns = f"linde_order_num, {base_sql_columns}"
-                    sql_values = f":linde_order_num, {base_sql_values}"
-                    base_params["linde_order_num"] = linde_order_num
-                else:
-                    sql_columns = base_sql_columns
-                    sql_values = base_sql_values
-
-                for i in range(order_qty):
-                    params = base_params.copy()
-                    params["edaban"] = i + 1
-                    sql = f"""
-                        INSERT INTO public.electrode_status ({sql_columns})
-                        VALUES ({sql_values});
-                    """
-                    queries.append({"sql": sql, "params": params})
+            if not orders:
+                st.info("登録する受注データはありません。")
+                return
 
+            order_count = sum(order["order_qty"] for order in orders)
             with st.spinner("データベースに登録しています..."):
-                success = supabase_execute_sql(queries, use_transaction=True)
+                started = time.perf_counter()
+                success = supabase_execute_sql(
+                    build_order_insert_queries(orders), use_transaction=True
+                )
+                metrics.record_upload(
+                    "order_csv", time.perf_counter() - started, order_count, success
+                )
 
             if success:
-                st.success(f"{len(queries)}件の受注データを正常に登録しました。")
+                st.success(f"{order_count}件の受注データを正常に登録しました。")
                 st.balloons()
             else:
                 st.error("登録処理中にエラーが発生しました。")
@@ -230,30 +226,88 @@ def render_edit_order_form():
     """受注編集・削除フォームをレンダリングする"""
     st.header("受注編集・削除")
 
+    # 一括変更の結果 (更新後の再実行で一度だけ表示する)
+    bulk_result = st.session_state.pop("bulk_order_update_result", None)
+    if bulk_result is not None:
+        st.success(
+            f"{bulk_result['orders']}件の受注 ({bulk_result['rows']}行) を更新しました。"
+        )
+        st.dataframe(bulk_result["summary"], hide_index=True)
+
+    render_bulk_order_list_form()
+
     # --- 検索フォーム ---
     st.markdown("##### 編集・削除したい受注を検索してください")
-    search_item = st.selectbox(
-        "品目で検索",
-        options=item_codes,
-        index=None,
-        placeholder="品目を選択してください",
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        search_item = st.selectbox(
+            "品目で検索",
+            options=item_codes,
+            index=None,
+            placeholder="すべての品目",
+        )
+        open_only = st.toggle("未出荷の受注のみ", value=False, key="order_search_open_only")
+    with col2:
+        search_giga_order = st.text_input("ギガ注番 (前方一致)", "").strip()
+        search_linde_order = st.text_input("リンデ注番 (前方一致)", "").strip()
+    with col3:
+        due_from = st.date_input("ギガ納期 (From)", value=None, key="order_search_due_from")
+        due_to = st.date_input("ギガ納期 (To)", value=None, key="order_search_due_to")
+    page_size = st.selectbox(
+        "1ページの表示件数", options=[50, 100, 200], index=1, key="order_search_page_size"
     )
 
-    if not search_item:
-        st.info("品目を選択してください。")
-        return
-
-    # --- 検索実行 ---
+    filters = {
+        "item_code": search_item,
+        "giga_order_num": search_giga_order or None,
+        "linde_order_num": search_linde_order or None,
+        "due_from": due_from,
+        "due_to": due_to,
+        "open_only": open_only,
+    }
+
+    # --- 検索実行 (ページ単位) ---
+    cursors = _order_search_cursors(repr(sorted(filters.items())) + f"|{page_size}")
     with st.spinner("受注データを検索中..."):
-        search_df = fetch_electrode_status_list(item_code=search_item, limit=100)
+        search_df, has_next = fetch_order_search_page(filters, cursors[-1], page_size)
+    page_no = len(cursors)
 
     if search_df.is_empty():
-        st.warning("品番に一致する受注データは見つかりませんでした。")
+        st.warning("条件に一致する受注データは見つかりませんでした。")
         return
 
     # --- 検索結果表示と行選択 ---
     st.markdown("##### 検索結果")
-    st.info("編集または削除したい行を選択してください。")
+    nav_prev, nav_info, nav_next = st.columns([1, 3, 1])
+    with nav_prev:
+        if st.button("◀ 前へ", disabled=page_no == 1, key="order_search_prev"):
+            cursors.pop()
+            st.rerun()
+    with nav_info:
+        st.caption(
+            f"{(page_no - 1) * page_size + 1} - "
+            f"{(page_no - 1) * page_size + search_df.height} 件目 ({page_no} ページ)"
+        )
+    with nav_next:
+        if st.button("次へ ▶", disabled=not has_next, key="order_search_next"):
+            cursors.append(_order_search_cursor(search_df))
+            st.rerun()
+    if has_next:
+        # 次のページを先読みしておく
+        prefetch.schedule(
+            [
+                functools.partial(
+                    warm_order_search_page,
+                    dict(filters),
+                    _order_search_cursor(search_df),
+                    page_size,
+                )
+            ]
+        )
+    st.info(
+        "編集または削除したい行を選択してください。"
+        "複数行を選択すると、ギガ納期とリンデ注番をまとめて変更できます。"
+    )
 
     # 日付列を文字列に変換して表示
     display_df = search_df.with_columns(pl.col("ギガ納期").dt.strftime("%Y-%m-%d"))
@@ -262,16 +316,22 @@ def render_edit_order_form():
     if "selected_order" not in st.session_state:
         st.session_state.selected_order = {"rows": []}
 
+    # ページごとにキーを分け、別のページの行選択が残らないようにする
     event = st.dataframe(
         display_df,
         on_select="rerun",
-        selection_mode="single-row",
-        key="search_results_df",
+        selection_mode="multi-row",
+        key=f"search_results_df_{page_no}",
+        column_config={"sort_due": None},
     )
     st.session_state.selected_order = event.selection
 
+    selected_rows = st.session_state.selected_order["rows"]
+    if len(selected_rows) > 1:
+        render_bulk_order_edit_form(search_df[selected_rows])
+
     # --- 編集・削除フォーム ---
-    if st.session_state.selected_order["rows"]:
+    if len(selected_rows) == 1:
         selected_row_index = st.session_state.selected_order["rows"][0]
         selected_order = search_df[selected_row_index]
 
@@ -318,7 +378,11 @@ def render_edit_order_form():
                 }
                 with st.spinner("データを更新しています..."):
                     success = supabase_execute_sql(
-                        [update_query], use_transaction=False
+                        [
+                            advisory_lock_query("electrode_status", [giga_order_num]),
+                            update_query,
+                        ],
+                        use_transaction=True,
                     )
 
                 if success:
@@ -346,7 +410,11 @@ def render_edit_order_form():
                 }
                 with st.spinner("データを削除しています..."):
                     success = supabase_execute_sql(
-                        [delete_query], use_transaction=False
+                        [
+                            advisory_lock_query("electrode_status", [giga_order_num]),
+                            delete_query,
+                        ],
+                        use_transaction=True,
                     )
 
                 if success:
@@ -363,58 +431,359 @@ def render_edit_order_form():
                     st.session_state.pop("deleted")
 
 
-def fetch_electrode_status_list(
-    item_code: str, limit: int = 50, params: dict = None
+# 一括変更の一覧の列 (ギガ納期・リンデ注番は少なくとも一方が必要)
+BULK_EDIT_COLUMNS = ["ギガ注番", "品目", "ギガ納期", "リンデ注番"]
+
+
+def render_bulk_order_edit_form(selected_df: pl.DataFrame):
+    """選択した複数の受注のギガ納期・リンデ注番をまとめて変更するフォームをレンダリングする"""
+    st.markdown("---")
+    st.markdown(f"##### 選択した{selected_df.height}件の受注をまとめて変更します")
+    with st.form("bulk_order_edit_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            set_due = st.checkbox("ギガ納期を変更する")
+            new_due = st.date_input("新しいギガ納期", value=datetime.date.today())
+        with col2:
+            set_linde = st.checkbox("リンデ注番を変更する")
+            new_linde = st.text_input("新しいリンデ注番 (空欄の場合は削除)")
+        submitted = st.form_submit_button("まとめて更新", type="primary")
+
+    if not submitted:
+        return
+    if not (set_due or set_linde):
+        st.error("変更する項目を選択してください。")
+        return
+
+    changes = []
+    for giga_order_num, item_code in zip(
+        selected_df["ギガ注番"].to_list(), selected_df["品目"].to_list()
+    ):
+        change = {"giga_order_num": giga_order_num, "item_code": item_code}
+        if set_due:
+            change["giga_due_date"] = new_due
+        if set_linde:
+            change["linde_order_num"] = new_linde.strip() or None
+        changes.append(change)
+    run_bulk_order_update(changes, fetch_order_summaries(changes))
+
+
+def render_bulk_order_list_form():
+    """貼り付け・CSVファイルの一覧で、受注ごとに異なるギガ納期・リンデ注番をまとめて変更するフォームをレンダリングする"""
+    with st.expander("一覧で一括変更する (貼り付け・CSVファイル)", expanded=False):
+        st.caption(
+            f"1行目は見出し ({', '.join(BULK_EDIT_COLUMNS)})。"
+            "変更しない値は空欄、リンデ注番を削除する場合は「-」を入力してください。"
+        )
+        pasted = st.text_area(
+            "Excelなどからの貼り付け (タブ区切り) またはCSV", key="bulk_order_paste"
+        )
+        csvfile = st.file_uploader(
+            "CSVファイル (Shift-JIS/CP932)", type=["csv"], key="bulk_order_file"
+        )
+        if csvfile is not None:
+            try:
+                text = csvfile.getvalue().decode("cp932")
+            except UnicodeDecodeError as e:
+                st.error(f"CSVファイルのエンコードに問題があります。Shift-JISまたはCP932形式のファイルをアップロードしてください: {e}")
+                return
+        elif pasted.strip():
+            text = pasted
+        else:
+            return
+
+        try:
+            changes, invalid_df = parse_bulk_order_changes(text)
+        except Exception as e:
+            st.error(f"一覧の読み込み中にエラーが発生しました: {e}")
+            return
+        if not invalid_df.is_empty():
+            st.warning(f"変更できない行が{invalid_df.height}件あります。")
+            st.dataframe(invalid_df, hide_index=True)
+
+        current_df = fetch_order_summaries(changes)
+        found = (
+            set(zip(current_df["ギガ注番"].to_list(), current_df["品目"].to_list()))
+            if not current_df.is_empty()
+            else set()
+        )
+        missing = [
+            f"{change['giga_order_num']} ({change['item_code']})"
+            for change in changes
+            if (change["giga_order_num"], change["item_code"]) not in found
+        ]
+        if missing:
+            st.warning(f"登録されていない受注はスキップします: {', '.join(missing)}")
+        changes = [
+            change
+            for change in changes
+            if (change["giga_order_num"], change["item_code"]) in found
+        ]
+        if not changes:
+            st.info("変更する受注はありません。")
+            return
+
+        st.markdown(f"##### 変更内容の確認 ({len(changes)}件の受注)")
+        st.dataframe(summarize_bulk_order_changes(current_df, changes), hide_index=True)
+        if st.button("一括更新する", type="primary", key="bulk_order_list_submit"):
+            run_bulk_order_update(changes, current_df)
+
+
+def parse_bulk_order_changes(text: str) -> tuple[list[dict], pl.DataFrame]:
+    """
+    一括変更の一覧(タブ区切りまたはカンマ区切り)を読み込み、受注ごとの変更内容に変換する
+    同じ受注が複数行ある場合は後の行を使う。
+    Args:
+        text (str): 1行目が見出しの一覧
+    Returns:
+        tuple[list[dict], pl.DataFrame]: 変更内容のリストと、変更できない行(理由の列を含む)
+            変更内容は giga_order_num, item_code と、変更する値(giga_due_date, linde_order_num)のみを持つ辞書
+    """
+    first_line = text.lstrip().splitlines()[0]
+    separator = "\t" if "\t" in first_line else ","
+    df = pl.read_csv(
+        io.BytesIO(text.strip().encode("utf-8")), separator=separator, infer_schema=False
+    )
+    df = df.rename({col: col.strip() for col in df.columns})
+    for col in ["ギガ注番", "品目"]:
+        if col not in df.columns:
+            raise ValueError(f"必須列 '{col}' がありません。")
+    if "ギガ納期" not in df.columns and "リンデ注番" not in df.columns:
+        raise ValueError("'ギガ納期' または 'リンデ注番' の列が必要です。")
+    for col in BULK_EDIT_COLUMNS:
+        if col not in df.columns:
+            df = df.with_columns(pl.lit(None, dtype=pl.String).alias(col))
+    df = df.select(
+        [pl.col(col).str.strip_chars().replace("", None).alias(col) for col in BULK_EDIT_COLUMNS]
+    ).with_columns(
+        pl.col("ギガ納期")
+        .str.replace_all("/", "-")
+        .str.to_date("%Y-%m-%d", strict=False)
+        .alias("_due_date")
+    )
+
+    reason = (
+        pl.when(pl.col("ギガ注番").is_null() | pl.col("品目").is_null())
+        .then(pl.lit("ギガ注番と品目は必須です"))
+        .when(pl.col("ギガ納期").is_not_null() & pl.col("_due_date").is_null())
+        .then(pl.lit("ギガ納期の形式が正しくありません (YYYY-MM-DD)"))
+        .when(pl.col("ギガ納期").is_null() & pl.col("リンデ注番").is_null())
+        .then(pl.lit("変更する値がありません"))
+        .otherwise(None)
+        .alias("理由")
+    )
+    df = df.with_columns(reason)
+    invalid_df = df.filter(pl.col("理由").is_not_null()).drop("_due_date")
+
+    changes = {}
+    for row in df.filter(pl.col("理由").is_null()).iter_rows(named=True):
+        change = {"giga_order_num": row["ギガ注番"], "item_code": row["品目"]}
+        if row["_due_date"] is not None:
+            change["giga_due_date"] = row["_due_date"]
+        if row["リンデ注番"] is not None:
+            change["linde_order_num"] = None if row["リンデ注番"] == "-" else row["リンデ注番"]
+        changes[(row["ギガ注番"], row["品目"])] = change
+    return list(changes.values()), invalid_df
+
+
+def fetch_order_summaries(changes: list[dict]) -> pl.DataFrame:
+    """
+    変更する受注の現在のギガ納期・リンデ注番と行数を1回のクエリで取得する
+    Args:
+        changes (list[dict]): 変更内容のリスト (giga_order_num, item_code を持つ辞書)
+    Returns:
+        pl.DataFrame: 登録されている受注のみのデータフレーム
+    """
+    return supabase_read_statement(
+        "order_summary_lookup",
+        parameters={
+            "giga_order_nums": [str(change["giga_order_num"]) for change in changes],
+            "item_codes": [change["item_code"] for change in changes],
+        },
+    )
+
+
+def summarize_bulk_order_changes(
+    current_df: pl.DataFrame, changes: list[dict]
 ) -> pl.DataFrame:
+    """受注ごとの変更前と変更後の値、対象の行数の一覧を作成する"""
+    current = {
+        (row["ギガ注番"], row["品目"]): row for row in current_df.iter_rows(named=True)
+    }
+    rows = []
+    for change in changes:
+        row = current.get((change["giga_order_num"], change["item_code"]))
+        if row is None:
+            continue
+        rows.append(
+            {
+                "ギガ注番": change["giga_order_num"],
+                "品目": change["item_code"],
+                "行数": row["行数"],
+                "ギガ納期 (変更前)": row["ギガ納期"],
+                "ギガ納期 (変更後)": change.get("giga_due_date", row["ギガ納期"]),
+                "リンデ注番 (変更前)": row["リンデ注番"],
+                "リンデ注番 (変更後)": change.get("linde_order_num", row["リンデ注番"]),
+            }
+        )
+    return pl.DataFrame(
+        rows,
+        schema={
+            "ギガ注番": pl.String,
+            "品目": pl.String,
+            "行数": pl.Int64,
+            "ギガ納期 (変更前)": pl.Date,
+            "ギガ納期 (変更後)": pl.Date,
+            "リンデ注番 (変更前)": pl.String,
+            "リンデ注番 (変更後)": pl.String,
+        },
+    )
+
+
+def run_bulk_order_update(changes: list[dict], current_df: pl.DataFrame):
+    """一括変更を実行し、結果を次の再実行で表示する"""
+    with st.spinner("データを更新しています..."):
+        started = time.perf_counter()
+        success, updated_rows = update_orders(changes)
+        metrics.record_upload(
+            "order_bulk_edit", time.perf_counter() - started, len(changes), success
+        )
+    if not success:
+        st.error("更新処理中にエラーが発生しました。")
+        return
+    st.session_state["bulk_order_update_result"] = {
+        "orders": len(changes),
+        "rows": updated_rows,
+        "summary": summarize_bulk_order_changes(current_df, changes),
+    }
+    st.rerun()
+
+
+def update_orders(changes: list[dict]) -> tuple[bool, int]:
+    """
+    複数の受注のギガ納期・リンデ注番を1回のUPDATEで更新する
+    変更内容の辞書にキーがある値のみを更新する(リンデ注番のNoneは削除)。
+    同じギガ注番を書き込む他の登録・更新とは、ギガ注番ごとのアドバイザリロックで順番に実行する。
+    Args:
+        changes (list[dict]): 変更内容のリスト
+            各要素は giga_order_num, item_code と、giga_due_date, linde_order_num(任意) を持つ辞書
+    Returns:
+        tuple[bool, int]: 成功したかどうかと、更新した行数
     """
-    user_rolesテーブルからデータを取得し、Polars DataFrameとして返す
+    # 列の型はelectrode_statusの定義に合わせて変換される
+    query = """
+UPDATE public.electrode_status es
+SET giga_due_date = CASE WHEN r.j ? 'giga_due_date' THEN u.giga_due_date ELSE es.giga_due_date END,
+    linde_order_num = CASE WHEN r.j ? 'linde_order_num' THEN u.linde_order_num ELSE es.linde_order_num END,
+    update_dt = now()
+FROM
+    jsonb_array_elements(CAST(:rows AS jsonb)) AS r(j)
+    CROSS JOIN LATERAL jsonb_populate_record(NULL::public.electrode_status, r.j) AS u
+WHERE
+    es.giga_order_num = u.giga_order_num
+    AND es.item_code = u.item_code
+"""
+    queries = [
+        advisory_lock_query(
+            "electrode_status", [change["giga_order_num"] for change in changes]
+        ),
+        {"sql": query, "params": {"rows": json.dumps(changes, default=str)}},
+    ]
+    row_counts = []
+    success = supabase_execute_sql(queries, use_transaction=True, row_counts=row_counts)
+    return success, row_counts[-1] if success else 0
+
+
+def fetch_electrode_status_list(item_code: str, limit: int = 50) -> pl.DataFrame:
+    """
+    品目ごとの受注一覧を取得し、Polars DataFrameとして返す
     Args:
         item_code (str): 品目コード
+        limit (int): 取得する最大件数
     Returns:
         pl.DataFrame: Polarsデータフレーム
     """
-    parameters = {"item_code": item_code, "limit": limit}
-    if params is not None:
-        listWheres = []
-        for key in params.keys():
-            strWhere = f"AND {key} = :{key}"
-            listWheres.append(strWhere)
-        strWheres = " \n".join(listWheres)
-        parameters = parameters | params
-    else:
-        strWheres = ""
-
-    query = f"""
-    -- 通常の電極ステータス (不具合登録されていないもの)
-    SELECT
-        linde_order_num AS "リンデ注番",
-        giga_order_num AS "ギガ注番",
-        item_code AS "品目",
-        giga_due_date AS "ギガ納期",
-        status AS "状況",
-        count(*) AS 受注数,
-        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END) AS "sn有"
-    FROM
-        public.electrode_status es
-    WHERE
-        es.item_code = :item_code
-        AND COALESCE(es.status, '') not in ('判定中', '廃棄', '保留')
-        {strWheres}
-    GROUP BY
-        linde_order_num,
-        giga_order_num,
-        item_code,
-        giga_due_date,
-        status,
-        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END)
-    ORDER BY
-        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END),
-        giga_due_date DESC,
-        giga_order_num DESC
-    LIMIT :limit
+    return supabase_read_statement(
+        "order_list_by_item", parameters={"item_code": item_code, "limit": limit}
+    )
+
+
+def fetch_order_search_page(
+    filters: dict, cursor: tuple | None, page_size: int
+) -> tuple[pl.DataFrame, bool]:
+    """
+    受注編集・削除の検索結果を(ギガ納期, ギガ注番, 品目)の降順で1ページ分取得する
+    受注ごとの集計テーブル(migrations/009_order_summary.sql)を参照するため、履歴の量によらず一定の時間で取得できる。
+    Args:
+        filters (dict): 絞り込み条件 (item_code, giga_order_num, linde_order_num, due_from, due_to, open_only)
+            注番は前方一致で絞り込む。
+        cursor (tuple | None): 前のページの最終行の(並び順のキー, ギガ注番, 品目)。先頭ページはNone
+        page_size (int): 1ページの件数
+    Returns:
+        tuple[pl.DataFrame, bool]: 1ページ分のデータと、次のページがあるかどうか
+    """
+    df = _query_order_search_page(_order_search_params(filters, cursor, page_size))
+    return df.head(page_size), df.height > page_size
+
+
+def _order_search_params(filters: dict, cursor: tuple | None, page_size: int) -> dict:
+    return {
+        "item_code": filters.get("item_code"),
+        "giga_order_pattern": _prefix_pattern(filters.get("giga_order_num")),
+        "linde_order_pattern": _prefix_pattern(filters.get("linde_order_num")),
+        "due_from": filters.get("due_from"),
+        "due_to": filters.get("due_to"),
+        "open_only": bool(filters.get("open_only")),
+        "after_due": cursor[0] if cursor else None,
+        "after_order": cursor[1] if cursor else None,
+        "after_item": cursor[2] if cursor else None,
+        # 次のページの有無を判定するため1件多く取得する
+        "limit": page_size + 1,
+    }
+
+
+def _prefix_pattern(value: str | None) -> str | None:
+    """前方一致のLIKEのパターンを返す(入力中の%と_は文字として扱う)"""
+    if not value:
+        return None
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+def _order_search_cursor(search_df: pl.DataFrame) -> tuple:
+    """ページの最終行から次のページのカーソルを作成する"""
+    last_row = search_df.row(-1, named=True)
+    return (last_row["sort_due"], last_row["ギガ注番"], last_row["品目"])
+
+
+def _order_search_cursors(filter_key: str) -> list:
+    """現在の検索条件でのページのカーソル一覧を返す(条件が変わったら先頭ページに戻す)"""
+    state = st.session_state.get("order_search_pages")
+    if state is None or state["filter_key"] != filter_key:
+        state = {"filter_key": filter_key, "cursors": [None]}
+        st.session_state["order_search_pages"] = state
+    return state["cursors"]
+
+
+@shared_cache(tables=("electrode_status",), ttl=120)
+def _query_order_search_page(parameters: dict) -> pl.DataFrame:
+    return supabase_read_statement("order_summary_page", parameters=parameters)
+
+
+def warm_order_search_page(filters: dict, cursor: tuple, page_size: int) -> None:
+    """
+    受注編集・削除の検索結果の次のページを共有キャッシュに読み込む(先読み用)
+    セッションの外で実行されるため、エラー時は例外を送出するread_statementを使用する。
     """
-    df = supabase_read_sql(query, parameters=parameters)
-    return df
+    parameters = _order_search_params(filters, cursor, page_size)
+    key = _query_order_search_page.cache_key(parameters)
+    if _query_order_search_page.lookup(key) is not None:
+        return
+    with tracking_reads() as sources:
+        df = read_statement(
+            "order_summary_page", parameters=parameters, query_class="background"
+        )
+    _query_order_search_page.store(key, df, sources)
 
 
 def is_giga_order_exist(giga_order_num: str) -> bool:
@@ -425,16 +794,84 @@ def is_giga_order_exist(giga_order_num: str) -> bool:
     Returns:
         bool: 存在する場合はTrue、存在しない場合はFalse
     """
+    return bool(fetch_existing_giga_orders([giga_order_num]))
+
+
+def fetch_existing_giga_orders(giga_order_nums: list[str]) -> set[str]:
+    """
+    指定されたギガ注番のうち、登録済み(アーカイブを含む)のものを返す
+    Args:
+        giga_order_nums (list[str]): ギガ注番のリスト
+    Returns:
+        set[str]: 登録済みのギガ注番
+    """
     query = """
-    SELECT COUNT(*) AS order_count
-    FROM public.electrode_status
-    WHERE giga_order_num = :giga_order_num;
+    SELECT DISTINCT giga_order_num::text AS giga_order_num
+    FROM public.electrode_status_all
+    WHERE giga_order_num::text = ANY(CAST(:giga_order_nums AS text[]));
     """
-    params = {"giga_order_num": giga_order_num}
+    params = {"giga_order_nums": [str(num) for num in giga_order_nums]}
     df = supabase_read_sql(query, parameters=params)
-    if not df.is_empty() and df["order_count"][0] > 0:
-        return True
-    return False
+    if df.is_empty():
+        return set()
+    return set(df["giga_order_num"].to_list())
+
+
+def build_order_insert_queries(orders: list[dict], skip_existing: bool = True) -> list[dict]:
+    """
+    新規受注を登録するクエリを作成する
+    受注ごとに受注数の回数だけ枝番(edaban)を1から採番した行を、1回のINSERTでまとめて登録する。
+    同じギガ注番を同時に登録した場合は、ギガ注番ごとのアドバイザリロックで順番に実行する。
+    Args:
+        orders (list[dict]): 受注のリスト
+            各要素は giga_order_num, item_code, giga_due_date, order_qty, linde_order_num(任意) を持つ辞書
+        skip_existing (bool, optional): Trueの場合、登録済みのギガ注番の受注は登録しない(スキップする)。
+            Falseの場合は (giga_order_num, edaban) の一意キーの違反としてトランザクション全体が失敗する。
+    Returns:
+        list[dict]: supabase_execute_sqlに渡すクエリのリスト
+    """
+    queries = [
+        advisory_lock_query(
+            "electrode_status", [order["giga_order_num"] for order in orders]
+        )
+    ]
+    skip_clause = (
+        """
+            WHERE NOT EXISTS (
+                SELECT 1 FROM public.electrode_status_all e
+                WHERE e.giga_order_num = o.giga_order_num
+            )
+            ON CONFLICT (giga_order_num, edaban) DO NOTHING"""
+        if skip_existing
+        else ""
+    )
+    # リンデ注番がない受注は列を指定せずに登録する(列の既定値を使う)
+    for with_linde in (True, False):
+        group = [order for order in orders if bool(order.get("linde_order_num")) == with_linde]
+        if not group:
+            continue
+        columns = "giga_order_num, item_code, giga_due_date, edaban"
+        if with_linde:
+            columns = f"linde_order_num, {columns}"
+        rows = [
+            {
+                "giga_order_num": order["giga_order_num"],
+                "item_code": order["item_code"],
+                "giga_due_date": order["giga_due_date"],
+                "linde_order_num": order.get("linde_order_num"),
+                "edaban": edaban,
+            }
+            for order in group
+            for edaban in range(1, order["order_qty"] + 1)
+        ]
+        # 列の型はelectrode_statusの定義に合わせて変換される
+        sql = f"""
+            INSERT INTO public.electrode_status ({columns})
+            SELECT {columns}
+            FROM jsonb_populate_recordset(NULL::public.electrode_status, CAST(:rows AS jsonb)) AS o{skip_clause};
+        """
+        queries.append({"sql": sql, "params": {"rows": json.dumps(rows, default=str)}})
+    return queries
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+"""electrode_statusのホット/コールド分割の保守
+
+出荷からARCHIVE_RETENTION_DAYSを過ぎた出荷済み(status = 'OK')の行を、
+electrode_statusから出荷実績日の年ごとのパーティションを持つelectrode_status_archiveへ移す
+(migrations/003_electrode_status_archive.sql)。
+通常の画面はelectrode_status(未出荷と最近出荷した行)だけを読み取り、
+アーカイブを含めて表示する場合はelectrode_status_allビューを読み取る。
+
+実行方法 (cronなどで1日1回程度):
+    python partitions.py roll                      # ARCHIVE_RETENTION_DAYSを過ぎた行を移す
+    python partitions.py roll --retention-days 90  # 保持日数を指定する
+"""
+
+import argparse
+import os
+
+from sqlalchemy import text
+
+from db_pool import checkout
+from shared_cache import bump_versions
+from util import conn_str, get_db_engine
+
+# 出荷後、electrode_statusに残しておく日数
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "180"))
+
+
+def roll_partitions(retention_days: int = ARCHIVE_RETENTION_DAYS) -> int:
+    """
+    保持日数を過ぎた出荷済みの行をアーカイブへ移し、依存するキャッシュを無効化する
+    Args:
+        retention_days (int, optional): 出荷後、electrode_statusに残しておく日数
+    Returns:
+        int: アーカイブへ移した行数
+    """
+    engine = get_db_engine(conn_str)
+    with checkout(engine) as connection:
+        with connection.begin():
+            # 行の移動は件数が多くなる場合があるため、接続の既定のタイムアウトを適用しない
+            connection.execute(text("SELECT set_config('statement_timeout', '0', true)"))
+            # 移す行のギガ注番ごとのロック(util.advisory_lock_query)の代わりに、受注の集計(migrations/009)の
+            # 更新が他の書き込みと重ならないように、移動が終わるまで書き込みを待たせる
+            connection.execute(
+                text("LOCK TABLE public.electrode_status IN SHARE ROW EXCLUSIVE MODE")
+            )
+            moved = connection.execute(
+                text(
+                    "SELECT public.roll_electrode_status_partitions("
+                    "make_interval(days => :days))"
+                ),
+                {"days": retention_days},
+            ).scalar_one()
+    if moved:
+        bump_versions(["electrode_status", "electrode_status_archive"])
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    roll = subparsers.add_parser("roll", help="保持日数を過ぎた出荷済みの行をアーカイブへ移す")
+    roll.add_argument(
+        "--retention-days",
+        type=int,
+        default=ARCHIVE_RETENTION_DAYS,
+        help="出荷後、electrode_statusに残しておく日数",
+    )
+    args = parser.parse_args()
+
+    if args.command == "roll":
+        moved = roll_partitions(args.retention_days)
+        print(f"Moved {moved} rows to electrode_status_archive.")
+
+
+if __name__ == "__main__":
+    main()
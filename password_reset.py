@@ -1,9 +1,13 @@
 import streamlit as st
-from supabase import create_client, Client
 import time
 import os
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 
+# Supabase SDKは読み込みに時間がかかるため、パスワードを変更する時に読み込む
+if TYPE_CHECKING:
+    from supabase import Client
+
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
@@ -13,11 +17,10 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 # Supabaseクライアントを初期化
 @st.cache_resource
-def init_supabase_client(url: str, key: str) -> Client:
-    return create_client(url, key)
+def init_supabase_client(url: str, key: str) -> "Client":
+    from supabase import create_client
 
-
-supabase: Client = init_supabase_client(SUPABASE_URL, SUPABASE_KEY)
+    return create_client(url, key)
 
 
 def password_reset_view():
@@ -49,6 +52,7 @@ def password_reset_view():
 
             try:
                 # Supabaseのユーザー情報更新メソッドを呼び出し
+                supabase = init_supabase_client(SUPABASE_URL, SUPABASE_KEY)
                 supabase.auth.update_user({"password": new_password})
                 st.success("パスワードが正常に変更されました。")
             except Exception as e:
@@ -0,0 +1,179 @@
+"""次に表示される可能性の高いデータのバックグラウンド先読み
+
+ページの描画が終わった後に、セッションで最近使った品目や次のページのデータを
+プロセス共通のスレッドプールで共有キャッシュ(shared_cache)に読み込んでおく。
+品目を切り替えたときは、キャッシュから即座に表示される。
+
+- 同時に投入できるタスク数はプロセス全体でPREFETCH_MAX_INFLIGHTまで。
+  上限に達している場合、先読みは行わない(利用者のクエリを優先する)。
+- 同じセッションで新しい先読みを投入した場合や、別のページに移動した場合は、
+  まだ実行されていないタスクを取り消す(実行中のタスクはそのまま完了させる)。
+- タスクはセッションの外で実行されるため、st.*やst.session_stateを使用してはならない。
+  エラー時に例外を送出する読み取り関数(util.read_statementなど)を使用する。
+- タスクの読み取りはレプリカに振り分けられるため、共有キャッシュへの保存はshared_cache.tracking_readsで
+  読み取り元を集めてstoreに渡す(書き込み直後のレプリカの結果は新しいバージョンのキーに保存されない)。
+- 終了したタスクはセッションの一覧から外し、タスクが残っていないセッションは一覧から削除する
+  (閉じたセッションの記録がプロセスに残り続けないようにする)。
+"""
+
+import functools
+import os
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# 0の場合、先読みを行わない
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+# 先読みに使用するスレッド数
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+# プロセス全体で同時に投入できる先読みタスクの数
+PREFETCH_MAX_INFLIGHT = int(os.getenv("PREFETCH_MAX_INFLIGHT", "8"))
+# 先読みの対象とする、セッションで最近使った品目の数
+PREFETCH_RECENT_ITEMS = int(os.getenv("PREFETCH_RECENT_ITEMS", "5"))
+
+_PAGE_KEY = "_prefetch_page"
+_RECENT_KEY = "_prefetch_recent"
+
+
+class PrefetchScheduler:
+    """セッションごとの先読みタスクを管理するスケジューラ"""
+
+    def __init__(self, workers: int, max_inflight: int):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        self._budget = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._futures: dict[str, list[Future]] = {}
+        self.submitted = 0
+        self.skipped = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.failed = 0
+
+    def schedule(self, session_id: str, tasks: Iterable[Callable[[], None]]) -> int:
+        """
+        セッションの未実行のタスクを取り消し、新しいタスクを投入する
+        Args:
+            session_id (str): セッションID
+            tasks (Iterable[Callable[[], None]]): 優先度の高い順のタスク
+        Returns:
+            int: 投入したタスクの数
+        """
+        self.cancel(session_id)
+        futures = []
+        for task in tasks:
+            if not self._budget.acquire(blocking=False):
+                self._count("skipped")
+                continue
+            future = self._executor.submit(self._run, task)
+            # 取り消された場合もコールバックが呼ばれ、枠が返却される
+            future.add_done_callback(functools.partial(self._finish, session_id))
+            futures.append(future)
+        with self._lock:
+            # 登録前に終わったタスクはコールバックで外せないため、ここで除く
+            pending = [future for future in futures if not future.done()]
+            if pending:
+                self._futures[session_id] = pending
+            self.submitted += len(futures)
+        return len(futures)
+
+    def cancel(self, session_id: str) -> int:
+        """セッションのまだ実行されていないタスクを取り消し、取り消した数を返す"""
+        with self._lock:
+            futures = self._futures.pop(session_id, [])
+        cancelled = sum(1 for future in futures if future.cancel())
+        self._count("cancelled", cancelled)
+        return cancelled
+
+    def _finish(self, session_id: str, future: Future) -> None:
+        """終了・取り消したタスクの枠を返却し、セッションの一覧から外す"""
+        self._budget.release()
+        with self._lock:
+            futures = self._futures.get(session_id)
+            if futures is None or future not in futures:
+                return
+            futures.remove(future)
+            if not futures:
+                del self._futures[session_id]
+
+    def _run(self, task: Callable[[], None]) -> None:
+        try:
+            task()
+        except Exception as e:
+            self._count("failed")
+            print(f"Prefetch failed: {e}")
+            return
+        self._count("completed")
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "skipped": self.skipped,
+                "cancelled": self.cancelled,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+
+@functools.cache
+def get_scheduler() -> PrefetchScheduler:
+    """プロセスで共通のスケジューラを返す"""
+    return PrefetchScheduler(PREFETCH_WORKERS, PREFETCH_MAX_INFLIGHT)
+
+
+def _session_id() -> str | None:
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def set_current_page(page: str) -> None:
+    """
+    表示するページを記録し、別のページに移動した場合はセッションの先読みを取り消す
+    (streamlit_app.pyでpg.run()の前に呼び出す)
+    Args:
+        page (str): ページの識別子
+    """
+    previous = st.session_state.get(_PAGE_KEY)
+    st.session_state[_PAGE_KEY] = page
+    session_id = _session_id()
+    if previous is not None and previous != page and session_id is not None:
+        get_scheduler().cancel(session_id)
+
+
+def remember_item(kind: str, item_code: str) -> None:
+    """セッションで使用した品目を新しい順に記録する"""
+    recent = st.session_state.setdefault(_RECENT_KEY, {}).setdefault(kind, [])
+    if item_code in recent:
+        recent.remove(item_code)
+    recent.insert(0, item_code)
+    del recent[PREFETCH_RECENT_ITEMS:]
+
+
+def recent_items(kind: str, exclude: Iterable[str] = ()) -> list[str]:
+    """セッションで最近使用した品目を新しい順に返す"""
+    excluded = set(exclude)
+    recent = st.session_state.get(_RECENT_KEY, {}).get(kind, [])
+    return [item_code for item_code in recent if item_code not in excluded]
+
+
+def schedule(tasks: Iterable[Callable[[], None]]) -> int:
+    """
+    現在のセッションの先読みタスクを投入する(ページの描画の最後に呼び出す)
+    Args:
+        tasks (Iterable[Callable[[], None]]): 優先度の高い順のタスク
+    Returns:
+        int: 投入したタスクの数
+    """
+    session_id = _session_id()
+    if not PREFETCH_ENABLED or session_id is None:
+        return 0
+    return get_scheduler().schedule(session_id, tasks)
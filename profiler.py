@@ -0,0 +1,239 @@
+"""管理者向けの再実行ごとのサンプリングプロファイラ
+
+管理者(user_roles.role == 'admin')が自分のセッションで有効にすると、streamlit_app.pyのpg.run()
+(1回の再実行)の間、別スレッドで一定間隔ごとにスクリプトのスレッドのスタックを記録し、
+関数ごとの時間の内訳(フレームグラフと同じ集計の表)と、フレームグラフ用のファイル(collapsed stacks形式。
+speedscopeやflamegraph.plで表示できる)をサイドバーに表示する。
+
+有効にする方法:
+    URLに ?profile=1 を付けて開く (権限を確認し、以降はサイドバーのトグルで切り替えられる)
+
+有効にしていないセッションでは、クエリパラメータとセッションの値を確認するだけで、サンプリングは行わない。
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import streamlit as st
+
+# サインインページなど、Polarsを使わないページの起動を遅くしないように、内訳を作る時に読み込む
+if TYPE_CHECKING:
+    import polars as pl
+
+# サンプリングの間隔(ミリ秒)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# 内訳の表に表示する最小の割合(%)
+PROFILE_MIN_PERCENT = float(os.getenv("PROFILE_MIN_PERCENT", "1"))
+
+_QUERY_PARAM = "profile"
+_ENABLED_KEY = "_profiler_enabled"
+_ALLOWED_KEY = "_profiler_allowed"
+
+
+@dataclass
+class Profile:
+    """1回の再実行のサンプリング結果"""
+
+    # スタック(外側から内側の関数の順) -> サンプル数
+    stacks: Counter
+    samples: int
+    elapsed: float
+    interval: float
+
+    def folded(self) -> str:
+        """collapsed stacks形式 (「関数;関数;関数 サンプル数」の行) のテキストを返す"""
+        return "\n".join(
+            f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()
+        )
+
+    def breakdown(self, min_percent: float = PROFILE_MIN_PERCENT) -> "pl.DataFrame":
+        """
+        関数ごとの時間の内訳を、呼び出しの木の順(深さ優先)で返す
+        Args:
+            min_percent (float, optional): この割合(%)未満の呼び出しは表示しない
+        Returns:
+            pl.DataFrame: 関数(深さに応じて字下げ)、全体に対する割合、時間(ミリ秒)、自身の時間(ミリ秒)
+        """
+        import polars as pl
+
+        # 呼び出しの木: パス(外側からのタプル) -> (全体のサンプル数, 自身のサンプル数)
+        inclusive: Counter = Counter()
+        exclusive: Counter = Counter()
+        for stack, count in self.stacks.items():
+            for depth in range(1, len(stack) + 1):
+                inclusive[stack[:depth]] += count
+            exclusive[stack] += count
+
+        children: dict[tuple, list[tuple]] = {}
+        for path in inclusive:
+            children.setdefault(path[:-1], []).append(path)
+
+        total = max(self.samples, 1)
+        # GILの待ちなどで間隔どおりに記録できない場合があるため、実行時間をサンプル数で按分する
+        sample_ms = self.elapsed * 1000 / total
+        rows = []
+
+        def visit(path: tuple) -> None:
+            for child in sorted(children.get(path, []), key=lambda p: -inclusive[p]):
+                percent = inclusive[child] * 100 / total
+                if percent < min_percent:
+                    continue
+                rows.append(
+                    {
+                        "関数": "  " * (len(child) - 1) + child[-1],
+                        "割合(%)": round(percent, 1),
+                        "時間(ms)": round(inclusive[child] * sample_ms, 1),
+                        "自身の時間(ms)": round(exclusive[child] * sample_ms, 1),
+                    }
+                )
+                visit(child)
+
+        visit(())
+        return pl.DataFrame(
+            rows,
+            schema={
+                "関数": pl.String,
+                "割合(%)": pl.Float64,
+                "時間(ms)": pl.Float64,
+                "自身の時間(ms)": pl.Float64,
+            },
+        )
+
+
+class SamplingProfiler:
+    """指定したスレッドのスタックを一定間隔で記録するプロファイラ"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+        self._samples = 0
+
+    def profile(self, func: Callable[[], None]) -> Profile:
+        """
+        funcを現在のスレッドで実行し、その間のスタックを記録する(funcの例外はそのまま送出する)
+        Args:
+            func (Callable[[], None]): 計測する処理
+        Returns:
+            Profile: サンプリング結果
+        """
+        thread_id = threading.get_ident()
+        # 呼び出し元までのスタックは記録から除く
+        skip = _stack_depth(sys._getframe())
+        sampler = threading.Thread(
+            target=self._sample, args=(thread_id, skip), name="profiler", daemon=True
+        )
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            func()
+        finally:
+            self._stop.set()
+            sampler.join()
+        return Profile(
+            stacks=self._stacks,
+            samples=self._samples,
+            elapsed=time.perf_counter() - started,
+            interval=self.interval,
+        )
+
+    def _sample(self, thread_id: int, skip: int) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.reverse()
+            # 先頭はprofile()自身のフレーム
+            stack = tuple(stack[skip + 1 :])
+            if stack:
+                self._stacks[stack] += 1
+                self._samples += 1
+
+
+def _stack_depth(frame) -> int:
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth - 1
+
+
+def _is_admin() -> bool:
+    from util import fetch_user_roles
+
+    user_email = st.session_state.get("user_email")
+    if not st.session_state.get("authenticated") or not user_email:
+        return False
+    user_roles_df = fetch_user_roles(email=user_email)
+    return not user_roles_df.is_empty() and user_roles_df["role"][0] == "admin"
+
+
+def is_enabled() -> bool:
+    """
+    このセッションの再実行をプロファイルするかどうかを返す
+    ?profile=1で開いた場合に一度だけ管理者であることを確認し、以降はサイドバーのトグルで切り替える。
+    """
+    requested = st.query_params.get(_QUERY_PARAM)
+    if requested is None and not st.session_state.get(_ALLOWED_KEY):
+        return False
+    if _ALLOWED_KEY not in st.session_state:
+        st.session_state[_ALLOWED_KEY] = _is_admin()
+        if not st.session_state[_ALLOWED_KEY]:
+            return False
+        st.session_state[_ENABLED_KEY] = requested == "1"
+    if not st.session_state[_ALLOWED_KEY]:
+        return False
+    st.sidebar.toggle("再実行をプロファイルする", key=_ENABLED_KEY)
+    return st.session_state[_ENABLED_KEY]
+
+
+def run(page_run: Callable[[], None]) -> None:
+    """
+    ページを実行する。プロファイルが有効な場合は実行の内訳をサイドバーに表示する
+    (streamlit_app.pyでpg.run()の代わりに呼び出す)
+    Args:
+        page_run (Callable[[], None]): ページを実行する関数 (pg.run)
+    """
+    if not is_enabled():
+        page_run()
+        return
+    # st.rerun()などで実行が中断された場合は、結果を表示せずにそのまま送出する
+    profile = SamplingProfiler().profile(page_run)
+    render(profile)
+
+
+def render(profile: Profile) -> None:
+    """プロファイルの結果をサイドバーに表示する"""
+    with st.sidebar.expander("プロファイル (この再実行)", expanded=True):
+        st.caption(
+            f"実行時間 {profile.elapsed * 1000:.0f} ms / "
+            f"サンプル {profile.samples} 件 ({profile.interval * 1000:.0f} ms 間隔)"
+        )
+        st.dataframe(
+            profile.breakdown(),
+            hide_index=True,
+            column_config={
+                "割合(%)": st.column_config.ProgressColumn(
+                    "割合(%)", min_value=0, max_value=100, format="%.1f"
+                ),
+            },
+        )
+        st.download_button(
+            "フレームグラフ用のファイル (collapsed stacks)",
+            data=profile.folded().encode("utf-8"),
+            file_name=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded",
+            mime="text/plain",
+        )
@@ -1,7 +1,9 @@
 import streamlit as st
 import time
 import polars as pl
-from util import supabase_read_sql, fetch_user_roles
+import snapshot
+import statements
+from util import supabase_read_statement, fetch_user_roles
 
 
 def main():
@@ -35,8 +37,13 @@ def main():
         "最新の出荷実績日の表示件数を指定して下さい。", options=limit_options, index=0
     )
 
+    include_archive = st.toggle(
+        "アーカイブ(過去の出荷済みデータ)も検索する", value=False, key="shipments_include_archive"
+    )
+    scope = "all" if include_archive else "hot"
+
     # 出荷実績データの取得
-    shipped_date_list = fetch_recent_shipment_dates(limit=selected_limit)
+    shipped_date_list = fetch_recent_shipment_dates(limit=selected_limit, scope=scope)
 
     if shipped_date_list:
         # フィルター用の選択肢を作成（「すべて」を追加）
@@ -50,7 +57,7 @@ def main():
             target_dates = [selected_date]
 
         # 選択された日付でデータを取得
-        shipment_df = fetch_shipment_data(target_dates)
+        shipment_df = fetch_shipment_data(target_dates, scope=scope)
 
         # 検索フィルター
         with st.expander("検索条件で絞り込む", expanded=False):
@@ -83,63 +90,43 @@ def main():
         st.info("表示対象の出荷データがありません。")
 
 
-def fetch_recent_shipment_dates(limit: int = 5) -> list[str]:
+def fetch_recent_shipment_dates(limit: int = 5, scope: str = "hot") -> list[str]:
     """
     指定された件数の最新出荷実績日を取得してリストとして返す
     Args:
         limit (int): 取得する件数. Defaults to 5.
+        scope (str): 読み取る範囲。hotは未出荷と最近出荷した行のみ、allはアーカイブを含む全期間. Defaults to "hot".
     Returns:
         list[str]: 出荷実績日の文字列リスト
     """
-    dates_query = """
-    SELECT DISTINCT shiped_date
-    FROM public.electrode_status
-    WHERE shiped_date IS NOT NULL
-    ORDER BY shiped_date DESC
-    LIMIT :limit
-    """
-    dates_df = supabase_read_sql(dates_query, parameters={"limit": limit})
+    # スナップショットモードで有効なスナップショットがあればSQLを実行しない
+    snapshot_dates = snapshot.fetch_recent_shipment_dates(limit, scope)
+    if snapshot_dates is not None:
+        return snapshot_dates
+
+    dates_df = supabase_read_statement(
+        statements.scoped("recent_shipment_dates", scope), parameters={"limit": limit}
+    )
     if dates_df.is_empty():
         return []
 
     return dates_df["shiped_date"].dt.strftime("%Y-%m-%d").to_list()
 
 
-def fetch_shipment_data(target_dates: list[str]) -> pl.DataFrame:
+def fetch_shipment_data(target_dates: list[str], scope: str = "hot") -> pl.DataFrame:
     """
     指定された出荷実績日に基づいて出荷データを取得し、ギガ注番ごとにシリアルを集約して返す
     Args:
         target_dates (list[str]): 取得対象の出荷実績日リスト (YYYY-MM-DD形式)
+        scope (str): 読み取る範囲 (hot/all). Defaults to "hot".
     Returns:
         pl.DataFrame: 集計された出荷データのDataFrame
     """
     if not target_dates:
         return pl.DataFrame()
-    target_dates_template_str = ", ".join(
-        [f":date{i}" for i, date in enumerate(target_dates)]
-    )
-    parameters = {f"date{i}": date for i, date in enumerate(target_dates)}
-    data_query = f"""
-    SELECT
-        es.shiped_date as "出荷実績日",
-        MAX(es.linde_order_num) as "リンデ注番",
-        es.giga_order_num as "ギガ注番",
-        MAX(es.item_code) as "品目",
-        MAX(es.giga_due_date) as "ギガ納期",
-        string_agg(es.sirial_num::text, ',' ORDER BY es.sirial_num) as "シリアル",
-        string_agg(es.remarks, ',' ORDER BY es.sirial_num) as "備考"
-    FROM
-        public.electrode_status es
-    WHERE
-        es.shiped_date In ({target_dates_template_str})
-    GROUP BY
-        es.shiped_date, es.giga_order_num
-    ORDER BY
-        "出荷実績日" DESC,
-        "ギガ納期" DESC,
-        "ギガ注番" DESC
-    """
-    shipped_df = supabase_read_sql(data_query, parameters=parameters)
+    shipped_df = snapshot.fetch_shipment_data(target_dates, scope)
+    if shipped_df is None:
+        shipped_df = _query_shipment_data(target_dates, scope)
 
     # 日付列をYYYY-MM-DD形式に変換
     date_columns_to_format = ["出荷実績日", "ギガ納期"]
@@ -155,5 +142,14 @@ def fetch_shipment_data(target_dates: list[str]) -> pl.DataFrame:
     return shipped_df
 
 
+def _query_shipment_data(target_dates: list[str], scope: str) -> pl.DataFrame:
+    """出荷データをデータベースから取得する"""
+    # 日付のリストは配列として1つのパラメータで渡すため、件数によらず同じステートメントになる
+    return supabase_read_statement(
+        statements.scoped("shipments_by_dates", scope),
+        parameters={"dates": target_dates},
+    )
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,115 @@
+"""セッションごとに保持するDataFrameのメモリ管理
+
+- セッション内で再利用するDataFrameは、セッションごとのメモリ予算(SESSION_FRAME_BUDGET_MB)の範囲で
+  保持し、超えた場合は最も長く使われていないものから破棄する(LRU)。
+- 保持したDataFrameは、バージョンが同じでも保存から一定の秒数(max_age)を過ぎたものは使わない。
+- 値の種類が少ない文字列の列はCategoricalに変換して保持する。
+- 表示用の書式化(日付の文字列化など)は、表示するページの行だけに行う。
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+import polars as pl
+import streamlit as st
+
+# 1セッションで保持するDataFrameの合計サイズの上限(MB)
+SESSION_FRAME_BUDGET_MB = float(os.getenv("SESSION_FRAME_BUDGET_MB", "64"))
+
+# Categoricalとして保持する列 (値の種類が少ない列)
+CATEGORICAL_COLUMNS = ("品目", "状況", "ギガ注番")
+
+_FRAMES_KEY = "_session_frames"
+
+
+def compact(df: pl.DataFrame, columns: tuple[str, ...] = CATEGORICAL_COLUMNS) -> pl.DataFrame:
+    """
+    文字列の列のうち値の種類が少ないものをCategoricalに変換する
+    Args:
+        df (pl.DataFrame): 対象のデータフレーム
+        columns (tuple[str, ...], optional): 変換する列。存在しない列と文字列以外の列は無視する
+    Returns:
+        pl.DataFrame: 変換後のデータフレーム
+    """
+    targets = [c for c in columns if c in df.columns and df[c].dtype == pl.String]
+    if not targets:
+        return df
+    return df.with_columns(pl.col(targets).cast(pl.Categorical))
+
+
+def _frames() -> "OrderedDict[str, tuple[str, pl.DataFrame, int, float]]":
+    return st.session_state.setdefault(_FRAMES_KEY, OrderedDict())
+
+
+def get(key: str, version: str, max_age: float | None = None) -> pl.DataFrame | None:
+    """
+    セッションで保持しているDataFrameを返す(バージョンが異なる場合と、max_ageを過ぎた場合はNone)
+    Args:
+        key (str): DataFrameのキー
+        version (str): 期待するバージョン (依存するテーブルのバージョンなど)
+        max_age (float | None, optional): 保存からの有効秒数。Noneの場合は期限なし
+    Returns:
+        pl.DataFrame | None: 保持しているDataFrame
+    """
+    frames = _frames()
+    entry = frames.get(key)
+    if entry is None or entry[0] != version:
+        return None
+    if max_age is not None and time.monotonic() - entry[3] > max_age:
+        del frames[key]
+        return None
+    frames.move_to_end(key)
+    return entry[1]
+
+
+def put(key: str, version: str, df: pl.DataFrame) -> None:
+    """
+    DataFrameをセッションに保持し、メモリ予算を超えた分を古い順に破棄する
+    直前に保存したDataFrameは、単独で予算を超える場合も保持する。
+    Args:
+        key (str): DataFrameのキー
+        version (str): DataFrameのバージョン
+        df (pl.DataFrame): 保持するDataFrame
+    """
+    frames = _frames()
+    frames[key] = (version, df, df.estimated_size(), time.monotonic())
+    frames.move_to_end(key)
+    budget = SESSION_FRAME_BUDGET_MB * 1024 * 1024
+    total = sum(size for _, _, size, _ in frames.values())
+    while total > budget and len(frames) > 1:
+        _, (_, _, size, _) = frames.popitem(last=False)
+        total -= size
+
+
+def usage() -> dict:
+    """セッションで保持しているDataFrameの数と合計サイズ(バイト)を返す"""
+    frames = _frames()
+    return {
+        "frames": len(frames),
+        "bytes": sum(size for _, _, size, _ in frames.values()),
+    }
+
+
+def format_page(
+    df: pl.DataFrame, page: int, page_size: int, date_columns: list[str]
+) -> pl.DataFrame:
+    """
+    表示するページの行だけを取り出し、日付列をYYYY-MM-DD形式の文字列に変換する
+    Args:
+        df (pl.DataFrame): 表示対象のデータフレーム全体
+        page (int): ページ番号 (1始まり)
+        page_size (int): 1ページの件数
+        date_columns (list[str]): 文字列に変換する日付列
+    Returns:
+        pl.DataFrame: 表示用のデータフレーム
+    """
+    page_df = df.slice((page - 1) * page_size, page_size)
+    targets = [
+        c
+        for c in date_columns
+        if c in page_df.columns and page_df[c].dtype in (pl.Date, pl.Datetime)
+    ]
+    if not targets:
+        return page_df
+    return page_df.with_columns(pl.col(targets).dt.strftime("%Y-%m-%d"))
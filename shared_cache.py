@@ -0,0 +1,328 @@
+"""プロセス間で共有するクエリ結果のキャッシュ
+
+st.cache_data はプロセス毎のキャッシュのため、Streamlitを複数プロセスで動かすと
+プロセスの数だけキャッシュが冷えた状態になる。このモジュールのキャッシュは
+同じホストの全プロセスで共有され、DataFrameをArrow IPC形式のファイルとして保存する
+(読み込みはメモリマップで行う)。
+
+各エントリは依存するテーブルのバージョンをキーに含む。テーブルへの書き込み時に
+bump_versionでバージョンを更新すると、古いエントリは参照されなくなる。
+レプリカ・スナップショットから読み取った結果は書き込みを含まない可能性があるため、
+新しいバージョンのキーには保存しない(_cacheable参照)。
+"""
+
+import contextlib
+import functools
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+
+import polars as pl
+
+# キャッシュの実装 ("disk" または "none")
+SHARED_CACHE_BACKEND = os.getenv("SHARED_CACHE_BACKEND", "disk")
+# ディスクキャッシュの保存先
+SHARED_CACHE_DIR = os.getenv(
+    "SHARED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "electrode-cache")
+)
+# この秒数より古いエントリのファイルを削除する
+SHARED_CACHE_MAX_AGE_SECONDS = float(os.getenv("SHARED_CACHE_MAX_AGE_SECONDS", "3600"))
+# レプリカの遅延の上限とみなす秒数。テーブルのバージョンを更新してからこの秒数の間は、
+# レプリカから読み取った結果を保存しない (utilのread-your-writesの期間と同じ設定を使う)
+SHARED_CACHE_REPLICA_LAG_SECONDS = float(
+    os.getenv("POSTGRE_READ_YOUR_WRITES_SECONDS", "10")
+)
+
+# スレッドごとの読み取り元の記録 (tracking_readsの中でのみ記録する)
+_reads = threading.local()
+# 共有キャッシュを参照せずに読み取る条件 (utilが書き込み直後のセッションの判定を登録する)
+_lookup_bypass: Callable[[], bool] = lambda: False
+
+
+class CacheBackend(ABC):
+    """キャッシュの実装の基底クラス
+
+    キャッシュの保存先を変える場合は、このクラスを継承してget_cache_backendで返す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str, ttl: float) -> pl.DataFrame | None:
+        """キーのエントリを返す(ttl秒より古い場合と、ない場合はNone)"""
+
+    @abstractmethod
+    def set(self, key: str, df: pl.DataFrame) -> None:
+        """キーのエントリを保存する"""
+
+    @abstractmethod
+    def table_version(self, table: str) -> str:
+        """テーブルの現在のバージョンを返す"""
+
+    @abstractmethod
+    def bump_version(self, table: str) -> None:
+        """テーブルのバージョンを更新する"""
+
+    def version_updated_at(self, table: str) -> float | None:
+        """テーブルのバージョンを更新した時刻(UNIX時刻)を返す。分からない場合はNone"""
+        return None
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class NullCacheBackend(CacheBackend):
+    """キャッシュを行わない実装"""
+
+    def get(self, key: str, ttl: float) -> pl.DataFrame | None:
+        self._count("misses")
+        return None
+
+    def set(self, key: str, df: pl.DataFrame) -> None:
+        pass
+
+    def table_version(self, table: str) -> str:
+        return "0"
+
+    def bump_version(self, table: str) -> None:
+        pass
+
+
+class DiskArrowCache(CacheBackend):
+    """ローカルディスクにArrow IPCファイルとして保存する実装
+
+    ファイルは一時ファイルに書き出してから置き換えるため、
+    複数プロセスが同時に読み書きしても壊れたエントリを読むことはない。
+    """
+
+    # この回数のsetごとに期限切れのファイルを削除する
+    _EVICT_EVERY = 100
+
+    def __init__(self, directory: str, max_age: float):
+        super().__init__()
+        self.entries_dir = os.path.join(directory, "entries")
+        self.versions_dir = os.path.join(directory, "versions")
+        self.max_age = max_age
+        self._sets = 0
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def _entry_path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.entries_dir, f"{digest}.arrow")
+
+    def _write_atomic(self, path: str, write: Callable[[str], None]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key: str, ttl: float) -> pl.DataFrame | None:
+        path = self._entry_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                self._count("misses")
+                return None
+            df = pl.read_ipc(path, memory_map=True)
+        except OSError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return df
+
+    def set(self, key: str, df: pl.DataFrame) -> None:
+        self._write_atomic(self._entry_path(key), df.write_ipc)
+        with self._lock:
+            self._sets += 1
+            evict = self._sets % self._EVICT_EVERY == 0
+        if evict:
+            self.evict_expired()
+
+    def evict_expired(self) -> int:
+        """max_ageより古いエントリを削除し、削除した件数を返す"""
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.entries_dir):
+            try:
+                if now - entry.stat().st_mtime > self.max_age:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                # 他のプロセスが先に削除した場合など
+                continue
+        self._count("evictions", removed)
+        return removed
+
+    def table_version(self, table: str) -> str:
+        try:
+            with open(os.path.join(self.versions_dir, table), encoding="utf-8") as f:
+                return f.read().strip() or "0"
+        except OSError:
+            return "0"
+
+    def version_updated_at(self, table: str) -> float | None:
+        try:
+            return os.path.getmtime(os.path.join(self.versions_dir, table))
+        except OSError:
+            # 一度も更新していないテーブル
+            return 0.0
+
+    def bump_version(self, table: str) -> None:
+        # 一意な値で置き換えるため、複数プロセスが同時に更新してもロックは不要
+        token = f"{time.time_ns()}-{os.getpid()}"
+
+        def _write(tmp_path: str) -> None:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(token)
+
+        self._write_atomic(os.path.join(self.versions_dir, table), _write)
+
+
+@functools.cache
+def get_cache_backend() -> CacheBackend:
+    """設定に応じたキャッシュの実装を返す(プロセス内で1つ)"""
+    if SHARED_CACHE_BACKEND == "disk":
+        try:
+            return DiskArrowCache(SHARED_CACHE_DIR, SHARED_CACHE_MAX_AGE_SECONDS)
+        except OSError as e:
+            print(f"Shared cache disabled: {e}")
+    return NullCacheBackend()
+
+
+def bump_versions(tables: Iterable[str]) -> None:
+    """テーブルのバージョンを更新し、そのテーブルに依存するキャッシュを無効化する"""
+    backend = get_cache_backend()
+    for table in tables:
+        backend.bump_version(table)
+
+
+def tables_version(tables: Iterable[str]) -> str:
+    """テーブルのバージョンを連結した文字列を返す(いずれかのテーブルへの書き込みで変わる)"""
+    backend = get_cache_backend()
+    return ",".join(f"{t}={backend.table_version(t)}" for t in tables)
+
+
+def set_lookup_bypass(check: Callable[[], bool]) -> None:
+    """共有キャッシュを参照せずにデータベースから読み取る条件を登録する (書き込み直後のセッションなど)"""
+    global _lookup_bypass
+    _lookup_bypass = check
+
+
+def record_read(source: str) -> None:
+    """
+    読み取り元を記録する (tracking_readsの外では何もしない)
+    Args:
+        source (str): "primary" / "replica" / "snapshot"
+    """
+    sources = getattr(_reads, "sources", None)
+    if sources is not None:
+        sources.add(source)
+
+
+@contextlib.contextmanager
+def tracking_reads() -> Iterator[set[str]]:
+    """ブロック内の読み取り元を集める (storeに渡して、保存してよい結果かを判定する)"""
+    outer = getattr(_reads, "sources", None)
+    sources: set[str] = set()
+    _reads.sources = sources
+    try:
+        yield sources
+    finally:
+        _reads.sources = outer
+        if outer is not None:
+            outer |= sources
+
+
+def _cacheable(tables: Iterable[str], sources: Iterable[str]) -> bool:
+    """
+    読み取り元から、結果を現在のバージョンのキーで保存してよいかを判定する
+    スナップショットは作成時点のデータのため保存しない。レプリカは直前の書き込みが反映されていない
+    可能性があるため、依存するテーブルのバージョンの更新からSHARED_CACHE_REPLICA_LAG_SECONDSが
+    経っている場合のみ保存する。
+    """
+    sources = set(sources)
+    if "snapshot" in sources:
+        return False
+    if "replica" not in sources:
+        return True
+    backend = get_cache_backend()
+    now = time.time()
+    for table in tables:
+        updated_at = backend.version_updated_at(table)
+        if updated_at is None or now - updated_at < SHARED_CACHE_REPLICA_LAG_SECONDS:
+            return False
+    return True
+
+
+def shared_cache(tables: tuple[str, ...], ttl: float = 300):
+    """DataFrameを返す関数の結果を共有キャッシュに保存するデコレータ
+
+    空のDataFrameは取得エラーの可能性があるため保存しない。
+    書き込み直後のセッション(set_lookup_bypass)はキャッシュを参照せずに関数を実行する。
+    複数の引数の結果をまとめて取得する呼び出し元のために、関数を実行せずにキャッシュを
+    読み書きするcache_key, lookup, storeを属性として持つ。キーには作成時点のテーブルの
+    バージョンが含まれるため、取得の前にキーを作成しておく。storeには取得をtracking_readsで
+    囲んで集めた読み取り元を渡す。
+    Args:
+        tables (tuple[str, ...]): 結果が依存するテーブル名
+        ttl (float, optional): エントリの有効秒数。デフォルトは300。
+    """
+
+    def decorator(func: Callable[..., pl.DataFrame]) -> Callable[..., pl.DataFrame]:
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        def cache_key(*args, **kwargs) -> str:
+            return f"{name}|{args!r}|{sorted(kwargs.items())!r}|{tables_version(tables)}"
+
+        def lookup(key: str) -> pl.DataFrame | None:
+            if _lookup_bypass():
+                return None
+            return get_cache_backend().get(key, ttl)
+
+        def store(key: str, df: pl.DataFrame, sources: Iterable[str]) -> None:
+            if df.is_empty() or not _cacheable(tables, sources):
+                return
+            try:
+                get_cache_backend().set(key, df)
+            except OSError as e:
+                print(f"Failed to write shared cache entry for {name}: {e}")
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> pl.DataFrame:
+            key = cache_key(*args, **kwargs)
+            df = lookup(key)
+            if df is not None:
+                return df
+            with tracking_reads() as sources:
+                df = func(*args, **kwargs)
+            store(key, df, sources)
+            return df
+
+        wrapper.cache_key = cache_key
+        wrapper.lookup = lookup
+        wrapper.store = store
+        return wrapper
+
+    return decorator
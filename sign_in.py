@@ -1,14 +1,13 @@
 import streamlit as st
-from supabase import create_client, Client
-import time
-
-# メール送信用ライブラリ
-import smtplib
-from email.mime.text import MIMEText
+from typing import TYPE_CHECKING
 
 import os
 from dotenv import load_dotenv
 
+# Supabase SDKは読み込みに時間がかかるため、初めて使う時に読み込む
+if TYPE_CHECKING:
+    from supabase import Client
+
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
@@ -18,53 +17,16 @@ supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 
 
-# クライアントの作成
+# クライアントの作成 (サインイン・サインアップを実行する時に作成する)
 @st.cache_resource
-def init_supabase_client(url: str, key: str) -> Client:
-    return create_client(url, key)
+def init_supabase_client(url: str, key: str) -> "Client":
+    from supabase import create_client
 
-
-supabase: Client = init_supabase_client(supabase_url, supabase_key)
+    return create_client(url, key)
 
 # --- Streamlit UI の実装 ---
 
 
-def send_notification_email(to_addrs: list[str], new_user_email: str):
-    """管理者に新規ユーザー登録を通知するメールを送信する"""
-    try:
-        # .envからメール設定を取得
-        smtp_server = os.getenv("SMTP_SERVER")
-        smtp_port = os.getenv("SMTP_PORT")
-        smtp_user = os.getenv("SMTP_USER")
-        smtp_password = os.getenv("SMTP_PASSWORD")
-
-        from_addr = smtp_user
-
-        subject = "【溶射電極管理システム】新規ユーザー登録通知"
-        body = f"""
-管理者の皆様
-
-新しいユーザーがシステムに登録されました。
-内容を確認し、必要に応じて権限の付与を行ってください。
-
-登録メールアドレス: {new_user_email}
-
-溶射電極管理システム
-"""
-
-        msg = MIMEText(body, "plain", "utf-8")
-        msg["Subject"] = subject
-        msg["From"] = from_addr
-        msg["To"] = ", ".join(to_addrs)
-
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.sendmail(from_addr, to_addrs, msg.as_string())
-    except Exception as e:
-        st.warning(f"管理者への通知メール送信中にエラーが発生しました: {e}")
-
-
 def login_view():
     """サインインフォームを表示する関数"""
     st.header("サインイン")
@@ -82,6 +44,7 @@ def login_view():
 
             try:
                 # Supabaseのサインインメソッド呼び出し
+                supabase = init_supabase_client(supabase_url, supabase_key)
                 response = supabase.auth.sign_in_with_password(
                     {"email": email, "password": password}
                 )
@@ -139,6 +102,7 @@ def signup_view():
                 return
 
             # --- Supabaseのサインアップメソッド呼び出し ---
+            supabase = init_supabase_client(supabase_url, supabase_key)
             response = supabase.auth.sign_up({"email": email, "password": password})
 
             # --- レスポンス内容の判定 ---
@@ -148,29 +112,24 @@ def signup_view():
                     f"新規アカウント登録が完了しました！**{email}**宛に確認メールを送信しました。メール内のリンクをクリックしてアカウントを有効にしてください。"
                 )
 
-                # 管理者に通知メールを送信
-                try:
-                    # RLSをバイパスするため、サービスロールキーでクライアントを一時的に作成
-                    supabase_service = init_supabase_client(
-                        os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY")
-                    )
-                    admin_users_response = (
-                        supabase_service.table("user_roles")
-                        .select("email")
-                        .eq("role", "admin")
-                        .execute()
-                    )
-                    if admin_users_response.data:
-                        admin_emails = [
-                            user["email"] for user in admin_users_response.data
-                        ]
-                        send_notification_email(admin_emails, email)
-                        st.info("管理者に新規登録が通知されました。")
-                except Exception as e:
-                    st.warning(f"管理者情報の取得中にエラーが発生しました: {e}")
-
-                time.sleep(3)
-                st.rerun()
+                # 管理者への通知はアウトボックスに書き込み、送信はバックグラウンドで行う(mailer.py)
+                # データベースを使うモジュールは、サインアップする時に読み込む
+                import mailer
+                from util import supabase_execute_sql
+
+                queued = supabase_execute_sql(
+                    [
+                        {
+                            "sql": "INSERT INTO public.signup_notification_outbox (new_user_email) VALUES (:email)",
+                            "params": {"email": email},
+                        }
+                    ]
+                )
+                if queued:
+                    mailer.notify()
+                    st.info("管理者に新規登録が通知されます。")
+                else:
+                    st.warning("管理者への通知の登録中にエラーが発生しました。")
             # 失敗パターン: userが存在しない場合 (既に登録済みなど)
             elif not response.user:
                 st.error("このメールアドレスは既に登録されているか、登録できません。")
@@ -1,5 +1,4 @@
 import streamlit as st
-from supabase import create_client, Client
 import time
 import os
 from dotenv import load_dotenv
@@ -23,7 +22,10 @@ def main():
         if st.button("ログアウト", type="primary"):
             supabase_url = os.getenv("SUPABASE_URL")
             supabase_key = os.getenv("SUPABASE_KEY")
-            supabase: Client = create_client(supabase_url, supabase_key)
+            # Supabase SDKは読み込みに時間がかかるため、サインアウトする時に読み込む
+            from supabase import create_client
+
+            supabase = create_client(supabase_url, supabase_key)
             supabase.auth.sign_out()
             st.session_state.authenticated = False
             st.success("サインアウトしました。サインインページにリダイレクトします。")
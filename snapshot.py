@@ -0,0 +1,368 @@
+"""読み取り専用ページ向けのParquetスナップショット
+
+electrode_status と defective_electrodes を定期的にParquetへ書き出し(item_codeでパーティション分割)、
+読み取りの多いページ(溶射電極状況表示、最新出荷データ検索、不具合履歴)をPolarsのLazyFrameで処理する。
+スナップショットが古い場合や、同じセッションでスナップショットの作成後に書き込みを行った場合はNoneを返し、
+呼び出し元はSQLでの取得にフォールバックする。
+
+スナップショットの作成:
+    python snapshot.py          # SNAPSHOT_INTERVAL_SECONDS毎に作成し続ける
+    python snapshot.py --once   # 1回だけ作成する
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import polars as pl
+
+from shared_cache import record_read
+from util import read_sql, session_wrote_since
+
+# 1の場合、ページの読み取りをスナップショットから行う
+SNAPSHOT_MODE = os.getenv("SNAPSHOT_MODE", "0") == "1"
+# スナップショットの保存先
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+# この秒数より古いスナップショットは使用しない
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", "300"))
+# スナップショットを作成する間隔(秒)
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "120"))
+
+# パーティションキーの型(数字のみの品目コードが整数として推論されないように指定する)
+_HIVE_SCHEMA = {"item_code": pl.String}
+
+SNAPSHOT_QUERIES = {
+    "electrode_status": """
+    SELECT
+        es.id,
+        es.linde_order_num,
+        es.giga_order_num,
+        es.item_code,
+        es.giga_due_date,
+        es.sirial_num,
+        es.status,
+        es.remarks,
+        es.ship_plan,
+        es.shiped_date,
+        es.daicho_haneibi,
+        es.linde_remarks,
+        es.archived
+    FROM
+        public.electrode_status_all es
+    """,
+    "defective_electrodes": """
+    SELECT
+        de.id,
+        de.item_code,
+        de.serial_num,
+        de.defect_date,
+        de.defect_status,
+        de.defect_description,
+        de.linde_remarks,
+        CASE
+            WHEN de.updated_by != '' THEN ur_update.user_name
+            ELSE ur_create.user_name
+        END AS registrant,
+        CASE
+            WHEN de.updated_at > de.created_at THEN de.updated_at
+            ELSE de.created_at
+        END AS last_updated
+    FROM
+        public.defective_electrodes de
+    LEFT JOIN public.user_roles ur_create ON de.created_by = ur_create.email
+    LEFT JOIN public.user_roles ur_update ON de.updated_by = ur_update.email
+    """,
+}
+
+
+def _pointer_path(table: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"{table}.json")
+
+
+def dump_snapshot(table: str) -> dict:
+    """テーブルをParquetに書き出し、現在のスナップショットとして登録する
+    Args:
+        table (str): SNAPSHOT_QUERIESのキー
+    Returns:
+        dict: 登録したスナップショットの情報
+    """
+    taken_at = time.time()
+    df = read_sql(SNAPSHOT_QUERIES[table], query_class="background")
+
+    version = f"{table}-{datetime.fromtimestamp(taken_at):%Y%m%d%H%M%S%f}"
+    version_dir = os.path.join(SNAPSHOT_DIR, version)
+    os.makedirs(version_dir, exist_ok=True)
+    if df.is_empty():
+        # 空のテーブルはパーティションが作られないため、スキーマのみのファイルを置く
+        df.write_parquet(os.path.join(version_dir, "empty.parquet"))
+    else:
+        df.write_parquet(version_dir, partition_by="item_code")
+
+    # ポインタファイルを置き換えることで、読み取り側は常に完成したスナップショットを参照する
+    pointer = {"version": version, "taken_at": taken_at, "rows": df.height}
+    tmp_path = _pointer_path(table) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pointer, f)
+    os.replace(tmp_path, _pointer_path(table))
+
+    _remove_old_versions(table, keep=version)
+    return pointer
+
+
+def _remove_old_versions(table: str, keep: str) -> None:
+    """読み取り中の可能性がある直前の世代を残して、古いスナップショットを削除する"""
+    versions = sorted(
+        name
+        for name in os.listdir(SNAPSHOT_DIR)
+        if name.startswith(f"{table}-") and name != keep
+    )
+    for name in versions[:-1]:
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, name), ignore_errors=True)
+
+
+def dump_all() -> None:
+    """全てのスナップショットを作成する"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    for table in SNAPSHOT_QUERIES:
+        started = time.perf_counter()
+        pointer = dump_snapshot(table)
+        print(
+            f"Snapshot {pointer['version']}: {pointer['rows']} rows "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+
+def scan_snapshot(table: str) -> pl.LazyFrame | None:
+    """有効なスナップショットをLazyFrameとして返す
+
+    スナップショットモードでない場合、スナップショットが存在しないか古い場合、
+    またはセッションがスナップショットの作成後に書き込みを行った場合はNoneを返す。
+    """
+    if not SNAPSHOT_MODE:
+        return None
+    try:
+        with open(_pointer_path(table), encoding="utf-8") as f:
+            pointer = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - pointer["taken_at"] > SNAPSHOT_MAX_AGE_SECONDS:
+        return None
+    # 自分の書き込みを含まないスナップショットは使わない (次の作成まではSQLで取得する)
+    if session_wrote_since(pointer["taken_at"]):
+        return None
+
+    version_dir = os.path.join(SNAPSHOT_DIR, pointer["version"])
+    # スナップショットから作成した結果は共有キャッシュに保存しない
+    record_read("snapshot")
+    if pointer["rows"] == 0:
+        return pl.scan_parquet(os.path.join(version_dir, "empty.parquet"))
+    return pl.scan_parquet(
+        version_dir, hive_partitioning=True, hive_schema=_HIVE_SCHEMA
+    )
+
+
+def _scan_electrode_status(scope: str) -> pl.LazyFrame | None:
+    """electrode_statusのスナップショットを読み取る範囲(hot/all)で絞り込む"""
+    es = scan_snapshot("electrode_status")
+    if es is None or scope == "all":
+        return es
+    return es.filter(~pl.col("archived"))
+
+
+def fetch_electrode_status_lists(
+    item_codes: list[str], scope: str = "hot"
+) -> pl.DataFrame | None:
+    """main_contents.fetch_electrode_status_listsのクエリと同じ結果をスナップショットから返す"""
+    es = _scan_electrode_status(scope)
+    de = scan_snapshot("defective_electrodes")
+    if es is None or de is None:
+        return None
+
+    # 品目での絞り込みはパーティションの選択としてParquetの読み込み前に適用される
+    es = es.filter(pl.col("item_code").is_in(item_codes))
+    de = de.filter(pl.col("item_code").is_in(item_codes))
+
+    # 通常の電極ステータス (不具合登録されていないもの)
+    defect_keys = de.select(
+        pl.col("item_code"), pl.col("serial_num").cast(pl.String).alias("_serial")
+    )
+    normal = (
+        es.with_columns(pl.col("sirial_num").cast(pl.String).alias("_serial"))
+        .join(defect_keys, on=["item_code", "_serial"], how="anti")
+        .select(
+            pl.col("id"),
+            pl.col("linde_order_num").alias("リンデ注番"),
+            pl.col("giga_order_num").alias("ギガ注番"),
+            pl.col("item_code").alias("品目"),
+            pl.col("giga_due_date").alias("ギガ納期"),
+            pl.col("sirial_num").alias("シリアル"),
+            pl.col("status").alias("状況"),
+            pl.col("remarks").alias("備考"),
+            pl.col("ship_plan").alias("出荷予定日"),
+            pl.col("shiped_date").alias("出荷実績日"),
+            pl.col("daicho_haneibi").alias("台帳反映日"),
+            pl.col("linde_remarks").alias("リンデ備考"),
+            pl.lit(None, dtype=pl.Date).alias("不具合発生日"),
+            pl.when(pl.col("sirial_num").is_null())
+            .then(0)
+            .otherwise(1)
+            .cast(pl.Int32)
+            .alias("sn有"),
+        )
+    )
+    # 不具合電極の情報
+    defects = de.select(
+        pl.col("id"),
+        pl.lit("-").alias("リンデ注番"),
+        pl.lit("-").alias("ギガ注番"),
+        pl.col("item_code").alias("品目"),
+        pl.lit(None).alias("ギガ納期"),
+        pl.col("serial_num").alias("シリアル"),
+        pl.col("defect_status").alias("状況"),
+        pl.col("defect_description").alias("備考"),
+        pl.lit(None).alias("出荷予定日"),
+        pl.lit(None).alias("出荷実績日"),
+        pl.lit(None).alias("台帳反映日"),
+        pl.col("linde_remarks").alias("リンデ備考"),
+        pl.col("defect_date").alias("不具合発生日"),
+        pl.lit(1, dtype=pl.Int32).alias("sn有"),
+    )
+    return pl.concat([normal, defects], how="vertical_relaxed").collect()
+
+
+def fetch_recent_shipment_dates(limit: int, scope: str = "hot") -> list[str] | None:
+    """recent_shipments.fetch_recent_shipment_datesと同じ結果をスナップショットから返す"""
+    es = _scan_electrode_status(scope)
+    if es is None:
+        return None
+    dates_df = (
+        es.select(pl.col("shiped_date"))
+        .drop_nulls()
+        .unique()
+        .sort("shiped_date", descending=True)
+        .head(limit)
+        .collect()
+    )
+    return dates_df["shiped_date"].dt.strftime("%Y-%m-%d").to_list()
+
+
+def fetch_shipment_data(
+    target_dates: list[str], scope: str = "hot"
+) -> pl.DataFrame | None:
+    """recent_shipments.fetch_shipment_dataのSQL部分と同じ結果をスナップショットから返す"""
+    es = _scan_electrode_status(scope)
+    if es is None:
+        return None
+    dates = [datetime.strptime(d, "%Y-%m-%d").date() for d in target_dates]
+    return (
+        es.filter(pl.col("shiped_date").cast(pl.Date).is_in(dates))
+        .group_by("shiped_date", "giga_order_num")
+        .agg(
+            pl.col("linde_order_num").max().alias("リンデ注番"),
+            pl.col("item_code").max().alias("品目"),
+            pl.col("giga_due_date").max().alias("ギガ納期"),
+            # string_aggと同様に、全てNULLの場合はNULLとする
+            pl.when(pl.col("sirial_num").count() > 0)
+            .then(pl.col("sirial_num").sort(nulls_last=True).cast(pl.String).str.join(","))
+            .alias("シリアル"),
+            pl.when(pl.col("remarks").count() > 0)
+            .then(pl.col("remarks").sort_by("sirial_num", nulls_last=True).str.join(","))
+            .alias("備考"),
+        )
+        .select(
+            pl.col("shiped_date").alias("出荷実績日"),
+            "リンデ注番",
+            pl.col("giga_order_num").alias("ギガ注番"),
+            "品目",
+            "ギガ納期",
+            "シリアル",
+            "備考",
+        )
+        .sort(["出荷実績日", "ギガ納期", "ギガ注番"], descending=True)
+        .collect()
+    )
+
+
+def _filter_defects(de: pl.LazyFrame, parameters: dict) -> pl.LazyFrame:
+    """statementsの不具合履歴の絞り込み条件(_DEFECT_FILTERS)と同じ条件を適用する"""
+    if parameters.get("item_code") is not None:
+        de = de.filter(pl.col("item_code") == parameters["item_code"])
+    if parameters.get("serial_num") is not None:
+        de = de.filter(pl.col("serial_num").cast(pl.String) == parameters["serial_num"])
+    if parameters.get("date_from") is not None:
+        de = de.filter(pl.col("defect_date") >= parameters["date_from"])
+    if parameters.get("date_to") is not None:
+        de = de.filter(pl.col("defect_date") <= parameters["date_to"])
+    return de
+
+
+def fetch_defect_history_page(parameters: dict) -> pl.DataFrame | None:
+    """statementsのdefect_history_pageと同じ結果をスナップショットから返す"""
+    de = scan_snapshot("defective_electrodes")
+    if de is None:
+        return None
+    de = _filter_defects(de, parameters)
+    if parameters.get("after_date") is not None:
+        after_date = datetime.strptime(parameters["after_date"], "%Y-%m-%d").date()
+        de = de.filter(
+            (pl.col("defect_date") < after_date)
+            | (
+                (pl.col("defect_date") == after_date)
+                & (pl.col("id") < parameters["after_id"])
+            )
+        )
+    return (
+        de.sort(["defect_date", "id"], descending=True)
+        .head(parameters["limit"])
+        .select(
+            pl.col("id"),
+            pl.col("item_code").alias("品目"),
+            pl.col("serial_num").alias("シリアル"),
+            pl.col("defect_date").dt.strftime("%Y-%m-%d").alias("不具合発生日"),
+            pl.col("defect_status").alias("不具合状況"),
+            pl.col("defect_description").alias("不具合内容"),
+            pl.col("linde_remarks").alias("リンデ備考"),
+            pl.col("registrant").alias("登録者"),
+            pl.col("last_updated")
+            .dt.convert_time_zone("Asia/Tokyo")
+            .dt.strftime("%Y-%m-%d %H:%M:%S")
+            .alias("最終更新日時"),
+        )
+        .collect()
+    )
+
+
+def fetch_defect_item_counts(parameters: dict) -> pl.DataFrame | None:
+    """statementsのdefect_item_countsと同じ結果をスナップショットから返す"""
+    de = scan_snapshot("defective_electrodes")
+    if de is None:
+        return None
+    return (
+        _filter_defects(de, parameters)
+        .group_by("item_code")
+        .agg(pl.len().alias("件数"))
+        .sort("item_code")
+        .rename({"item_code": "品目"})
+        .collect()
+    )
+
+
+def main():
+    run_once = "--once" in sys.argv[1:]
+    while True:
+        try:
+            dump_all()
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
+            if run_once:
+                raise
+        if run_once:
+            return
+        time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+"""名前付きSQLステートメントのレジストリ
+
+呼び出しの度にf-stringでSQLを組み立てると、条件の組み合わせごとに異なるSQL文となり
+解析と実行計画の作成がやり直しになる。ここではステートメントをプロセスで一度だけ
+SQLAlchemy Coreの形で作成し、全セッションで使い回す。
+
+接続文字列のドライバがpsycopg (postgresql+psycopg://) の場合は、同じステートメントを
+POSTGRE_PREPARE_THRESHOLD回実行した後にサーバー側のプリペアドステートメントが使われる
+(psycopg2はサーバー側のプリペアに対応していないため、SQLAlchemyのコンパイル済みキャッシュのみ)。
+"""
+
+import threading
+from dataclasses import dataclass
+
+from sqlalchemy import TextClause, text
+
+
+@dataclass
+class StatementStats:
+    """ステートメントごとの実行時間の集計"""
+
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class StatementRegistry:
+    """名前付きステートメントと実行時間の集計を保持する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statements: dict[str, TextClause] = {}
+        self._query_classes: dict[str, str] = {}
+        self._stats: dict[str, StatementStats] = {}
+
+    def register(
+        self, name: str, sql: str, query_class: str = "interactive"
+    ) -> TextClause:
+        """ステートメントを登録する(同じ名前での再登録はエラー)
+
+        query_classはstatement_timeoutの種類 (db_pool.DEFAULT_STATEMENT_TIMEOUTSのキー)。
+        """
+        with self._lock:
+            if name in self._statements:
+                raise ValueError(f"Statement '{name}' is already registered.")
+            statement = text(sql)
+            self._statements[name] = statement
+            self._query_classes[name] = query_class
+            self._stats[name] = StatementStats()
+            return statement
+
+    def get(self, name: str) -> TextClause:
+        return self._statements[name]
+
+    def query_class(self, name: str) -> str:
+        return self._query_classes[name]
+
+    def record(self, name: str, elapsed: float, failed: bool = False) -> None:
+        """実行時間を記録する"""
+        with self._lock:
+            stats = self._stats.setdefault(name, StatementStats())
+            stats.calls += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            if failed:
+                stats.errors += 1
+
+    def stats(self) -> dict[str, StatementStats]:
+        """ステートメントごとの集計のコピーを返す"""
+        with self._lock:
+            return {
+                name: StatementStats(**vars(stats))
+                for name, stats in self._stats.items()
+            }
+
+
+registry = StatementRegistry()
+
+
+# --- 固定のステートメント ---
+
+# 受注管理: 品目ごとの受注一覧 (order_management_linde.fetch_electrode_status_list)
+registry.register(
+    "order_list_by_item",
+    """
+    -- 通常の電極ステータス (不具合登録されていないもの)
+    SELECT
+        linde_order_num AS "リンデ注番",
+        giga_order_num AS "ギガ注番",
+        item_code AS "品目",
+        giga_due_date AS "ギガ納期",
+        status AS "状況",
+        count(*) AS 受注数,
+        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END) AS "sn有"
+    FROM
+        public.electrode_status es
+    WHERE
+        es.item_code = :item_code
+        AND COALESCE(es.status, '') not in ('判定中', '廃棄', '保留')
+    GROUP BY
+        linde_order_num,
+        giga_order_num,
+        item_code,
+        giga_due_date,
+        status,
+        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END)
+    ORDER BY
+        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END),
+        giga_due_date DESC,
+        giga_order_num DESC
+    LIMIT :limit
+    """,
+)
+
+# electrode_statusを読み取る範囲ごとの参照先 (migrations/003_electrode_status_archive.sql)
+#   hot: 未出荷と最近出荷した行のみ (electrode_status)
+#   all: アーカイブに移した出荷済みの行を含む全期間 (electrode_status_all)
+SCOPE_SOURCES = {
+    "hot": "public.electrode_status",
+    "all": "public.electrode_status_all",
+}
+
+
+def scoped(name: str, scope: str) -> str:
+    """読み取る範囲(hot/all)に対応するステートメント名を返す"""
+    if scope not in SCOPE_SOURCES:
+        raise ValueError(f"Unknown scope '{scope}'.")
+    return name if scope == "hot" else f"{name}[{scope}]"
+
+
+# 不具合履歴の絞り込み条件 (NULLの条件は無視する)
+# パラメータの型を明示して、サーバー側でのパラメータ型推論に依存しないようにする
+_DEFECT_FILTERS = """
+        (CAST(:item_code AS text) IS NULL OR de.item_code = :item_code)
+        AND (CAST(:serial_num AS text) IS NULL OR de.serial_num = :serial_num)
+        AND (CAST(:date_from AS date) IS NULL OR de.defect_date >= :date_from)
+        AND (CAST(:date_to AS date) IS NULL OR de.defect_date <= :date_to)"""
+
+# 不具合履歴の1ページ分 (defective_electrode_registration.fetch_defect_history_page)
+# (不具合発生日, id)の降順でキーセットページングを行う。日本時間への変換と書式化はSQLで行う。
+registry.register(
+    "defect_history_page",
+    f"""
+    SELECT
+        de.id
+        , de.item_code AS "品目"
+        , de.serial_num AS "シリアル"
+        , to_char(de.defect_date, 'YYYY-MM-DD') AS "不具合発生日"
+        , de.defect_status AS "不具合状況"
+        , de.defect_description AS "不具合内容"
+        , de.linde_remarks AS "リンデ備考"
+        , CASE
+            WHEN de.updated_by != '' THEN ur_update.user_name
+            ELSE ur_create.user_name
+        END AS "登録者"
+        , to_char(
+            CASE
+                WHEN de.updated_at > de.created_at THEN de.updated_at
+                ELSE de.created_at
+            END AT TIME ZONE 'Asia/Tokyo',
+            'YYYY-MM-DD HH24:MI:SS'
+        ) AS "最終更新日時"
+    FROM
+        public.defective_electrodes de
+    LEFT JOIN public.user_roles ur_create ON de.created_by = ur_create.email
+    LEFT JOIN public.user_roles ur_update ON de.updated_by = ur_update.email
+    WHERE{_DEFECT_FILTERS}
+        AND (
+            CAST(:after_date AS date) IS NULL
+            OR (de.defect_date, de.id) < (CAST(:after_date AS date), :after_id)
+        )
+    ORDER BY
+        de.defect_date DESC,
+        de.id DESC
+    LIMIT :limit
+    """,
+)
+
+# 不具合履歴の品目ごとの件数 (品目の選択肢に使用)
+registry.register(
+    "defect_item_counts",
+    f"""
+    SELECT
+        de.item_code AS "品目",
+        count(*) AS "件数"
+    FROM
+        public.defective_electrodes de
+    WHERE{_DEFECT_FILTERS}
+    GROUP BY
+        de.item_code
+    ORDER BY
+        de.item_code
+    """,
+)
+
+# 一括登録する不具合の(品目, シリアル)が登録済みか確認する
+# (defective_electrode_registration.lookup_defect_serials)
+# 不具合は出荷後に見つかることが多いため、アーカイブに移した電極も含めて確認する
+registry.register(
+    "defect_serial_lookup",
+    """
+    SELECT
+        k.item_code AS "品目",
+        k.serial_num AS "シリアル",
+        EXISTS (
+            SELECT 1
+            FROM public.defective_electrodes de
+            WHERE de.item_code = k.item_code AND de.serial_num = k.serial_num
+        ) AS "不具合登録済",
+        EXISTS (
+            SELECT 1
+            FROM public.electrode_status_all es
+            WHERE es.item_code = k.item_code AND es.sirial_num::text = k.serial_num
+        ) AS "電極登録済"
+    FROM
+        unnest(CAST(:item_codes AS text[]), CAST(:serial_nums AS text[]))
+            AS k(item_code, serial_num)
+    """,
+)
+
+# 受注編集・削除の検索結果の1ページ分 (order_management_linde.fetch_order_search_page)
+# migrations/009_order_summary.sqlのトリガーで更新される受注ごとの集計を、
+# (ギガ納期, ギガ注番, 品目)の降順でキーセットページングする。注番は前方一致(LIKEのパターン)で絞り込む。
+registry.register(
+    "order_summary_page",
+    """
+    SELECT
+        s.sort_due,
+        s.linde_order_num AS "リンデ注番",
+        s.giga_order_num AS "ギガ注番",
+        s.item_code AS "品目",
+        s.giga_due_date AS "ギガ納期",
+        s.order_qty AS "受注数",
+        s.serial_count AS "シリアル登録数",
+        s.shipped_count AS "出荷数",
+        (
+            SELECT string_agg(format('%s: %s', COALESCE(NULLIF(e.key, ''), '-'), e.value), ', ' ORDER BY e.key)
+            FROM jsonb_each_text(s.status_counts) AS e
+        ) AS "状況"
+    FROM
+        public.order_summary s
+    WHERE
+        s.order_qty > 0
+        AND (CAST(:item_code AS text) IS NULL OR s.item_code = :item_code)
+        AND (CAST(:giga_order_pattern AS text) IS NULL OR s.giga_order_num LIKE :giga_order_pattern)
+        AND (CAST(:linde_order_pattern AS text) IS NULL OR s.linde_order_num LIKE :linde_order_pattern)
+        AND (CAST(:due_from AS date) IS NULL OR s.giga_due_date >= :due_from)
+        AND (CAST(:due_to AS date) IS NULL OR s.giga_due_date <= :due_to)
+        AND (NOT CAST(:open_only AS boolean) OR s.shipped_count < s.order_qty)
+        AND (
+            CAST(:after_due AS date) IS NULL
+            OR (s.sort_due, s.giga_order_num, s.item_code)
+                < (CAST(:after_due AS date), CAST(:after_order AS text), CAST(:after_item AS text))
+        )
+    ORDER BY
+        s.sort_due DESC,
+        s.giga_order_num DESC,
+        s.item_code DESC
+    LIMIT :limit
+    """,
+)
+
+# 一括変更する受注の現在の値と行数 (order_management_linde.fetch_order_summaries)
+registry.register(
+    "order_summary_lookup",
+    """
+    SELECT
+        s.giga_order_num AS "ギガ注番",
+        s.item_code AS "品目",
+        s.giga_due_date AS "ギガ納期",
+        s.linde_order_num AS "リンデ注番",
+        (SELECT sum(e.value::integer) FROM jsonb_each_text(s.status_counts) AS e) AS "行数"
+    FROM
+        unnest(CAST(:giga_order_nums AS text[]), CAST(:item_codes AS text[]))
+            AS k(giga_order_num, item_code)
+        JOIN public.order_summary s
+            ON s.giga_order_num = k.giga_order_num AND s.item_code = k.item_code
+    """,
+)
+
+# 品目ごとの溶射電極状況 (main_contents.fetch_electrode_status_lists)
+# 複数の品目を配列として1つのパラメータで渡し、1回のクエリで取得する
+_ELECTRODE_STATUS_BY_ITEMS = """
+    -- 通常の電極ステータス (不具合登録されていないもの)
+    SELECT
+        id,
+        linde_order_num AS "リンデ注番",
+        giga_order_num AS "ギガ注番",
+        item_code AS "品目",
+        giga_due_date AS "ギガ納期",
+        sirial_num AS "シリアル",
+        status AS "状況",
+        remarks AS "備考",
+        ship_plan AS "出荷予定日",
+        shiped_date AS "出荷実績日",
+        daicho_haneibi AS "台帳反映日",
+        linde_remarks AS "リンデ備考",
+        NULL::date AS "不具合発生日", -- 不具合品ではないのでNULL
+        (CASE WHEN es.sirial_num IS NULL THEN 0 ELSE 1 END) AS "sn有"
+    FROM
+        {source} es
+    WHERE
+        es.item_code = ANY(CAST(:items AS text[]))
+        AND NOT EXISTS (
+            SELECT 1
+            FROM public.defective_electrodes de
+            WHERE de.item_code = es.item_code AND de.serial_num = es.sirial_num
+        )
+
+    UNION ALL
+
+    -- 不具合電極の情報 (こちらを優先)
+    SELECT
+        id,
+        '-' AS "リンデ注番",
+        '-' AS "ギガ注番",
+        item_code AS "品目",
+        NULL::timestamp AS "ギガ納期",
+        serial_num AS "シリアル",
+        defect_status AS "状況",
+        defect_description AS "備考",
+        NULL::date AS "出荷予定日",
+        NULL::date AS "出荷実績日",
+        NULL::date AS "台帳反映日",
+        linde_remarks AS "リンデ備考",
+        defect_date AS "不具合発生日",
+        1 AS "sn有" -- 不具合品は必ずシリアルがあるので1
+    FROM
+        public.defective_electrodes
+    WHERE
+        item_code = ANY(CAST(:items AS text[]))
+    """
+for _scope in SCOPE_SOURCES:
+    registry.register(
+        scoped("electrode_status_by_items", _scope),
+        _ELECTRODE_STATUS_BY_ITEMS.format(source=SCOPE_SOURCES[_scope]),
+        query_class="heavy",
+    )
+
+# 品目ごとのデータのバージョン (main_contents.fetch_item_versions)
+# migrations/007_electrode_item_versions.sqlのトリガーで更新され、主キーの参照のみで取得できる
+registry.register(
+    "electrode_item_versions",
+    """
+    SELECT item_code, version
+    FROM public.electrode_item_versions
+    WHERE item_code = ANY(CAST(:items AS text[]))
+    """,
+)
+
+# 出荷実績日ごとの出荷データ (recent_shipments.fetch_shipment_data)
+# 日付のリストは配列として1つのパラメータで渡す
+_SHIPMENTS_BY_DATES = """
+    SELECT
+        es.shiped_date as "出荷実績日",
+        MAX(es.linde_order_num) as "リンデ注番",
+        es.giga_order_num as "ギガ注番",
+        MAX(es.item_code) as "品目",
+        MAX(es.giga_due_date) as "ギガ納期",
+        string_agg(es.sirial_num::text, ',' ORDER BY es.sirial_num) as "シリアル",
+        string_agg(es.remarks, ',' ORDER BY es.sirial_num) as "備考"
+    FROM
+        {source} es
+    WHERE
+        es.shiped_date = ANY(CAST(:dates AS date[]))
+    GROUP BY
+        es.shiped_date, es.giga_order_num
+    ORDER BY
+        "出荷実績日" DESC,
+        "ギガ納期" DESC,
+        "ギガ注番" DESC
+    """
+for _scope in SCOPE_SOURCES:
+    registry.register(
+        scoped("shipments_by_dates", _scope),
+        _SHIPMENTS_BY_DATES.format(source=SCOPE_SOURCES[_scope]),
+    )
+
+# 最新の出荷実績日 (recent_shipments.fetch_recent_shipment_dates)
+_RECENT_SHIPMENT_DATES = """
+    SELECT DISTINCT shiped_date
+    FROM {source}
+    WHERE shiped_date IS NOT NULL
+    ORDER BY shiped_date DESC
+    LIMIT :limit
+    """
+for _scope in SCOPE_SOURCES:
+    registry.register(
+        scoped("recent_shipment_dates", _scope),
+        _RECENT_SHIPMENT_DATES.format(source=SCOPE_SOURCES[_scope]),
+    )
+
+# --- 分析ダッシュボード (analytics.py) ---
+# 集計テーブルはmigrations/002_analytics_rollups.sqlのトリガーで書き込み時に更新される。
+# 品目の配列が空の場合は全品目を対象とする。
+
+# 品目・月・不具合状況ごとの不具合件数
+registry.register(
+    "analytics_defect_monthly",
+    """
+    SELECT
+        r.month AS "月",
+        r.item_code AS "品目",
+        r.defect_status AS "不具合状況",
+        r.defect_count AS "件数"
+    FROM
+        public.analytics_defect_monthly r
+    WHERE
+        r.month >= CAST(:date_from AS date)
+        AND (cardinality(CAST(:items AS text[])) = 0 OR r.item_code = ANY(CAST(:items AS text[])))
+    ORDER BY
+        r.month, r.item_code, r.defect_status
+    """,
+)
+
+# 品目・週ごとの出荷数
+registry.register(
+    "analytics_shipment_weekly",
+    """
+    SELECT
+        r.week AS "週",
+        r.item_code AS "品目",
+        r.shipped_count AS "出荷数"
+    FROM
+        public.analytics_shipment_weekly r
+    WHERE
+        r.week >= CAST(:date_from AS date)
+        AND (cardinality(CAST(:items AS text[])) = 0 OR r.item_code = ANY(CAST(:items AS text[])))
+    ORDER BY
+        r.week, r.item_code
+    """,
+)
+
+# 品目・ギガ納期の週ごとの未出荷数 (納期が過ぎたものも含めて全期間)
+registry.register(
+    "analytics_open_backlog_weekly",
+    """
+    SELECT
+        r.due_week AS "ギガ納期週",
+        r.item_code AS "品目",
+        r.open_count AS "未出荷数"
+    FROM
+        public.analytics_open_backlog_weekly r
+    WHERE
+        cardinality(CAST(:items AS text[])) = 0 OR r.item_code = ANY(CAST(:items AS text[]))
+    ORDER BY
+        r.due_week, r.item_code
+    """,
+)
+
+# 集計テーブルに含まれる品目の一覧
+registry.register(
+    "analytics_items",
+    """
+    SELECT item_code AS "品目" FROM public.analytics_shipment_weekly
+    UNION
+    SELECT item_code FROM public.analytics_open_backlog_weekly
+    UNION
+    SELECT item_code FROM public.analytics_defect_monthly
+    ORDER BY 1
+    """,
+)
+
+# 起動時のウォームアップで先読みする品目 (未出荷の受注が多い順)
+registry.register(
+    "warmup_hot_items",
+    """
+    SELECT
+        r.item_code AS "品目"
+    FROM
+        public.analytics_open_backlog_weekly r
+    GROUP BY
+        r.item_code
+    ORDER BY
+        sum(r.open_count) DESC
+    LIMIT :limit
+    """,
+)
+
+# --- 変更履歴 (main_contents.show_change_history) ---
+# migrations/008_electrode_change_history.sqlのトリガーで追記され、
+# (キー, changed_at desc) のインデックスで新しい順に先頭の行のみを読む。
+_CHANGE_HISTORY = """
+    SELECT
+        h.changed_at AT TIME ZONE 'Asia/Tokyo' AS "日時",
+        h.operation AS "操作",
+        h.table_name AS "テーブル",
+        h.item_code AS "品目",
+        h.serial_num AS "シリアル",
+        h.giga_order_num AS "ギガ注番",
+        COALESCE(ur.user_name, h.changed_by) AS "変更者",
+        (
+            SELECT string_agg(
+                format(
+                    '%s: %s → %s',
+                    k,
+                    COALESCE(h.old_values ->> k, '-'),
+                    COALESCE(h.new_values ->> k, '-')
+                ),
+                ', ' ORDER BY k
+            )
+            FROM jsonb_object_keys(
+                COALESCE(h.old_values, '{{}}'::jsonb) || COALESCE(h.new_values, '{{}}'::jsonb)
+            ) AS k
+        ) AS "変更内容"
+    FROM
+        public.electrode_change_history h
+    LEFT JOIN public.user_roles ur ON h.changed_by = ur.email
+    WHERE
+        {condition}
+    ORDER BY
+        h.changed_at DESC, h.id DESC
+    LIMIT :limit
+"""
+
+registry.register(
+    "change_history_by_serial",
+    _CHANGE_HISTORY.format(
+        condition="h.serial_num = :serial_num\n"
+        "        AND (CAST(:item_code AS text) IS NULL OR h.item_code = :item_code)"
+    ),
+)
+
+registry.register(
+    "change_history_by_order",
+    _CHANGE_HISTORY.format(condition="h.giga_order_num = :giga_order_num"),
+)
@@ -1,4 +1,9 @@
 import streamlit as st
+import mailer
+import metrics
+import prefetch
+import profiler
+import warmup
 
 st.set_page_config(
     page_title="溶射電極管理システム",
@@ -6,6 +11,13 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+# python warmup.py で起動していない場合は、最初のリクエスト時にウォームアップを開始する
+warmup.start()
+# メトリクスのHTTPサーバー(METRICS_PORT)を起動する (プロセスで1回のみ)
+metrics.start()
+# 新規登録の通知メールの送信処理を開始する (プロセスで1回のみ。MAILER_ENABLED=0で無効)
+mailer.start()
+
 pages = {
     "各種コンテンツ": [
         st.Page("main_contents.py", title="溶射電極状況表示", icon="📈"),
@@ -19,6 +31,7 @@ pages = {
             icon="🚚",
         ),
         st.Page("order_management_linde.py", title="受注管理 (Linde様専用)", icon="📝"),
+        st.Page("analytics.py", title="分析ダッシュボード", icon="📊"),
     ],
     "アカウント管理": [
         st.Page("sign_in.py", title="サインイン／サインアップ", icon="🏠"),
@@ -29,4 +42,8 @@ pages = {
 }
 
 pg = st.navigation(pages, position="top")
-pg.run()
+# 別のページに移動した場合は、前のページで投入した先読みを取り消す
+prefetch.set_current_page(pg.title)
+metrics.count_rerun(pg.title)
+# 管理者が ?profile=1 で有効にしたセッションのみ、再実行をプロファイルする
+profiler.run(pg.run)
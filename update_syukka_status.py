@@ -2,7 +2,9 @@ import streamlit as st
 from datetime import datetime
 import time
 import polars as pl
+import metrics
 from util import (
+    advisory_lock_query,
     get_db_engine,
     supabase_read_sql,
     supabase_execute_sql,
@@ -82,7 +84,7 @@ def main():
                     st.dataframe(updatable_df, width="stretch")
                     if not_updatable_df.is_empty() == False:
                         st.warning(
-                            f"更新出来ないデータが{ not_updatable_df.shape(0) }件あります。"
+                            f"更新出来ないデータが{not_updatable_df.height}件あります。"
                         )
                         st.dataframe(not_updatable_df, width="stretch")
                     if updatable_df.is_empty() == False:
@@ -104,47 +106,38 @@ def fetch_electrode_status_list(update_df: pl.DataFrame) -> pl.DataFrame:
     Args:
         update_df (pl.DataFrame): 読み込んだ出荷シリアルデータ
     Returns:
-        pl.DataFrame: 更新対象のデータ
+        pl.DataFrame: 出荷シリアルデータに、電極状況表に存在するかどうかの列(exists)を追加したデータ
     """
-    # schema_dict = {
-    #     "giga_order_num": pl.String,
-    #     "edaban": pl.Int32,
-    #     "exists": pl.Boolean,
-    # }
-    exists_df = pl.DataFrame()
-    for row in update_df.to_dicts():
-        try:
-            params = {
-                "giga_order_num": row["giga_order_num"],
-                "edaban": row["edaban"],
-            }
-        except Exception as e:
-            st.error(f"更新対象のデータの取得中にエラーが発生しました: {e}")
-            return pl.DataFrame()
+    try:
+        keys_json = update_df.select("giga_order_num", "edaban").write_json()
+    except Exception as e:
+        st.error(f"更新対象のデータの取得中にエラーが発生しました: {e}")
+        return pl.DataFrame()
 
-        query = """
-SELECT
-    es.id,
-    es.item_code
+    # ファイルのすべての行を1回のクエリで照合する (アーカイブに移した出荷済みの行を含む)
+    query = """
+SELECT DISTINCT
+    es.giga_order_num,
+    es.edaban
 FROM
-    public.electrode_status es
-WHERE
-    es.giga_order_num = :giga_order_num
-    AND es.edaban = :edaban
+    jsonb_populate_recordset(NULL::public.electrode_status, CAST(:keys AS jsonb)) AS u
+    JOIN public.electrode_status_all es
+        ON es.giga_order_num = u.giga_order_num
+        AND es.edaban = u.edaban
 """
-        result_df = supabase_read_sql(query, parameters=params)
-        if result_df.is_empty() == False:
-            dict_exists = {
-                "giga_order_num": row["giga_order_num"],
-                "edaban": row["edaban"],
-                "exists": True,
-            }
-            exists_df = pl.concat([exists_df, pl.DataFrame([dict_exists])])
+    result_df = supabase_read_sql(query, parameters={"keys": keys_json})
+    if result_df.is_empty():
+        return update_df.with_columns(pl.lit(False).alias("exists"))
     try:
-        updatable_df = update_df.join(
-            exists_df, on=["giga_order_num", "edaban"], how="inner"
+        # ファイルの列の型(数値のギガ注番など)に合わせて照合する
+        exists_df = result_df.select(
+            pl.col("giga_order_num").cast(update_df.schema["giga_order_num"]),
+            pl.col("edaban").cast(update_df.schema["edaban"]),
+            pl.lit(True).alias("exists"),
         )
-        return updatable_df
+        return update_df.join(
+            exists_df, on=["giga_order_num", "edaban"], how="left"
+        ).with_columns(pl.col("exists").fill_null(False))
     except Exception as e:
         st.error(f"更新対象のデータの取得中にエラーが発生しました: {e}")
         return pl.DataFrame()
@@ -152,35 +145,61 @@ WHERE
 
 def update_electrode_status_list(update_df: pl.DataFrame) -> bool:
     """読み込んだ出荷シリアルデータを元に電極状況表を更新
+    同じギガ注番を含むファイルを同時に更新した場合は、ギガ注番ごとのアドバイザリロックで順番に実行する。
+    アーカイブ(electrode_status_archive)に移した行も同じトランザクションで更新する。
     Args:
         update_df (pl.DataFrame): 読み込んだ出荷シリアルデータ
     Returns:
         bool: 更新結果の真偽値(True: 成功, False: 失敗)
     """
-    queries = []
-    for row in update_df.to_dicts():
-
-        # 各種属性のパラメータの格納
-        params = {
-            "giga_order_num": row["giga_order_num"],
-            "shiped_date": row["shiped_date"],
-            "sirial_num": row["sirial_num"],
-            "edaban": row["edaban"],
-        }
-
-        # 更新用クエリ
-        query = """
-UPDATE public.electrode_status
-SET shiped_date = :shiped_date,
-    sirial_num = :sirial_num,
+    rows_json = update_df.select(
+        "giga_order_num", "edaban", "shiped_date", "sirial_num"
+    ).write_json()
+
+    # 更新用クエリ (ファイルのすべての行を1回のUPDATEで更新する)
+    # 列の型はelectrode_statusの定義に合わせて変換される
+    update_sql = """
+UPDATE public.{table} es
+SET shiped_date = u.shiped_date,
+    sirial_num = u.sirial_num,
     status = 'OK',
     update_dt = now()
-WHERE 
-    public.electrode_status.giga_order_num = :giga_order_num
-    AND public.electrode_status.edaban = :edaban
+FROM
+    jsonb_populate_recordset(NULL::public.electrode_status, CAST(:rows AS jsonb)) AS u
+WHERE
+    es.giga_order_num = u.giga_order_num
+    AND es.edaban = u.edaban
 """
-        queries.append({"sql": query, "params": params})
+    # アーカイブの行の出荷実績日を別の年に変える場合に、移動先のパーティションを作成する
+    ensure_partitions_sql = """
+SELECT public.ensure_electrode_status_archive_partition(y)
+FROM (
+    SELECT DISTINCT extract(year FROM u.shiped_date)::integer AS y
+    FROM
+        jsonb_populate_recordset(NULL::public.electrode_status, CAST(:rows AS jsonb)) AS u
+        JOIN public.electrode_status_archive a
+            ON a.giga_order_num = u.giga_order_num
+            AND a.edaban = u.edaban
+    WHERE u.shiped_date IS NOT NULL
+) years
+"""
+    queries = [
+        # 同じギガ注番を書き込む他のアップロード・受注登録の完了を待つ
+        advisory_lock_query(
+            "electrode_status", update_df["giga_order_num"].unique().to_list()
+        ),
+        {"sql": update_sql.format(table="electrode_status"), "params": {"rows": rows_json}},
+        {"sql": ensure_partitions_sql, "params": {"rows": rows_json}},
+        {
+            "sql": update_sql.format(table="electrode_status_archive"),
+            "params": {"rows": rows_json},
+        },
+    ]
+    started = time.perf_counter()
     result = supabase_execute_sql(queries)
+    metrics.record_upload(
+        "shipment_status", time.perf_counter() - started, update_df.height, result
+    )
     return result
 
 
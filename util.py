@@ -1,11 +1,28 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import polars as pl
-from sqlalchemy import create_engine, exc, text
-import pandas as pd
+from sqlalchemy import exc, text
+from sqlalchemy.sql import Executable
 from collections.abc import Mapping
 from typing import Any
 import os
+import re
+import time
 from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner_utils.script_requests import ScriptRequestType
+from db_pool import (
+    PoolSettings,
+    QueryCancelledError,
+    QueryTimeoutError,
+    apply_statement_timeout,
+    checkout,
+    create_pooled_engine,
+    get_pool_metrics,
+    query_canceller,
+)
+from shared_cache import bump_versions, record_read, set_lookup_bypass
+import metrics
+from statements import registry as statement_registry
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
@@ -20,14 +37,289 @@ postgre_db = os.getenv("POSTGRE_DB")
 # データベース接続文字列
 conn_str = f"postgresql://{postgre_uid}:{postgre_pwd}@{postgre_host}:{postgre_port}/{postgre_db}"
 
+# 読み取り専用レプリカの接続文字列(未設定の場合は全てプライマリで処理する)
+replica_conn_str = os.getenv("POSTGRE_REPLICA_DSN") or None
+# 書き込み後、この秒数の間は同じセッションの読み取りをプライマリで行う(read-your-writes)
+read_your_writes_seconds = float(os.getenv("POSTGRE_READ_YOUR_WRITES_SECONDS", "10"))
+# レプリカの接続に失敗した後、この秒数の間はレプリカを使わない
+replica_retry_seconds = float(os.getenv("POSTGRE_REPLICA_RETRY_SECONDS", "30"))
+
+# 書き込み対象のテーブル名を取得する正規表現 (共有キャッシュの無効化に使用)
+_WRITE_TARGET_PATTERN = re.compile(
+    r"\b(?:INSERT\s+INTO|(?<!DO )UPDATE|DELETE\s+FROM)\s+(?:public\.)?(\w+)", re.IGNORECASE
+)
+
+# セッションで最後に書き込みを行った時刻を保存するキー
+_LAST_WRITE_KEY = "_db_last_write_at"
+# 同じ時刻のUNIX時刻 (スナップショットの作成時刻と比べるため)
+_LAST_WRITE_WALL_KEY = "_db_last_write_wall"
+# ユーザーの権限をセッション内で再利用する秒数 (権限は共有キャッシュに保存しない)
+user_roles_cache_seconds = float(os.getenv("USER_ROLES_CACHE_SECONDS", "10"))
+# セッションに保存したユーザーの権限のキー
+_USER_ROLES_KEY = "_user_roles_cache"
+# レプリカの利用を再開する時刻(プロセス全体で共有)
+_replica_down_until = 0.0
+
 
 @st.cache_resource
 def get_db_engine(conn_string: str):
     """SQLAlchemyのエンジンを作成し、キャッシュする"""
-    # pool_pre_ping=True は、プールから接続を取得する前に、
-    # その接続がまだ有効かテストするための「ping」を発行します。
-    # これにより、ネットワークの問題やタイムアウトで切断された接続を再利用しようとするのを防ぎます。
-    return create_engine(conn_string, pool_pre_ping=True)
+    # プールサイズ等は.envのPOSTGRE_POOL_*で設定する(db_pool.PoolSettings参照)。
+    # pool_pre_pingはチェックアウト毎に往復が増えるため使わず、
+    # バックグラウンドスレッドによる定期的な死活確認で切断済みの接続を検出する。
+    return create_pooled_engine(conn_string, PoolSettings.from_env())
+
+
+def fetch_pool_metrics(replica: bool = False) -> dict:
+    """コネクションプールの状態(使用中の接続数、待ち回数、接続時間など)を返す
+    Args:
+        replica (bool, optional): レプリカのプールを対象にするかどうか。デフォルトはFalse。
+    """
+    if replica and replica_conn_str is None:
+        return {}
+    engine = get_db_engine(replica_conn_str if replica else conn_str)
+    pool_metrics = get_pool_metrics(engine)
+    if pool_metrics is None:
+        return {}
+    return pool_metrics.snapshot(engine)
+
+
+def _mark_session_write() -> None:
+    """現在のセッションで書き込みを行った時刻を記録する"""
+    st.session_state[_LAST_WRITE_KEY] = time.monotonic()
+    st.session_state[_LAST_WRITE_WALL_KEY] = time.time()
+
+
+def session_wrote_recently() -> bool:
+    """現在のセッションがread-your-writesの期間内に書き込みを行ったかどうかを返す"""
+    # セッションの外(バックグラウンドのスレッドなど)では書き込みの記録はない
+    if get_script_run_ctx() is None:
+        return False
+    last_write_at = st.session_state.get(_LAST_WRITE_KEY)
+    if last_write_at is None:
+        return False
+    return time.monotonic() - last_write_at <= read_your_writes_seconds
+
+
+def session_wrote_since(timestamp: float) -> bool:
+    """
+    現在のセッションが指定した時刻以降に書き込みを行ったかどうかを返す
+    スナップショットはレプリカから作成される場合があるため、書き込みからread-your-writesの期間内に
+    作成されたものも書き込みを含まないとみなす。
+    Args:
+        timestamp (float): UNIX時刻 (スナップショットの作成時刻など)
+    """
+    if get_script_run_ctx() is None:
+        return False
+    last_write_wall = st.session_state.get(_LAST_WRITE_WALL_KEY)
+    if last_write_wall is None:
+        return False
+    return timestamp < last_write_wall + read_your_writes_seconds
+
+
+# 書き込み直後のセッションは、書き込み前のデータが残っている可能性がある共有キャッシュを参照しない
+set_lookup_bypass(session_wrote_recently)
+
+
+def _set_change_author(connection, is_local: bool = True) -> bool:
+    """
+    変更履歴(migrations/008)に記録する変更者を接続に設定する
+    Args:
+        connection (Connection): 書き込みに使う接続
+        is_local (bool, optional): Trueの場合は現在のトランザクションだけに設定する。
+            Falseの場合は接続(セッション)に設定するため、プールに戻す前にRESETする。
+    Returns:
+        bool: 設定した場合はTrue
+    """
+    # セッションの外(メーラーなどのバックグラウンド処理)では設定せず、接続ユーザー名が記録される
+    if get_script_run_ctx() is None:
+        return False
+    user_email = st.session_state.get("user_email")
+    if not user_email:
+        return False
+    connection.execute(
+        text("SELECT set_config('app.user_email', :user_email, :is_local)"),
+        {"user_email": user_email, "is_local": is_local},
+    )
+    return True
+
+
+def _reset_change_author(connection) -> None:
+    """セッションに設定した変更者を、接続をプールに戻す前に消す"""
+    try:
+        connection.execute(text("RESET app.user_email"))
+    except Exception:
+        # 消せなかった接続は他のユーザーの書き込みに使われないように破棄する
+        connection.invalidate()
+
+
+def _invalidate_written_tables(queries: list[Mapping[str, Any]]) -> None:
+    """書き込み対象のテーブルに依存する共有キャッシュを無効化する"""
+    tables = {
+        table
+        for query in queries
+        for table in _WRITE_TARGET_PATTERN.findall(query["sql"])
+    }
+    bump_versions(tables)
+    # 自分の権限・ユーザー名の変更はすぐに反映する
+    if "user_roles" in tables and get_script_run_ctx() is not None:
+        st.session_state.pop(_USER_ROLES_KEY, None)
+
+
+def _use_replica() -> bool:
+    """読み取りをレプリカに振り分けるかどうかを判定する"""
+    if replica_conn_str is None or time.monotonic() < _replica_down_until:
+        return False
+    return not session_wrote_recently()
+
+
+def _mark_replica_down() -> None:
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + replica_retry_seconds
+
+
+def _superseded_check():
+    """現在のスクリプト実行が再実行・停止の要求で置き換えられたかを返す関数を作成する
+
+    Streamlitは再実行の要求を次のst.*の呼び出しまで処理しないため、
+    DBの応答を待っている間はScriptRequestsの状態を直接参照する(内部の属性のため、
+    取得できない場合はキャンセルしない)。セッションの外ではNoneを返す。
+    """
+    ctx = get_script_run_ctx()
+    requests = getattr(ctx, "script_requests", None) if ctx is not None else None
+    if requests is None:
+        return None
+
+    def _superseded() -> bool:
+        state = getattr(requests, "_state", ScriptRequestType.CONTINUE)
+        return state != ScriptRequestType.CONTINUE
+
+    return _superseded
+
+
+def _read_df(
+    conn_string: str,
+    statement: Executable,
+    parameters: dict = None,
+    query_class: str = "interactive",
+) -> pl.DataFrame:
+    engine = get_db_engine(conn_string)
+    with checkout(engine) as connection:
+        apply_statement_timeout(connection, query_class)
+        # 同じセッションの再実行で不要になったクエリはサーバー側でキャンセルし、接続を早く返す
+        with query_canceller.watch(connection, _superseded_check()):
+            # SQLAlchemy Coreのexecuteを使い、結果を直接Polars DataFrameに変換
+            # これにより、:key形式のパラメータが使えるようになる
+            result = connection.execute(statement, parameters)
+            columns = list(result.keys())
+            rows = result.fetchall()
+        # pandasを経由しない (起動時にpandasを読み込まないため)
+        if not rows:
+            # 0件の場合は、これまでどおり文字列の列にする
+            return pl.DataFrame(schema={column: pl.String for column in columns})
+        # 先頭の行がNULLのみの列も型を決められるように、すべての行から型を推定する
+        return pl.DataFrame(
+            rows, schema=columns, orient="row", infer_schema_length=None
+        )
+
+
+def _route_read(
+    statement: Executable,
+    parameters: dict = None,
+    query_class: str = "interactive",
+    primary: bool = False,
+) -> pl.DataFrame:
+    """読み取りをレプリカまたはプライマリに振り分けて実行する(primaryの場合は常にプライマリ)"""
+    if not primary and _use_replica():
+        try:
+            df = _read_df(replica_conn_str, statement, parameters, query_class)
+            record_read("replica")
+            return df
+        except (exc.OperationalError, exc.TimeoutError) as e:
+            print(f"Replica read failed, falling back to primary: {e}")
+            _mark_replica_down()
+    df = _read_df(conn_str, statement, parameters, query_class)
+    record_read("primary")
+    return df
+
+
+def read_sql(
+    query: str, parameters: dict = None, query_class: str = "interactive"
+) -> pl.DataFrame:
+    """SQLクエリを実行し、Polars DataFrameとして返す(画面表示を伴わない版)
+
+    エラーは呼び出し元に送出する。Streamlitの画面外(バックグラウンド処理など)から使用する。
+    Args:
+        query (str): 実行するSQLクエリ
+        parameters (dict, optional): クエリパラメータ。デフォルトはNone。
+        query_class (str, optional): statement_timeoutの種類。デフォルトは"interactive"。
+    Returns:
+        pl.DataFrame: Polarsデータフレーム
+    Raises:
+        QueryTimeoutError: statement_timeoutを超えた場合
+        QueryCancelledError: セッションの再実行によりキャンセルした場合
+    """
+    started = time.perf_counter()
+    rows = None
+    try:
+        df = _route_read(text(query), parameters, query_class)
+        rows = df.height
+        return df
+    finally:
+        metrics.observe_query("adhoc", time.perf_counter() - started, rows)
+
+
+def read_statement(
+    name: str,
+    parameters: dict = None,
+    query_class: str | None = None,
+    primary: bool = False,
+) -> pl.DataFrame:
+    """statementsに登録された名前付きステートメントを実行し、実行時間を記録する
+
+    エラーは呼び出し元に送出する。
+    Args:
+        name (str): ステートメント名
+        parameters (dict, optional): クエリパラメータ。デフォルトはNone。
+        query_class (str, optional): statement_timeoutの種類。デフォルトは登録時の種類。
+        primary (bool, optional): Trueの場合はレプリカを使わずプライマリから読み取る
+            (他のユーザーの直前の書き込みを見落とせない確認に使う)。デフォルトはFalse。
+    Returns:
+        pl.DataFrame: Polarsデータフレーム
+    """
+    statement = statement_registry.get(name)
+    query_class = query_class or statement_registry.query_class(name)
+    started = time.perf_counter()
+    rows = None
+    try:
+        df = _route_read(statement, parameters, query_class, primary)
+        rows = df.height
+        return df
+    finally:
+        elapsed = time.perf_counter() - started
+        statement_registry.record(name, elapsed, failed=rows is None)
+        metrics.observe_query(name, elapsed, rows)
+
+
+def supabase_read_statement(name: str, parameters: dict = None) -> pl.DataFrame:
+    """名前付きステートメントを実行し、Polars DataFrameとして返す
+    Args:
+        name (str): statementsに登録されたステートメント名
+        parameters (dict, optional): クエリパラメータ。デフォルトはNone。
+    Returns:
+        pl.DataFrame: Polarsデータフレーム
+    """
+    try:
+        return read_statement(name, parameters)
+    except QueryCancelledError:
+        # 再実行で置き換えられたクエリの結果は表示されない
+        return pl.DataFrame()
+    except QueryTimeoutError:
+        _show_timeout_error()
+        return pl.DataFrame()
+    except exc.SQLAlchemyError as e:
+        st.error(f"データベースからのデータ取得中にエラーが発生しました: {e}")
+        return pl.DataFrame()
 
 
 def supabase_read_sql(query: str, parameters: dict = None) -> pl.DataFrame:
@@ -37,23 +329,65 @@ def supabase_read_sql(query: str, parameters: dict = None) -> pl.DataFrame:
         parameters (dict, optional): クエリパラメータ。デフォルトはNone。
     Returns:
         pl.DataFrame: Polarsデータフレーム
+
+    POSTGRE_REPLICA_DSNが設定されている場合はレプリカから読み取る。
+    ただし同じセッションで直前に書き込みを行った場合と、レプリカに接続できない場合はプライマリから読み取る。
     """
     try:
-        engine = get_db_engine(conn_str)
-        with engine.connect() as connection:
-            # SQLAlchemy Coreのexecuteを使い、結果を直接Polars DataFrameに変換
-            # これにより、:key形式のパラメータが使えるようになる
-            result = connection.execute(text(query), parameters)
-            pandas_df = pd.DataFrame(result.fetchall(), columns=result.keys())
-            df = pl.from_pandas(pandas_df)
-            return df
+        return read_sql(query, parameters)
+    except QueryCancelledError:
+        # 再実行で置き換えられたクエリの結果は表示されない
+        return pl.DataFrame()
+    except QueryTimeoutError:
+        _show_timeout_error()
+        return pl.DataFrame()
     except exc.SQLAlchemyError as e:
         st.error(f"データベースからのデータ取得中にエラーが発生しました: {e}")
         return pl.DataFrame()
 
 
+def _show_timeout_error() -> None:
+    st.error(
+        "データの取得に時間がかかりすぎたため中断しました。"
+        "条件を絞り込むか、しばらくしてから再度お試しください。"
+    )
+
+
+def advisory_lock_query(namespace: str, keys: list[str]) -> dict:
+    """
+    キーごとのトランザクション単位のアドバイザリロックを取得するクエリを返す
+    supabase_execute_sqlのqueriesの先頭に置くと、同じキーを書き込むトランザクションが直列に実行される
+    (ロックはトランザクションの終了時に解放されるため、use_transaction=Trueで使用する)。
+    キーは常に同じ順序で取得するため、複数のキーを取得するトランザクション同士でもデッドロックしない。
+    Args:
+        namespace (str): キーの種類 (例: "electrode_status")
+        keys (list[str]): ロックするキー (例: ギガ注番のリスト)
+    Returns:
+        dict: {"sql": str, "params": dict} の形式のクエリ
+    """
+    sql = """
+    SELECT pg_advisory_xact_lock(hashtextextended(CAST(:namespace AS text) || ':' || k, 0))
+    FROM unnest(CAST(:keys AS text[])) AS k
+    GROUP BY k
+    ORDER BY k
+    """
+    return {
+        "sql": sql,
+        "params": {"namespace": namespace, "keys": [str(key) for key in keys]},
+    }
+
+
+def _count_written_rows(sql: str, result, written: dict[str, int]) -> None:
+    """書き込みクエリの対象テーブルごとに、変更した行数を加算する"""
+    tables = _WRITE_TARGET_PATTERN.findall(sql)
+    if tables and result.rowcount > 0:
+        written[tables[0]] = written.get(tables[0], 0) + result.rowcount
+
+
 def supabase_execute_sql(
-    queries: list[Mapping[str, Any]], use_transaction: bool = True
+    queries: list[Mapping[str, Any]],
+    use_transaction: bool = True,
+    row_counts: list[int] | None = None,
 ) -> bool:
     """SupabaseのPostgreSQLデータベースにSQLクエリを実行する
     Args:
@@ -61,6 +395,7 @@ def supabase_execute_sql(
             各要素は {"sql": str, "params": dict} の形式の辞書。
             "params"キーはオプショナル。
         use_transaction (bool, optional): トランザクションを使用するかどうか。デフォルトはTrue。
+        row_counts (list[int] | None, optional): 指定した場合、クエリごとの変更行数(rowcount)を順に追加する。
     Returns:
         bool: クエリが成功したかどうかを示すブール値
 
@@ -71,29 +406,57 @@ def supabase_execute_sql(
             msg = f"Invalid query format at index {i}. Each query must be a dict with a 'sql' key."
             st.error(msg)
             return False
+    # テーブルごとの書き込み行数 (メトリクス用)
+    written: dict[str, int] = {}
     try:
         engine = get_db_engine(conn_str)
-        with engine.connect() as connection:
+        with checkout(engine) as connection:
             if use_transaction:
                 with connection.begin():  # トランザクションを開始
+                    apply_statement_timeout(connection, "write")
+                    _set_change_author(connection)
                     for query in queries:
                         sql = query["sql"]
                         params = query.get("params")
-                        connection.execute(text(sql), params)
+                        result = connection.execute(text(sql), params)
+                        _count_written_rows(sql, result, written)
+                        if row_counts is not None:
+                            row_counts.append(result.rowcount)
             else:
                 # 自動コミットモードで実行
                 conn_autocommit = connection.execution_options(
                     isolation_level="AUTOCOMMIT"
                 )
-                for query in queries:
-                    sql = query["sql"]
-                    params = query.get("params")
-                    conn_autocommit.execute(text(sql), params)
+                # 変更者は文ごとのトランザクションに引き継がれないため、セッションに設定する
+                author_set = _set_change_author(conn_autocommit, is_local=False)
+                try:
+                    for query in queries:
+                        sql = query["sql"]
+                        params = query.get("params")
+                        result = conn_autocommit.execute(text(sql), params)
+                        _count_written_rows(sql, result, written)
+                        if row_counts is not None:
+                            row_counts.append(result.rowcount)
+                finally:
+                    if author_set:
+                        _reset_change_author(conn_autocommit)
 
-        print(f"All {len(queries)} queries executed successfully.")
+        # 書き込み直後の読み取りはプライマリで行う(read-your-writes)
+        _mark_session_write()
+        _invalidate_written_tables(queries)
+        for table, rows in written.items():
+            metrics.rows_written.inc(rows, table=table)
+        metrics.write_transactions.inc(result="ok")
         return True
     except Exception as e:
         # 接続エラーや実行エラーが発生した場合、トランザクションは自動的にロールバックされる
+        # (自動コミットモードでは途中までの書き込みが残るため、書き込みとして記録する)
+        _mark_session_write()
+        if not use_transaction:
+            _invalidate_written_tables(queries)
+            for table, rows in written.items():
+                metrics.rows_written.inc(rows, table=table)
+        metrics.write_transactions.inc(result="error")
         failed_sql = getattr(e, "statement", "N/A")
         failed_params = getattr(e, "params", "N/A")
         st.error(
@@ -106,7 +469,29 @@ def supabase_execute_sql(
 def fetch_user_roles(email: str) -> pl.DataFrame:
     """
     user_rolesテーブルからデータを取得し、Polars DataFrameとして返す
+    認証・権限の判定に使うため、プロセス間では共有せず、セッション内で
+    USER_ROLES_CACHE_SECONDS秒の間だけ再利用する(権限の取り消しはこの秒数以内に反映される)。
     """
+    if get_script_run_ctx() is None:
+        return _query_user_roles(email)
+    cached = st.session_state.get(_USER_ROLES_KEY)
+    now = time.monotonic()
+    if (
+        cached is not None
+        and cached["email"] == email
+        and now - cached["fetched_at"] <= user_roles_cache_seconds
+    ):
+        return cached["df"]
+    user_roles_df = _query_user_roles(email)
+    st.session_state[_USER_ROLES_KEY] = {
+        "email": email,
+        "fetched_at": now,
+        "df": user_roles_df,
+    }
+    return user_roles_df
+
+
+def _query_user_roles(email: str) -> pl.DataFrame:
 
     query = """
 SELECT
@@ -0,0 +1,133 @@
+"""サーバー起動時のウォームアップ
+
+再起動後の最初のリクエストが、エンジンの作成・最初のTLS接続・Supabaseクライアントの作成・
+キャッシュの読み込みをまとめて負担しないように、起動時にバックグラウンドで実行しておく。
+st.cache_resourceとshared_cacheはプロセス全体で共有されるため、ここで作成したものを
+各セッションがそのまま使う。
+
+起動方法:
+    python warmup.py [streamlit runのオプション]   # ウォームアップを開始してからサーバーを起動する
+    streamlit run streamlit_app.py                  # 最初のリクエスト時にウォームアップを開始する
+"""
+
+import os
+import sys
+import threading
+import time
+
+# 0の場合、ウォームアップを行わない
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# 先読みする品目 (カンマ区切り)。未指定の場合は未出荷の受注が多い品目を使用する
+WARMUP_ITEMS = [item for item in os.getenv("WARMUP_ITEMS", "").split(",") if item]
+# WARMUP_ITEMSが未指定の場合に先読みする品目数
+WARMUP_HOT_ITEMS = int(os.getenv("WARMUP_HOT_ITEMS", "5"))
+
+_lock = threading.Lock()
+_started = False
+
+
+def start() -> bool:
+    """
+    ウォームアップをバックグラウンドのスレッドで開始する(プロセスで1回のみ)
+    Returns:
+        bool: このプロセスで初めて開始した場合はTrue
+    """
+    global _started
+    with _lock:
+        if _started or not WARMUP_ENABLED:
+            return False
+        _started = True
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return True
+
+
+def run() -> dict[str, float]:
+    """
+    ウォームアップの各手順を実行し、所要時間(秒)をログに出力する
+    失敗した手順は出力して次の手順に進む(最初のリクエストで改めて実行される)。
+    Returns:
+        dict[str, float]: 手順ごとの所要時間
+    """
+    timings = {}
+
+    def step(name, func):
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            print(f"Warm-up step '{name}' failed: {e}")
+            result = None
+        timings[name] = time.perf_counter() - started
+        return result
+
+    started = time.perf_counter()
+    step("connections", _open_pool_connections)
+    step("supabase_client", _init_supabase_client)
+    item_codes = step("item_codes", _load_item_codes) or []
+    hot_items = step("hot_items", lambda: _select_hot_items(item_codes)) or []
+    step("item_frames", lambda: _load_item_frames(hot_items))
+    timings["total"] = time.perf_counter() - started
+
+    print(
+        "Warm-up finished: "
+        + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items())
+        + f" (hot items: {len(hot_items)})"
+    )
+    return timings
+
+
+def _open_pool_connections() -> None:
+    from db_pool import PoolSettings, open_connections
+    from util import conn_str, get_db_engine, replica_conn_str
+
+    pool_min = PoolSettings.from_env().pool_min
+    for conn_string in filter(None, [conn_str, replica_conn_str]):
+        open_connections(get_db_engine(conn_string), pool_min)
+
+
+def _init_supabase_client() -> None:
+    # Supabase SDKの読み込みとクライアントの作成(st.cache_resource)を先に済ませておく
+    import sign_in
+
+    sign_in.init_supabase_client(sign_in.supabase_url, sign_in.supabase_key)
+
+
+def _load_item_codes() -> list[str]:
+    import main_contents
+
+    return main_contents.fetch_item_list()
+
+
+def _select_hot_items(item_codes: list[str]) -> list[str]:
+    if WARMUP_ITEMS:
+        return WARMUP_ITEMS
+    from util import read_statement
+
+    hot_df = read_statement(
+        "warmup_hot_items",
+        parameters={"limit": WARMUP_HOT_ITEMS},
+        query_class="background",
+    )
+    known = set(item_codes)
+    return [item for item in hot_df["品目"].to_list() if not known or item in known]
+
+
+def _load_item_frames(item_codes: list[str]) -> None:
+    import main_contents
+
+    if item_codes:
+        main_contents.warm_electrode_status(item_codes)
+
+
+def main():
+    """ウォームアップを開始してから、同じプロセスでStreamlitのサーバーを起動する"""
+    from streamlit.web import cli as stcli
+
+    start()
+    sys.argv = ["streamlit", "run", "streamlit_app.py", *sys.argv[1:]]
+    sys.exit(stcli.main())
+
+
+if __name__ == "__main__":
+    main()